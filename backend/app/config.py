@@ -17,6 +17,39 @@ class Settings(BaseModel):
     ENABLE_RATE_LIMITING: bool = Field(default=False)  # Set to True in production
     DEFAULT_DOCTOR_ID: str = Field(default="691994fd596a2deacfefb623")  # For dev environment
 
+    # X-ray inference: gom request đồng thời thành 1 batch predict
+    XRAY_BATCHING: bool = Field(default=True)
+    XRAY_BATCH_MAX_SIZE: int = Field(default=8)
+    XRAY_BATCH_MAX_WAIT_MS: int = Field(default=25)
+    XRAY_BATCH_MAX_FILES: int = Field(default=200)  # giới hạn ảnh cho /predict-batch
+    XRAY_BATCH_MAX_FILE_BYTES: int = Field(default=20 * 1024 * 1024)    # mỗi ảnh sau giải nén
+    XRAY_BATCH_MAX_TOTAL_BYTES: int = Field(default=200 * 1024 * 1024)  # tổng cả batch sau giải nén
+    # X-ray inference chạy trong process pool (0 = inline, chặn hub eventlet)
+    XRAY_POOL_WORKERS: int = Field(default=2)
+    XRAY_POOL_START_METHOD: str = Field(default="")  # "" = auto (forkserver nếu có, không thì spawn)
+    XRAY_INFER_TIMEOUT: int = Field(default=120)  # giây
+    YOLO_IMGSZ: int = Field(default=640)
+    XRAY_WARMUP_ON_START: bool = Field(default=True)  # preload + dummy inference lúc khởi động
+    XRAY_CACHE_MAX_ENTRIES: int = Field(default=256)  # cache kết quả theo hash ảnh (0 = tắt)
+    XRAY_SAVE_UPLOADS: bool = Field(default=True)  # lưu ảnh upload gốc vào upload/xray
+    XRAY_WRITE_BEHIND: bool = Field(default=True)  # encode JPEG + insert DB chạy nền sau response
+    # Tiled inference cho film lớn (sliding window + NMS giữa các tile)
+    XRAY_TILED_MAX_SIZE: int = Field(default=2048)  # cạnh dài tối đa khi chạy tiled (thay MAX_IMAGE_SIZE)
+    XRAY_TILE_AUTO_MIN: int = Field(default=0)  # tự bật tiled khi cạnh dài ảnh gốc >= giá trị này (0 = tắt)
+    XRAY_TILE_SIZE: int = Field(default=0)  # 0 = dùng imgsz
+    XRAY_TILE_OVERLAP: float = Field(default=0.2)
+    XRAY_TILE_INCLUDE_FULL: bool = Field(default=True)
+    # Backend inference: "torch" (Ultralytics eager) | "onnx" (ONNX Runtime, export best.onnx 1 lần)
+    YOLO_BACKEND: str = Field(default="torch")
+    ONNX_INTRA_OP_THREADS: int = Field(default=0)  # 0 = để onnxruntime tự chọn
+    ONNX_PROVIDERS: str = Field(default="CPUExecutionProvider")
+    # LLM provider theo use case: "gemini" | "local" (OpenAI-compatible tại LMSTUDIO_URL) | "fake"
+    LLM_DEFAULT_PROVIDER: str = Field(default="gemini")
+    LLM_ROUTES: str = Field(default="")  # vd "suggestions=local,summary=local,doctor_advisor=gemini"
+    LMSTUDIO_MODEL: str = Field(default="local-model")
+    LMSTUDIO_TIMEOUT: int = Field(default=60)  # giây
+    FAKE_LLM_LATENCY_MS: int = Field(default=0)  # độ trễ giả lập cho benchmark
+
     def model_abs_path(self) -> Path:
         """
         Trả về đường dẫn tuyệt đối tới file model.
@@ -36,6 +69,33 @@ def get_settings() -> Settings:
         LMSTUDIO_URL=os.getenv("LMSTUDIO_URL", "http://127.0.0.1:1234"),
         LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO"),
         MAX_IMAGE_SIZE=int(os.getenv("MAX_IMAGE_SIZE", "1024")),
+        XRAY_BATCHING=os.getenv("XRAY_BATCHING", "True").lower() == "true",
+        XRAY_BATCH_MAX_SIZE=int(os.getenv("XRAY_BATCH_MAX_SIZE", "8")),
+        XRAY_BATCH_MAX_WAIT_MS=int(os.getenv("XRAY_BATCH_MAX_WAIT_MS", "25")),
+        XRAY_BATCH_MAX_FILES=int(os.getenv("XRAY_BATCH_MAX_FILES", "200")),
+        XRAY_BATCH_MAX_FILE_BYTES=int(os.getenv("XRAY_BATCH_MAX_FILE_BYTES", str(20 * 1024 * 1024))),
+        XRAY_BATCH_MAX_TOTAL_BYTES=int(os.getenv("XRAY_BATCH_MAX_TOTAL_BYTES", str(200 * 1024 * 1024))),
+        XRAY_POOL_WORKERS=int(os.getenv("XRAY_POOL_WORKERS", "2")),
+        XRAY_POOL_START_METHOD=os.getenv("XRAY_POOL_START_METHOD", ""),
+        XRAY_INFER_TIMEOUT=int(os.getenv("XRAY_INFER_TIMEOUT", "120")),
+        YOLO_IMGSZ=int(os.getenv("YOLO_IMGSZ", "640")),
+        XRAY_WARMUP_ON_START=os.getenv("XRAY_WARMUP_ON_START", "True").lower() == "true",
+        XRAY_CACHE_MAX_ENTRIES=int(os.getenv("XRAY_CACHE_MAX_ENTRIES", "256")),
+        XRAY_SAVE_UPLOADS=os.getenv("XRAY_SAVE_UPLOADS", "True").lower() == "true",
+        XRAY_WRITE_BEHIND=os.getenv("XRAY_WRITE_BEHIND", "True").lower() == "true",
+        XRAY_TILED_MAX_SIZE=int(os.getenv("XRAY_TILED_MAX_SIZE", "2048")),
+        XRAY_TILE_AUTO_MIN=int(os.getenv("XRAY_TILE_AUTO_MIN", "0")),
+        XRAY_TILE_SIZE=int(os.getenv("XRAY_TILE_SIZE", "0")),
+        XRAY_TILE_OVERLAP=float(os.getenv("XRAY_TILE_OVERLAP", "0.2")),
+        XRAY_TILE_INCLUDE_FULL=os.getenv("XRAY_TILE_INCLUDE_FULL", "True").lower() == "true",
+        YOLO_BACKEND=os.getenv("YOLO_BACKEND", "torch").lower(),
+        ONNX_INTRA_OP_THREADS=int(os.getenv("ONNX_INTRA_OP_THREADS", "0")),
+        ONNX_PROVIDERS=os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider"),
+        LLM_DEFAULT_PROVIDER=os.getenv("LLM_DEFAULT_PROVIDER", "gemini").lower(),
+        LLM_ROUTES=os.getenv("LLM_ROUTES", ""),
+        LMSTUDIO_MODEL=os.getenv("LMSTUDIO_MODEL", "local-model"),
+        LMSTUDIO_TIMEOUT=int(os.getenv("LMSTUDIO_TIMEOUT", "60")),
+        FAKE_LLM_LATENCY_MS=int(os.getenv("FAKE_LLM_LATENCY_MS", "0")),
     )
 
 # Email Configuration - Use environment variables
@@ -8,6 +8,7 @@ from datetime import datetime
 import logging
 import os  # ✅ Add os import
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 # Extensions
 from app.extensions import mongo_db, socketio  # socketio instance dùng chung
@@ -236,6 +237,13 @@ def create_app() -> Flask:
         except Exception as e:
             logging.getLogger(__name__).warning(f"Dev auto-fix failed: {e}")
     
+    # ============================================
+    # YOLO WARM-UP: load model + dummy inference, bật cờ /api/health/ready
+    # ============================================
+    if settings.XRAY_WARMUP_ON_START:
+        from app.services.yolo_executor import warmup as yolo_warmup
+        socketio.start_background_task(yolo_warmup)
+
     # ============================================
     # BACKGROUND TASKS: Data integrity checks
     # ============================================
@@ -291,6 +299,11 @@ def handle_join_room(data):
         print("⚠️ No room specified in join_room event")
         return
 
+    if str(room).startswith("xray_batch:"):
+        # room kết quả X-quang chỉ join qua `join_xray_batch` (có kiểm tra join_key)
+        emit("system", {"message": "Dùng event join_xray_batch"}, room=request.sid)
+        return
+
     join_room(room)
     print(f"🚪 Client {request.sid} joined room: {room}")
     emit("system", {"message": f"Joined room {room}"}, room=request.sid)
@@ -371,10 +384,11 @@ def handle_message(data):
     )
 
     # Update conversation metadata
-    mongo_db.conversations.update_one(
+    conv = mongo_db.conversations.find_one_and_update(
         {"_id": conv_oid},
         {"$set": {"updated_at": now, "last_message": text}},
         upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
 
     # Emit to room
@@ -388,6 +402,10 @@ def handle_message(data):
     emit("receive_message", payload, room=room_name)
     emit("new_message", payload, broadcast=True)
 
+    # Tính trước gợi ý trả lời cho người nhận (đẩy qua event `chat_suggestions`)
+    from app.services.smart_replies import schedule_smart_replies, next_roles
+    schedule_smart_replies(conv_id_str, next_roles(sender, conv))
+
     # AI auto-reply DISABLED - use POST /chat/ai endpoint instead
 
 @socketio.on("typing")
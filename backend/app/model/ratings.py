@@ -2,6 +2,7 @@
 from datetime import datetime
 from bson import ObjectId
 from app.extensions import mongo_db
+from app.services.redis_cache import cache, doctor_tag, TAG_RATINGS
 
 class RatingModel:
     """
@@ -284,6 +285,9 @@ class RatingModel:
         
         print(f"✅ Updated rating stats for doctor {doctor_id}: {avg_rating} ({total_ratings} reviews)")
         
+        # Bỏ cache stats/thẻ bác sĩ (mọi route ghi rating đều đi qua hàm này)
+        cache.invalidate_tags(doctor_tag(doctor_id), TAG_RATINGS)
+        
         return {
             "average_rating": avg_rating,
             "total_ratings": total_ratings,
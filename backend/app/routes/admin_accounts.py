@@ -6,6 +6,7 @@ from flask import Blueprint, request
 
 from app.extensions import mongo_db, socketio
 from app.middlewares.auth import auth_required
+from app.services.redis_cache import cache, doctor_tag
 from app.utils.responses import ok, fail
 
 admin_accounts_bp = Blueprint("admin_accounts_bp", __name__)
@@ -102,6 +103,7 @@ def update_doctor_account_status(doctor_id):
             }
         }
     )
+    cache.invalidate_tags(doctor_tag(oid))
 
     try:
         socketio.emit("doctor_status_changed", {
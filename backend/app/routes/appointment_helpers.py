@@ -1,6 +1,7 @@
 from bson import ObjectId
 from datetime import datetime
 from app.extensions import mongo_db
+from app.services.redis_cache import cache, doctor_tag, TAG_APPOINTMENTS, TAG_STATS
 
 def detect_patient_oid(user_ctx):
     """
@@ -211,3 +212,14 @@ def populate_slot_info(slot_id):
             "time": time_display,  # ✅ Add formatted time field
         }
     return None
+
+
+def invalidate_appointment_caches(doctor_id=None):
+    """
+    Gọi sau mỗi lần ghi appointments: bỏ cache thống kê / danh sách lịch hẹn
+    và cache gắn với bác sĩ liên quan (theo tag, không quét key).
+    """
+    tags = [TAG_APPOINTMENTS, TAG_STATS]
+    if doctor_id:
+        tags.append(doctor_tag(doctor_id))
+    cache.invalidate_tags(*tags)
@@ -21,7 +21,8 @@ from app.services.email_service import (
 from app.services.notification_service import NotificationService  # ✅ Import notification service
 from .appointment_helpers import (
     detect_patient_oid, check_slot_expired, convert_objectids_to_str,
-    populate_doctor_info, populate_patient_info, populate_slot_info
+    populate_doctor_info, populate_patient_info, populate_slot_info,
+    invalidate_appointment_caches
 )
 from .appointment_queries import (
     get_slots_by_doctor_date, check_date_availability,
@@ -292,6 +293,7 @@ def complete_booking():
 
         apt_id = create_appointment(patient_oid, slot, data)
         mark_slot_booked(slot_id, patient_oid, apt_id)
+        invalidate_appointment_caches(slot.get("doctor_id"))
 
         # ✅ Convert date to string format
         slot_date = slot.get("date")
@@ -850,6 +852,8 @@ def cancel_appointment_route(appointment_id):
             except Exception as notif_err:
                 print(f"⚠️ Failed to send cancellation notification to patient: {notif_err}")
         
+        invalidate_appointment_caches(appointment["doctor_id"])
+        
         socketio.emit("appointment_updated", {
             "appointment_id": appointment_id,
             "status": "cancelled",
@@ -1181,6 +1185,8 @@ def reschedule_appointment_route(appointment_id):
         print(f"📋 [reschedule_appointment] Final appointment_id: {new_appointment.get('appointment_id')}")
         print(f"📋 [reschedule_appointment] Final id: {new_appointment.get('id')}")
         
+        invalidate_appointment_caches(new_appointment.get("doctor_id"))
+        
         return success({
             "message": "Đổi lịch khám thành công",
             "old_appointment_id": appointment_id,
@@ -1399,6 +1405,8 @@ def confirm_appointment_route(appointment_id):
         if note:
             response_data["confirm_note"] = note
         
+        invalidate_appointment_caches(doctor_id)
+        
         return success(response_data)
     
     except Exception as e:
@@ -1655,6 +1663,8 @@ def delete_appointment_route(appointment_id):
         if not success_flag:
             return fail(message, 404 if "không tồn tại" in message else 500)
         
+        invalidate_appointment_caches(apt.get("doctor_id"))
+        
         if slot_id:
             mongo_db.time_slots.update_one(
                 {"_id": ObjectId(slot_id)},
@@ -1772,6 +1782,7 @@ def complete_consultation(appointment_id):
             {"_id": apt_oid},
             {"$set": update_data}
         )
+        invalidate_appointment_caches(appointment.get("doctor_id"))
         
         print(f"✅ Appointment {appointment_id} marked as DONE")
         
@@ -6,6 +6,7 @@ from flask_socketio import join_room, leave_room, emit
 from app.extensions import mongo_db, socketio
 from app.utils.responses import ok, fail, success
 from app.middlewares.auth import auth_required
+from app.services.smart_replies import schedule_smart_replies, next_roles
 from app.config import JWT_SECRET_KEY
 import jwt
 
@@ -466,6 +467,7 @@ def post_message():
     room = f"room:{str(conv_oid)}"
     socketio.emit("receive_message", payload, room=room)
     socketio.emit("new_message", payload)
+    schedule_smart_replies(conv_oid, next_roles(role, conv))
     
     # ✅ Send notification to patient when doctor sends message
     if role == "doctor" and conv.get("patient_id"):
@@ -597,6 +599,7 @@ def post_message_to_conversation(conv_id):
     room = f"room:{conv_id}"
     socketio.emit("receive_message", payload, room=room)
     socketio.emit("new_message", payload)
+    schedule_smart_replies(conv_oid, next_roles(role, conv))
     
     # ✅ Send notification to patient when doctor sends message
     if role == "doctor" and conv.get("patient_id"):
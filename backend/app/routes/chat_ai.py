@@ -6,21 +6,39 @@ AI Chat Routes - RESTful Endpoints
 """
 
 from flask import Blueprint, request, g, jsonify
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
 
 from app.extensions import mongo_db, socketio
-from app.utils.responses import success, fail
+from app.utils.responses import success, fail, too_busy
 from app.utils.rate_limiter import limiter, RATE_LIMITS
 from app.middlewares.auth import auth_required
-from app.services.gemini_service import clear_chat_session
+from app.services.gemini_service import clear_chat_session, AIBusyError
 
 # Import các services AI đã tối ưu
 from app.services.ai_patient_advisor import advise_patient
 from app.services.ai_doctor_advisor import advise_doctor, get_doctor_suggestions
+from app.services.smart_replies import schedule_smart_replies, next_roles
 
 chat_ai_bp = Blueprint("chat_ai", __name__)
 
+# Tin user đã lưu nhưng AI chưa trả lời (429/lỗi) → client retry trong khoảng này dùng lại tin cũ
+PENDING_REUSE_WINDOW = timedelta(minutes=10)
+
+
+def _pending_user_message(conv_oid, sender: str, text: str, now: datetime):
+    """Tin user cùng nội dung đang chờ AI (lần gọi trước bị 429) → retry không lưu/emit lại."""
+    return mongo_db.messages.find_one(
+        {
+            "conversation_id": conv_oid,
+            "sender": sender,
+            "text": text,
+            "ai_pending": True,
+            "created_at": {"$gte": now - PENDING_REUSE_WINDOW},
+        },
+        sort=[("created_at", -1)],
+    )
+
 # ==========================================
 # HELPER: Resolve Patient ID
 # ==========================================
@@ -90,7 +108,44 @@ def chat_with_ai():
             clear_chat_session(conv_id)
             print(f"🧹 Cleared AI session for: {conv_id}")
 
-        # 4. Xác định Context & Gọi AI
+        room = f"room:{str(conv_oid)}"
+
+        # 4. Lưu + emit tin nhắn User trước (UI hiện ngay, không chờ AI).
+        #    Đánh dấu ai_pending tới khi AI trả lời: retry sau 429 dùng lại tin này, không lưu/emit lần 2
+        now = datetime.utcnow()
+        user_msg = _pending_user_message(conv_oid, user_role, content.strip(), now)
+        if user_msg is None:
+            user_msg = {
+                "conversation_id": conv_oid,
+                "sender": user_role,
+                "text": content.strip(),
+                "created_at": now,
+                "is_read": True,
+                "ai_pending": True,
+            }
+            mongo_db.messages.insert_one(user_msg)
+            socketio.emit("receive_message", {
+                **user_msg, 
+                "_id": str(user_msg.get("_id", "")), # Jsonify ObjectId
+                "created_at": now.isoformat() + "Z",
+                "conversation_id": str(conv_oid)
+            }, room=room)
+        else:
+            print(f"🔁 Retry: dùng lại tin user đang chờ AI {user_msg['_id']}")
+
+        # 5. Gọi AI - stream từng đoạn qua event `ai_chunk` (cùng message_id với tin cuối)
+        ai_oid = ObjectId()
+        chunk_idx = {"n": 0}
+
+        def _emit_chunk(delta: str):
+            socketio.emit("ai_chunk", {
+                "message_id": str(ai_oid),
+                "conversation_id": str(conv_oid),
+                "index": chunk_idx["n"],
+                "delta": delta,
+            }, room=room)
+            chunk_idx["n"] += 1
+
         ai_response_text = ""
         
         if user_role == "patient":
@@ -101,36 +156,31 @@ def chat_with_ai():
             ai_response_text = advise_patient(
                 user_message=content,
                 conversation_id=str(conv_oid),
-                patient_id=pid
+                patient_id=pid,
+                on_chunk=_emit_chunk,
+                user_message_id=user_msg["_id"],
             )
         else:
             # Fallback cho các role khác (Doctor/Admin chat chơi)
             # Doctor nên dùng route /doctor-advisor để xịn hơn
             from app.services.gemini_service import gemini_chat_streaming
-            ai_response_text = gemini_chat_streaming(str(conv_oid), content)
+            ai_response_text = gemini_chat_streaming(
+                str(conv_oid), content, on_chunk=_emit_chunk, use_case="chat",
+                exclude_message_id=user_msg["_id"],
+            )
 
-        # 5. Lưu tin nhắn vào DB (User + AI)
+        # 6. Lưu câu trả lời hoàn chỉnh của AI
         now = datetime.utcnow()
-        
-        # Save User Message
-        user_msg = {
-            "conversation_id": conv_oid,
-            "sender": user_role,
-            "text": content.strip(),
-            "created_at": now,
-            "is_read": True
-        }
-        mongo_db.messages.insert_one(user_msg)
-
-        # Save AI Response
         ai_msg = {
+            "_id": ai_oid,
             "conversation_id": conv_oid,
             "sender": "ai",
             "text": ai_response_text,
             "created_at": now,
             "is_read": True
         }
-        res_ins = mongo_db.messages.insert_one(ai_msg)
+        mongo_db.messages.insert_one(ai_msg)
+        mongo_db.messages.update_one({"_id": user_msg["_id"]}, {"$unset": {"ai_pending": ""}})
 
         # Update Conversation Metadata
         mongo_db.conversations.update_one(
@@ -138,20 +188,9 @@ def chat_with_ai():
             {"$set": {"updated_at": now, "last_message": ai_response_text[:100]}}
         )
 
-        # 6. Emit Socket.IO (Realtime update UI)
-        room = f"room:{str(conv_oid)}"
-        
-        # Emit User msg (để UI sync nếu cần)
-        socketio.emit("receive_message", {
-            **user_msg, 
-            "_id": str(user_msg.get("_id", "")), # Jsonify ObjectId
-            "created_at": now.isoformat() + "Z",
-            "conversation_id": str(conv_oid)
-        }, room=room)
-        
-        # Emit AI msg
+        # 7. Emit AI msg hoàn chỉnh (UI thay thế phần đã stream theo message_id)
         ai_payload = {
-            "message_id": str(res_ins.inserted_id),
+            "message_id": str(ai_oid),
             "conversation_id": str(conv_oid),
             "sender": "ai",
             "text": ai_response_text,
@@ -159,9 +198,12 @@ def chat_with_ai():
             "created_at": now.isoformat() + "Z"
         }
         socketio.emit("receive_message", ai_payload, room=room)
+        schedule_smart_replies(conv_oid, next_roles("ai"))
 
         return success(data=ai_payload, status_code=201)
 
+    except AIBusyError as e:
+        return too_busy(e.message, e.retry_after)
     except Exception as e:
         print(f"❌ AI Chat Error: {e}")
         return fail(f"Lỗi xử lý AI: {str(e)}", 500)
@@ -211,8 +253,8 @@ def doctor_advisor_chat():
         full_context_for_suggestion = f"Q: {message}\nA: {ai_response}"
         suggestions = get_doctor_suggestions(full_context_for_suggestion)
 
-        # 4. Return JSON (Không cần save DB conversation nếu chỉ là tool tra cứu nhanh)
-        # Nếu muốn lưu lịch sử tra cứu, bạn có thể thêm logic insert DB ở đây giống route trên.
+        # 4. Return JSON (Không save DB: tool tra cứu nhanh; ngữ cảnh các lượt trước nằm trong RAM
+        #    theo conversation_id — session Gemini hoặc provider_turns — mất khi restart/hết TTL)
         
         return success(data={
             "conversation_id": conv_id,
@@ -220,6 +262,8 @@ def doctor_advisor_chat():
             "suggestions": suggestions
         })
 
+    except AIBusyError as e:
+        return too_busy(e.message, e.retry_after)
     except Exception as e:
         print(f"❌ Doctor Advisor Error: {e}")
         return fail(f"Lỗi trợ lý bác sĩ: {str(e)}", 500)
\ No newline at end of file
@@ -5,16 +5,60 @@ Endpoint để lấy gợi ý câu hỏi từ AI
 """
 
 from flask import Blueprint, request, g
+from bson import ObjectId
 import re
 
-from app.utils.responses import ok
+from app.extensions import mongo_db
+from app.utils.responses import ok, fail
 from app.middlewares.auth import auth_required
+from app.routes.chat import can_access_conversation
 from app.services.ai_patient_advisor import get_patient_suggestions
 from app.services.ai_doctor_advisor import get_doctor_suggestions
+from app.services.smart_replies import build_suggestion_context, get_smart_replies, ensure_smart_replies
 
 chat_suggestions_bp = Blueprint("chat_suggestions", __name__)
 
 
+@chat_suggestions_bp.get("/chat/suggestions")
+@auth_required()
+def get_precomputed_suggestions():
+    """
+    Gợi ý đã tính sẵn ở nền (sau mỗi tin nhắn) cho hội thoại
+    GET /api/chat/suggestions?conversation_id=...
+    
+    Response: {
+        "suggestions": [...],
+        "precomputed": true/false,   // false → danh sách fallback, gợi ý thật sẽ tới qua socket `chat_suggestions`
+        "pending": true/false,
+        "role": "patient" | "doctor"
+    }
+    """
+    user_role = (g.current_user.get("role") or "").lower()
+    conv_id = request.args.get("conversation_id") or request.args.get("conv_id")
+
+    # Gợi ý sinh từ nội dung hội thoại → chỉ người tham gia mới được xem / kích hoạt tính
+    if conv_id:
+        try:
+            conv = mongo_db.conversations.find_one({"_id": ObjectId(conv_id)})
+        except Exception:
+            return fail("conversation_id không hợp lệ", 400)
+        if not can_access_conversation(conv, user_role, g.current_user.get("user_id")):
+            return fail("Không có quyền truy cập cuộc trò chuyện", 403)
+    
+    cached = get_smart_replies(conv_id, user_role) if conv_id else None
+    if cached:
+        return ok({**cached, "precomputed": True, "pending": False})
+    
+    pending = ensure_smart_replies(conv_id, user_role) if conv_id else False
+    return ok({
+        "suggestions": get_fallback_suggestions(user_role),
+        "context_used": False,
+        "role": user_role,
+        "precomputed": False,
+        "pending": pending
+    })
+
+
 @chat_suggestions_bp.post("/chat/suggestions")
 @auth_required()
 def get_ai_suggestions():
@@ -40,17 +84,21 @@ def get_ai_suggestions():
         b = request.get_json(silent=True) or {}
         conversation_messages = b.get("messages", [])
         
-        # Build context from recent messages
-        context_text = ""
-        if conversation_messages and len(conversation_messages) > 0:
-            context_lines = []
-            for msg in conversation_messages[-3:]:  # Last 3 messages only
-                role = msg.get("role", "")
-                text = msg.get("text", "").strip()
-                if text and len(text) > 5:  # Skip very short messages
-                    role_label = "Bác sĩ" if role == "doctor" else "Bệnh nhân" if role == "patient" else "AI"
-                    context_lines.append(f"{role_label}: {text}")
-            context_text = "\n".join(context_lines) if context_lines else ""
+        # Đã tính sẵn ở nền cho hội thoại này → trả luôn, không gọi AI
+        conv_id = b.get("conversation_id")
+        if conv_id:
+            try:
+                conv = mongo_db.conversations.find_one({"_id": ObjectId(conv_id)})
+            except Exception:
+                conv = None
+            if not can_access_conversation(conv, user_role, user_claims.get("user_id")):
+                conv_id = None  # không phải người tham gia → bỏ qua gợi ý tính sẵn
+        cached = get_smart_replies(conv_id, user_role) if conv_id else None
+        if cached:
+            return ok({**cached, "precomputed": True})
+        
+        # Build context from recent messages (last 3 only)
+        context_text = build_suggestion_context(conversation_messages or [])
         
         print(f"🎯 Getting suggestions for {user_role} | Context: {len(context_text)} chars")
         
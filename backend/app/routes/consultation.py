@@ -6,8 +6,10 @@ from app.middlewares.auth import auth_required, get_current_user
 from app.extensions import mongo_db, socketio
 from app.utils.responses import success, fail
 from app.services.ehr_service import EHRService
+from app.services.ehr_context_cache import invalidate_ehr_context
+from app.routes.appointment_helpers import invalidate_appointment_caches
 from app.services.notification_service import NotificationService
-from app.services.yolo_service import infer as yolo_infer
+from app.services.yolo_executor import run_infer as yolo_infer
 from app.utils.doctor_helpers import get_doctor_oid_from_user
 from app.services.email_service import send_consultation_completed_email
 
@@ -604,6 +606,7 @@ def complete_consultation_simple():
                 }
             }
         )
+        invalidate_appointment_caches(appointment.get("doctor_id"))
         
         # Create EHR record
         try:
@@ -622,6 +625,7 @@ def complete_consultation_simple():
                 "created_at": datetime.utcnow()
             }
             mongo_db.ehr_records.insert_one(ehr_data)
+            invalidate_ehr_context(ehr_data["patient_id"])
         except Exception as ehr_err:
             print(f"⚠️ Failed to create EHR record: {ehr_err}")
         
@@ -1061,8 +1065,15 @@ def analyze_xray(consultation_id):
         if not file_doc:
             return fail("File không tồn tại", 404)
         
-        # Analyze X-ray using AI (YOLO model)
-        analysis_result = yolo_infer(file_doc["file_path"])
+        # Analyze X-ray using AI (YOLO model) - chạy trên process pool, không chặn hub;
+        # chỉ dùng preds → không vẽ / không gửi ảnh annotated về từ worker
+        preds, _ = yolo_infer(file_doc["file_path"], render=False)
+        top = preds[0] if preds else {}
+        analysis_result = {
+            "predictions": preds,
+            "prediction": top.get("label", ""),
+            "confidence": top.get("prob", 0),
+        }
         
         # Update specialty_data with X-ray result
         mongo_db.consultations.update_one(
@@ -1203,3 +1214,4 @@ def schedule_follow_up_appointment(patient_id, doctor_id, follow_up_date, notes)
     }
     
     mongo_db.appointments.insert_one(appointment_doc)
+    invalidate_appointment_caches(doctor_id)
@@ -3,6 +3,7 @@ from bson import ObjectId
 from datetime import datetime, timedelta
 from app.extensions import mongo_db
 from app.services.scheduler_service import SchedulerService  # ✅ THÊM AUTO SLOTS
+from app.services.redis_cache import cache, doctor_tag
 import jwt
 from app.config import JWT_SECRET_KEY
 
@@ -270,6 +271,51 @@ def _find_doctor_for_current_user():
 
 # backend/app/routes/doctor.py
 
+DOCTOR_CARD_TTL = 600
+
+
+def _doctor_card_key(doctor_id) -> str:
+    return f"doctor_card:{doctor_id}"
+
+
+def _doctor_card(doc):
+    """Thẻ bác sĩ trả về trong danh sách /doctors (được cache theo doctor_id)."""
+    doctor_id = str(doc["_id"])
+    full_name = doc.get("full_name") or doc.get("name", "")
+    
+    return {
+        "_id": doctor_id,
+        "id": doctor_id,
+        "name": full_name,  # ✅ CRITICAL
+        "full_name": full_name,
+        "license_no": doc.get("license_no", ""),
+        "issuing_authority": doc.get("issuing_authority", ""),
+        "specialty": doc.get("specialty", ""),
+        "subspecialty": doc.get("subspecialty", ""),
+        "department": doc.get("department", ""),
+        "years_of_experience": doc.get("years_of_experience", 0),
+        "qualifications": doc.get("qualifications", []),
+        "languages": doc.get("languages", []),
+        "email": doc.get("email", ""),
+        "phone": doc.get("phone", ""),
+        "gender": doc.get("gender", "male"),
+        "date_of_birth": doc.get("date_of_birth", ""),  # ✅ dd/mm/yyyy
+        "status": doc.get("status", "active"),
+        "role": doc.get("role", "doctor"),
+        "shift": doc.get("shift", {}),
+        "on_call": doc.get("on_call", False),
+        "avatar": doc.get("avatar", "👨‍⚕️"),
+        "rating": doc.get("rating", 4.8),
+        "reviews": doc.get("reviews", 0),
+        "experience": doc.get("years_of_experience", 0),
+        "price": doc.get("consultation_fee", 500000),
+        "consultation_fee": doc.get("consultation_fee", 500000),
+        "bio": doc.get("bio", "Bác sĩ chuyên khoa giàu kinh nghiệm"),
+        "working_hours": doc.get("shift", {}),
+        "specific_schedule": doc.get("specific_schedule", {}),
+    }
+
+
 @doctor_bp.route("/doctors", methods=["GET", "OPTIONS"])
 def get_doctors():
     """✅ Lấy danh sách bác sĩ"""
@@ -292,48 +338,23 @@ def get_doctors():
                 {"department": {"$regex": search, "$options": "i"}}
             ]
         
-        # ✅ Fetch all doctors
-        cursor = mongo_db.doctors.find(query).sort("full_name", 1)
+        # ✅ Chỉ lấy id theo thứ tự; thẻ bác sĩ đọc từ cache bằng 1 round-trip (MGET)
+        ids = [str(d["_id"]) for d in mongo_db.doctors.find(query, {"_id": 1}).sort("full_name", 1)]
+        cards = cache.get_many([_doctor_card_key(i) for i in ids])
         
-        result = []
-        for doc in cursor:
-            # ✅ Convert ObjectId to string
-            doctor_id = str(doc["_id"])
-            full_name = doc.get("full_name") or doc.get("name", "")
-            
-            doctor_data = {
-                "_id": doctor_id,
-                "id": doctor_id,
-                "name": full_name,  # ✅ CRITICAL
-                "full_name": full_name,
-                "license_no": doc.get("license_no", ""),
-                "issuing_authority": doc.get("issuing_authority", ""),
-                "specialty": doc.get("specialty", ""),
-                "subspecialty": doc.get("subspecialty", ""),
-                "department": doc.get("department", ""),
-                "years_of_experience": doc.get("years_of_experience", 0),
-                "qualifications": doc.get("qualifications", []),
-                "languages": doc.get("languages", []),
-                "email": doc.get("email", ""),
-                "phone": doc.get("phone", ""),
-                "gender": doc.get("gender", "male"),
-                "date_of_birth": doc.get("date_of_birth", ""),  # ✅ dd/mm/yyyy
-                "status": doc.get("status", "active"),
-                "role": doc.get("role", "doctor"),
-                "shift": doc.get("shift", {}),
-                "on_call": doc.get("on_call", False),
-                "avatar": doc.get("avatar", "👨‍⚕️"),
-                "rating": doc.get("rating", 4.8),
-                "reviews": doc.get("reviews", 0),
-                "experience": doc.get("years_of_experience", 0),
-                "price": doc.get("consultation_fee", 500000),
-                "consultation_fee": doc.get("consultation_fee", 500000),
-                "bio": doc.get("bio", "Bác sĩ chuyên khoa giàu kinh nghiệm"),
-                "working_hours": doc.get("shift", {}),
-                "specific_schedule": doc.get("specific_schedule", {}),
-            }
-            
-            result.append(doctor_data)
+        missing = [ObjectId(i) for i in ids if _doctor_card_key(i) not in cards]
+        if missing:
+            fresh = {}
+            for doc in mongo_db.doctors.find({"_id": {"$in": missing}}):
+                fresh[_doctor_card_key(doc["_id"])] = _doctor_card(doc)
+            cards.update(fresh)
+            cache.set_many(
+                fresh,
+                ttl=DOCTOR_CARD_TTL,
+                tags={key: [doctor_tag(card["id"])] for key, card in fresh.items()},
+            )
+        
+        result = [cards[_doctor_card_key(i)] for i in ids if _doctor_card_key(i) in cards]
         
         print(f"✅ Returning {len(result)} doctors")
         return jsonify(result), 200
@@ -450,6 +471,7 @@ def delete_doctor(id):
     res = mongo_db.doctors.delete_one({"_id": oid})
     if res.deleted_count == 0:
         return jsonify({"error": "not found"}), 404
+    cache.invalidate_tags(doctor_tag(oid))
     
     # ✅ Emit socket event for real-time update
     try:
@@ -725,6 +747,7 @@ def patch_doctor(id):
     
     if res.matched_count == 0:
         return jsonify({"error": "not found"}), 404
+    cache.invalidate_tags(doctor_tag(oid))
 
     doc = mongo_db.doctors.find_one({"_id": oid})
     
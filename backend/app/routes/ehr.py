@@ -7,6 +7,7 @@ import os
 from werkzeug.utils import secure_filename
 from app.middlewares.auth import auth_required, get_current_user
 from app.services.ehr_service import EHRService, log_ehr_access, clean_for_json
+from app.services.ehr_context_cache import invalidate_ehr_context
 from app.services.pdf_service import EHRPDFService
 from app.extensions import mongo_db
 from app.utils.responses import success, fail
@@ -533,6 +534,7 @@ def delete_record(record_id):
 
     try:
         mongo_db.ehr_records.delete_one({"_id": oid})
+        invalidate_ehr_context(record.get("patient_id"))
 
         # Nếu appointment tham chiếu tới record này, bỏ liên kết
         appointment_id = record.get("appointment_id")
@@ -1049,6 +1051,7 @@ def upload_pdf_record():
         }
         
         ehr_result = mongo_db.ehr_records.insert_one(ehr_doc)
+        invalidate_ehr_context(patient_oid)
         
         # Get created record with populated data
         record = mongo_db.ehr_records.find_one({"_id": ehr_result.inserted_id})
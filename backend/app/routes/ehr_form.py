@@ -11,6 +11,8 @@ from app.utils.responses import success, fail
 from app.utils.ehr_schema import create_ehr_form, EHRSchemaValidator
 from app.utils.doctor_helpers import get_doctor_oid_from_user
 from app.extensions import mongo_db
+from app.services.ehr_context_cache import invalidate_ehr_context
+from app.routes.appointment_helpers import invalidate_appointment_caches
 
 ehr_form_bp = Blueprint("ehr_form", __name__)
 
@@ -195,6 +197,7 @@ def save_form():
         
         # Insert to database
         result = mongo_db.ehr_records.insert_one(ehr_doc)
+        invalidate_ehr_context(ehr_doc["patient_id"])
         
         # Update appointment if linked
         if appointment_id:
@@ -208,6 +211,7 @@ def save_form():
                     }
                 }
             )
+            invalidate_appointment_caches(doctor_id)
         
         return success({
             "ehr_id": str(result.inserted_id),
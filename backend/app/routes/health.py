@@ -1,9 +1,59 @@
 #
 from flask import Blueprint
-from app.utils.responses import ok
+from app.utils.responses import ok, fail
 from app.extensions import mongo_db
+from app.services.yolo_executor import health as pool_health, readiness
+from app.services.xray_cache import xray_cache
+from app.services.xray_writer import xray_writer
+from app.services.redis_cache import cache
+from app.services.gemini_service import get_session_stats, get_gate_stats, get_model_health, get_llm_routes
 health_bp = Blueprint("health_bp", __name__)
 
 @health_bp.route("/health", methods=["GET"])
 def health():
     return ok({"status": "ok"})
+
+
+@health_bp.route("/health/inference", methods=["GET"])
+def inference_health():
+    """Health probe cho YOLO inference pool."""
+    info = pool_health()
+    info["result_cache"] = xray_cache.stats()
+    info["write_behind"] = xray_writer.stats()
+    if not info.get("healthy"):
+        return fail("Inference pool không sẵn sàng.", 503, data=info)
+    return ok(info)
+
+
+@health_bp.route("/health/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 503 cho tới khi model YOLO đã warm-up xong."""
+    info = readiness()
+    if not info["ready"]:
+        return fail("Model đang khởi động.", 503, data=info)
+    return ok(info)
+
+
+@health_bp.route("/health/ai-sessions", methods=["GET"])
+def ai_sessions():
+    """Số liệu kho session chat AI (size, hit/miss, eviction)."""
+    return ok(get_session_stats())
+
+
+@health_bp.route("/health/ai-gate", methods=["GET"])
+def ai_gate():
+    """Tải cổng gọi Gemini (đang chạy/đang chờ, số lần 429, timeout)."""
+    return ok(get_gate_stats())
+
+
+
+@health_bp.route("/health/ai-models", methods=["GET"])
+def ai_models():
+    """Sức khoẻ từng model Gemini (circuit, latency, error rate) + tỉ lệ fallback + routing provider."""
+    return ok({**get_model_health(), "routes": get_llm_routes()})
+
+
+@health_bp.route("/health/cache", methods=["GET"])
+def cache_health():
+    """Backend cache đang dùng (redis/memory) + số liệu tầng memory."""
+    return ok(cache.stats())
@@ -6,8 +6,10 @@ from flask import Blueprint, request
 from flask_cors import cross_origin
 from bson import ObjectId
 from datetime import datetime
+import os
 from app.middlewares.auth import auth_required, get_current_user
 from app.extensions import mongo_db
+from app.services.redis_cache import cache
 from app.utils.responses import success, fail
 from app.utils.doctor_helpers import get_doctor_oid_from_user
 
@@ -33,6 +35,52 @@ def serialize_notification(doc: dict) -> dict:
     return serialized
 
 
+# Nội dung notification không đổi sau khi tạo, chỉ trạng thái đọc thay đổi
+NOTIFICATION_CACHE_TTL = int(os.getenv("NOTIFICATION_CACHE_TTL", "3600"))
+READ_STATE_FIELDS = ("is_read", "read_at")
+
+
+def _notification_key(notification_id) -> str:
+    return f"notification:{notification_id}"
+
+
+def load_notifications(query: dict, limit: int) -> list:
+    """
+    Danh sách notification (mới → cũ) đã serialize.
+    Mongo chỉ trả id + trạng thái đọc; nội dung đọc từ cache bằng 1 round-trip (MGET),
+    phần thiếu lấy bằng 1 query $in rồi ghi lại cache bằng 1 pipeline.
+    """
+    heads = list(
+        mongo_db.notifications
+        .find(query, {"_id": 1, "is_read": 1, "read_at": 1})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+    keys = [_notification_key(h["_id"]) for h in heads]
+    bodies = cache.get_many(keys)
+
+    missing = [h["_id"] for h, key in zip(heads, keys) if key not in bodies]
+    if missing:
+        fresh = {}
+        for doc in mongo_db.notifications.find({"_id": {"$in": missing}}):
+            body = serialize_notification(doc)
+            for field in READ_STATE_FIELDS:
+                body.pop(field, None)
+            fresh[_notification_key(doc["_id"])] = body
+        bodies.update(fresh)
+        cache.set_many(fresh, ttl=NOTIFICATION_CACHE_TTL)
+
+    notifications = []
+    for head, key in zip(heads, keys):
+        body = bodies.get(key)
+        if body is None:
+            continue  # bị xoá giữa 2 query
+        item = dict(body)
+        item.update(serialize_notification({f: head[f] for f in READ_STATE_FIELDS if f in head}))
+        notifications.append(item)
+    return notifications
+
+
 # =============== PATIENT NOTIFICATIONS ===============
 
 @notifications_bp.route("/patient/notifications", methods=["GET", "OPTIONS"])
@@ -68,14 +116,7 @@ def get_patient_notifications():
         limit = int(request.args.get("limit", 50))
         
         # Get notifications
-        notifications_cursor = (
-            mongo_db.notifications
-            .find(query)
-            .sort("created_at", -1)
-            .limit(limit)
-        )
-        
-        notifications = [serialize_notification(notif) for notif in notifications_cursor]
+        notifications = load_notifications(query, limit)
         
         # Count unread
         unread_count = mongo_db.notifications.count_documents({
@@ -229,14 +270,7 @@ def get_doctor_notifications():
         limit = int(request.args.get("limit", 50))
         
         # Get notifications
-        notifications_cursor = (
-            mongo_db.notifications
-            .find(query)
-            .sort("created_at", -1)
-            .limit(limit)
-        )
-        
-        notifications = [serialize_notification(notif) for notif in notifications_cursor]
+        notifications = load_notifications(query, limit)
         
         # Count unread
         unread_count = mongo_db.notifications.count_documents({
@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request, g
 from bson import ObjectId
 from datetime import datetime, date
 from app.extensions import mongo_db
+from app.services.ehr_context_cache import invalidate_ehr_context
 from flask_cors import cross_origin
 from pymongo.errors import DuplicateKeyError
 import bcrypt
@@ -686,6 +687,7 @@ def update_patient(patient_id):
     # 15) Đóng dấu thời gian & update
     updates["updated_at"] = datetime.utcnow()
     mongo_db.patients.update_one({"_id": oid}, {"$set": updates})
+    invalidate_ehr_context(oid)
 
     # 16) Đồng bộ tên sang users nếu đổi
     if p.get("user_id") and (("name" in data) or ("full_name" in data)):
@@ -758,6 +760,7 @@ def delete_patient(patient_id):
     
     # 3. Xóa patient record
     result = mongo_db.patients.delete_one({"_id": oid})
+    invalidate_ehr_context(oid)
     
     if result.deleted_count == 0:
         return jsonify({"error": "Không thể xóa bệnh nhân"}), 500
@@ -8,6 +8,7 @@ from app.extensions import mongo_db, socketio
 from app.middlewares.auth import auth_required
 from app.model.ratings import RatingModel, RATING_TAGS
 from app.services.notification_service import NotificationService
+from app.services.redis_cache import cache, doctor_tag, TAG_RATINGS
 
 ratings_bp = Blueprint("ratings", __name__)
 
@@ -585,6 +586,44 @@ def get_rating_by_appointment(appointment_id):
         return fail(str(e), 500)
 
 
+def _load_doctor_rating_stats(doctor_id):
+    """Stats rating của bác sĩ từ doctors collection (tính lại nếu chưa có)."""
+    # Get from doctors collection
+    doctor = mongo_db.doctors.find_one(
+        {"_id": ObjectId(doctor_id)},
+        {
+            "average_rating": 1,
+            "total_ratings": 1,
+            "rating_distribution": 1,
+            "rating_updated_at": 1,
+            "full_name": 1,
+            "name": 1,
+        }
+    )
+    
+    if not doctor or "average_rating" not in doctor:
+        # Calculate fresh stats
+        stats = RatingModel.update_doctor_rating_stats(doctor_id)
+    else:
+        stats = {
+            "average_rating": doctor.get("average_rating", 0),
+            "total_ratings": doctor.get("total_ratings", 0),
+            "rating_distribution": doctor.get("rating_distribution", {
+                "5_star": 0,
+                "4_star": 0,
+                "3_star": 0,
+                "2_star": 0,
+                "1_star": 0
+            })
+        }
+        # Convert datetime if exists
+        if "rating_updated_at" in doctor and hasattr(doctor["rating_updated_at"], "isoformat"):
+            stats["last_updated"] = doctor["rating_updated_at"].isoformat()
+
+    stats = ensure_rating_stats(stats, doctor_id, doctor)
+    return stats
+
+
 @ratings_bp.route("/ratings/stats/doctor/<doctor_id>", methods=["GET"])
 def get_doctor_rating_stats(doctor_id):
     """
@@ -606,40 +645,12 @@ def get_doctor_rating_stats(doctor_id):
         }
     """
     try:
-        # Get from doctors collection
-        doctor = mongo_db.doctors.find_one(
-            {"_id": ObjectId(doctor_id)},
-            {
-                "average_rating": 1,
-                "total_ratings": 1,
-                "rating_distribution": 1,
-                "rating_updated_at": 1,
-                "full_name": 1,
-                "name": 1,
-            }
+        stats = cache.get_or_compute(
+            f"rating_stats:{doctor_id}",
+            lambda: _load_doctor_rating_stats(doctor_id),
+            ttl=600,
+            tags=[doctor_tag(doctor_id), TAG_RATINGS],
         )
-        
-        if not doctor or "average_rating" not in doctor:
-            # Calculate fresh stats
-            stats = RatingModel.update_doctor_rating_stats(doctor_id)
-        else:
-            stats = {
-                "average_rating": doctor.get("average_rating", 0),
-                "total_ratings": doctor.get("total_ratings", 0),
-                "rating_distribution": doctor.get("rating_distribution", {
-                    "5_star": 0,
-                    "4_star": 0,
-                    "3_star": 0,
-                    "2_star": 0,
-                    "1_star": 0
-                })
-            }
-            # Convert datetime if exists
-            if "rating_updated_at" in doctor and hasattr(doctor["rating_updated_at"], "isoformat"):
-                stats["last_updated"] = doctor["rating_updated_at"].isoformat()
-
-        stats = ensure_rating_stats(stats, doctor_id, doctor)
-        
         return success(stats)
     
     except Exception as e:
@@ -3,11 +3,46 @@
 API routes for Specialty AI Assistant
 """
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
 from flask import Blueprint, request, jsonify
 from app.services.specialty_ai_service import SpecialtyAIService
+from app.services.gemini_client import AIBusyError, Deadline
+from app.utils.responses import too_busy
 
 specialty_ai_bp = Blueprint('specialty_ai', __name__)
 
+# Batch: tối đa số yêu cầu / lần và deadline chung (giây)
+BATCH_MAX_ITEMS = int(os.getenv("SPECIALTY_BATCH_MAX_ITEMS", "6"))
+BATCH_TIMEOUT = float(os.getenv("SPECIALTY_BATCH_TIMEOUT", "25"))
+
+# Pool dùng chung (dưới eventlet.monkey_patch là green thread); số call Gemini thật vẫn do gemini_gate giới hạn
+_batch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SPECIALTY_BATCH_WORKERS", "8")),
+                                 thread_name_prefix="specialty-ai")
+
+
+def _parse_suggestion_request(data):
+    """Body (1 yêu cầu) → kwargs cho SpecialtyAIService.get_suggestions (symptoms rỗng → None)."""
+    specialty = data.get('specialty', 'internal')
+    # Support both 'symptoms' (legacy) and 'chief_complaint' (new)
+    symptoms = data.get('chief_complaint') or data.get('symptoms', '')
+    history = data.get('history_present_illness', '')
+
+    # Combine symptoms and history for better context
+    if history:
+        symptoms = f"{symptoms}\n\nBệnh sử: {history}"
+    if not symptoms:
+        return None
+
+    return {
+        "specialty": specialty,
+        "symptoms": symptoms,
+        "patient_info": data.get('patient_info'),
+        "vital_signs": data.get('vital_signs'),
+    }
+
 @specialty_ai_bp.route('/suggest', methods=['POST'])
 @specialty_ai_bp.route('/suggestions', methods=['POST'])
 def get_ai_suggestions():
@@ -27,30 +62,15 @@ def get_ai_suggestions():
     try:
         data = request.get_json()
         
-        specialty = data.get('specialty', 'internal')
-        # Support both 'symptoms' (legacy) and 'chief_complaint' (new)
-        symptoms = data.get('chief_complaint') or data.get('symptoms', '')
-        history = data.get('history_present_illness', '')
-        patient_info = data.get('patient_info')
-        vital_signs = data.get('vital_signs')
-        
-        # Combine symptoms and history for better context
-        if history:
-            symptoms = f"{symptoms}\n\nBệnh sử: {history}"
-        
-        if not symptoms:
+        params = _parse_suggestion_request(data)
+        if not params:
             return jsonify({
                 "status": "error",
                 "message": "Vui lòng cung cấp triệu chứng"
             }), 400
         
         # Call AI service (now sync, no need asyncio)
-        result = SpecialtyAIService.get_suggestions(
-            specialty=specialty,
-            symptoms=symptoms,
-            patient_info=patient_info,
-            vital_signs=vital_signs
-        )
+        result = SpecialtyAIService.get_suggestions(**params)
         
         if result.get('success'):
             return jsonify({
@@ -63,6 +83,110 @@ def get_ai_suggestions():
                 "message": result.get('error', 'Không thể lấy gợi ý')
             }), 500
             
+    except AIBusyError as e:
+        return too_busy(e.message, e.retry_after, status="error")
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@specialty_ai_bp.route('/suggest/batch', methods=['POST'])
+@specialty_ai_bp.route('/suggestions/batch', methods=['POST'])
+def get_ai_suggestions_batch():
+    """
+    Gọi nhiều gợi ý AI song song với 1 deadline chung, trả kết quả từng phần
+    
+    POST /api/specialty-ai/suggest/batch (or /suggestions/batch)
+    Body: {
+        "requests": [
+            {"id": "labs", "specialty": "internal", "chief_complaint": "...", ...},
+            {"id": "diagnosis", "specialty": "pediatric", "symptoms": "...", ...}
+        ],
+        "timeout": 20  // giây (optional, tối đa SPECIALTY_BATCH_TIMEOUT)
+    }
+    
+    Mỗi phần tử kết quả có status: success | error | timeout | busy
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('requests') or []
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                "status": "error",
+                "message": "Vui lòng cung cấp danh sách requests"
+            }), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                "status": "error",
+                "message": f"Tối đa {BATCH_MAX_ITEMS} yêu cầu mỗi lần"
+            }), 400
+        
+        try:
+            timeout = min(float(data.get('timeout') or BATCH_TIMEOUT), BATCH_TIMEOUT)
+        except (TypeError, ValueError):
+            timeout = BATCH_TIMEOUT
+        
+        started = time.monotonic()
+        deadline = Deadline(timeout)  # truyền xuống từng call: quá hạn thì call bị cắt, trả slot
+        results = [None] * len(items)
+        futures = {}
+        for i, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            params = _parse_suggestion_request(item)
+            if not params:
+                results[i] = {"status": "error", "message": "Vui lòng cung cấp triệu chứng"}
+                continue
+            futures[_batch_pool.submit(SpecialtyAIService.get_suggestions, deadline=deadline, **params)] = i
+        
+        # Deadline chung: lấy những call đã xong, phần còn lại trả timeout
+        # (call chưa chạy bị huỷ; call đang chạy bị cắt bởi cùng deadline)
+        done, pending = wait(futures, timeout=timeout)
+        for fut in pending:
+            fut.cancel()
+        retry_after = None
+        for fut, i in futures.items():
+            if fut not in done:
+                results[i] = {"status": "timeout", "message": "Quá thời gian chờ AI"}
+                continue
+            try:
+                result = fut.result()
+            except AIBusyError as e:
+                retry_after = max(retry_after or 0, e.retry_after)
+                results[i] = {"status": "busy", "message": e.message, "retry_after": e.retry_after}
+                continue
+            except Exception as e:
+                results[i] = {"status": "error", "message": str(e)}
+                continue
+            if result.get('success'):
+                results[i] = {"status": "success", "data": result}
+            else:
+                results[i] = {"status": "error", "message": result.get('error', 'Không thể lấy gợi ý')}
+        
+        for i, item in enumerate(items):
+            results[i]["index"] = i
+            if isinstance(item, dict) and item.get('id') is not None:
+                results[i]["id"] = item.get('id')
+        
+        completed = sum(1 for r in results if r["status"] == "success")
+        payload = {
+            "status": "success" if completed else "error",
+            "data": {
+                "results": results,
+                "completed": completed,
+                "total": len(items),
+                "elapsed_ms": int((time.monotonic() - started) * 1000)
+            }
+        }
+        
+        # Không call nào xong và có call bị từ chối vì quá tải → 429 để client lùi lại
+        if retry_after and not completed:
+            return too_busy("Trợ lý AI đang quá tải, vui lòng thử lại sau.", retry_after,
+                            status="error", data=payload["data"])
+        return jsonify(payload), 200
+        
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -4,16 +4,26 @@ from datetime import datetime
 from uuid import uuid4
 import mimetypes
 import math
+import hmac
+import io
+import secrets
+import zipfile
 
 from flask import Blueprint, request, send_file, current_app, url_for, g
+from flask_socketio import join_room, emit
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 
 from app.config import get_settings
 from app.utils.responses import ok, fail
-from app.utils.image_utils import safe_filename, ensure_dir, resize_inplace
-from app.services.yolo_service import infer
-from app.extensions import mongo_db
+from app.utils.image_utils import safe_filename, ensure_dir, decode_image, resize_max
+from app.utils.xray_render import render_predictions
+from app.services.yolo_batcher import batched_infer
+from app.services.yolo_executor import run_batch, run_tiled
+from app.services.xray_cache import xray_cache, content_hash
+from app.services.xray_writer import xray_writer
+from app.services.ttl_store import TTLStore
+from app.extensions import mongo_db, socketio
 
 xray_bp = Blueprint("xray_bp", __name__)
 _settings = get_settings()
@@ -23,6 +33,12 @@ APP_DIR = Path(__file__).resolve().parents[1]
 UPLOAD_DIR = APP_DIR / "upload" / "xray"
 RESULT_DIR = APP_DIR / "static" / "xray_results"
 
+# batch_id → {"join_key", "results", "done"}: chỉ người upload (giữ join_key) được join room;
+# client join muộn vẫn nhận lại tiến độ đã emit
+_batches = TTLStore(max_size=500, ttl_seconds=3600)
+
+ZIP_READ_CHUNK = 1024 * 1024
+
 ALLOWED_EXTS = {"png", "jpg", "jpeg"}
 ALLOWED_MIMES = {"image/png", "image/jpeg"}
 
@@ -110,12 +126,11 @@ def _sanitize_preds(preds):
     return out
 
 
-def _color_for(label: str):
-    """Sinh màu ổn định theo label."""
-    import random
-
-    rnd = random.Random(hash(label) & 0xFFFFFFFF)
-    return (50 + rnd.randint(0, 205), 50 + rnd.randint(0, 205), 50 + rnd.randint(0, 205))
+def _write_bytes(path: Path, data: bytes) -> None:
+    try:
+        path.write_bytes(data)
+    except Exception as e:
+        print(f"[XRay] save upload warn: {e}")
 
 
 def _to_pil(img_like):
@@ -137,45 +152,64 @@ def _to_pil(img_like):
 
 
 def _draw_boxes(base_img: Image.Image, preds_sanitized):
-    """Vẽ bbox + label lên ảnh PIL rồi trả PIL.Image."""
+    """Vẽ bbox + label lên ảnh PIL rồi trả PIL.Image (1 lượt cv2, màu theo label cache)."""
     img = base_img.convert("RGB")
     W, H = img.size
-    draw = ImageDraw.Draw(img)
+    boxes = [_box_from_pred(p, W, H) for p in preds_sanitized]
+    bgr = np.asarray(img)[:, :, ::-1]
+    return _to_pil(render_predictions(bgr, preds_sanitized, boxes=boxes))
 
-    # font: ưu tiên truetype nếu có, fallback default
-    try:
-        font = ImageFont.truetype("arial.ttf", max(12, int(min(W, H) * 0.025)))
-    except Exception:
-        font = ImageFont.load_default()
 
-    thickness = max(2, int(min(W, H) * 0.004))  # scale theo ảnh
+def _compose_annotated(annotated, preds, img_bgr) -> Image.Image:
+    """Chọn ảnh đã vẽ từ model (hoặc tự vẽ box) → PIL RGB."""
+    base_from_model = _to_pil(annotated)           # r.plot() -> ndarray BGR -> PIL
+    if any(p.get("box") for p in preds) and base_from_model:
+        return base_from_model                     # model đã vẽ box
+    base = base_from_model or _to_pil(img_bgr)
+    return _draw_boxes(base, preds)                # tự vẽ (nếu cần)
 
-    for p in preds_sanitized:
-        box = _box_from_pred(p, W, H)
-        if not box:
-            continue
-        x1, y1, x2, y2 = box
-        color = _color_for(p["label"])
 
-        # rectangle (viền dày)
-        for t in range(thickness):
-            draw.rectangle([x1 - t, y1 - t, x2 + t, y2 + t], outline=color)
+def _new_out_name(stem: str) -> str:
+    return f"{uuid4().hex}_{stem}.jpg"
+
+
+def _save_annotated(annotated, preds, img_bgr, stem: str) -> str:
+    """Vẽ + lưu JPEG vào RESULT_DIR ngay (đồng bộ); trả tên file."""
+    out_name = _new_out_name(stem)
+    _compose_annotated(annotated, preds, img_bgr).save(RESULT_DIR / out_name, format="JPEG", quality=90)
+    return out_name
+
 
-        # nhãn
-        text = f"{p['label']} {p['prob'] * 100:.1f}%"
-        pad = 2
+def _respond(preds, top, out_name: str, conf, iou, imgsz, device, vis: Image.Image | None = None, tiled: bool = False):
+    """
+    Lưu ảnh annotated `vis` (nếu có) + DB rồi trả JSON kết quả predict.
+    XRAY_WRITE_BEHIND: encode JPEG + insert chạy nền, response trả ngay.
+    """
+    doc = {
+        "patient_name": request.form.get("patient_name", "Unknown"),
+        "doctor_id": getattr(g, "user_id", None) or request.form.get("doctor_id"),
+        "annotated_path": f"static/xray_results/{out_name}",
+        "ai_result": (top or {}),
+        "created_at": datetime.utcnow()
+    }
+    if _settings.XRAY_WRITE_BEHIND:
+        xray_writer.submit(RESULT_DIR / out_name if vis is not None else None, vis, doc)
+    else:
+        if vis is not None:
+            vis.save(RESULT_DIR / out_name, format="JPEG", quality=90)
         try:
-            tw, th = draw.textsize(text, font=font)  # PIL <10
-        except Exception:
-            # PIL>=10 khuyến nghị textbbox
-            bbox = draw.textbbox((0, 0), text, font=font)
-            tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        # nền label
-        draw.rectangle([x1, y1 - th - 2 * pad, x1 + tw + 2 * pad, y1], fill=color)
-        # chữ trắng
-        draw.text((x1 + pad, y1 - th - pad), text, fill=(255, 255, 255), font=font)
+            mongo_db.xray_results.insert_one(doc)
+        except Exception as dbe:
+            current_app.logger.warning(f"[XRay] DB insert warn: {dbe}")
+
+    img_url = url_for("xray_bp.get_xray_image", filename=out_name, _external=True)
 
-    return img
+    return ok({
+        "predictions": preds,
+        "top": top,
+        "annotated_image_url": img_url,
+        "params": {"conf": conf, "iou": iou, "imgsz": imgsz, "device": device or "cpu", "tiled": tiled},
+    })
 
 
 # Cho phép gọi theo 2 kiểu:
@@ -193,70 +227,74 @@ def predict_xray():
     ensure_dir(UPLOAD_DIR)
     ensure_dir(RESULT_DIR)
 
-    # Lưu input
-    in_name = safe_filename(f.filename)
-    inp_path = UPLOAD_DIR / in_name
-    f.save(str(inp_path))
-    try:
-        resize_inplace(inp_path, _settings.MAX_IMAGE_SIZE)
-    except Exception as e:
-        current_app.logger.warning(f"[XRay] resize warn: {e}")
-
     # Params
     conf  = _num(request.form.get("conf")  or request.args.get("conf"),  float, 0.25)
     iou   = _num(request.form.get("iou")   or request.args.get("iou"),   float, 0.45)
-    imgsz = _num(request.form.get("imgsz") or request.args.get("imgsz"), int,   640)
+    imgsz = _num(request.form.get("imgsz") or request.args.get("imgsz"), int,   _settings.YOLO_IMGSZ)
     device = request.form.get("device") or request.args.get("device") or None
+    tiled_arg = (request.form.get("tiled") or request.args.get("tiled") or "").lower()
+
+    # ---- Decode 1 lần vào RAM (không round-trip qua đĩa)
+    data = f.read()
+    try:
+        img_bgr = decode_image(data)
+    except ValueError as e:
+        return fail(str(e), 400)
+
+    # Tiled: film lớn giữ độ phân giải cao (XRAY_TILED_MAX_SIZE) thay vì thu về MAX_IMAGE_SIZE
+    if tiled_arg in ("1", "true", "yes"):
+        tiled = True
+    elif tiled_arg in ("0", "false", "no"):
+        tiled = False
+    else:
+        tiled = 0 < _settings.XRAY_TILE_AUTO_MIN <= max(img_bgr.shape[:2])
+    mode = "tiled" if tiled else "full"
+
+    # ---- Cache theo nội dung ảnh: cùng film + cùng tham số → bỏ qua model
+    image_hash = content_hash(data)
+    cached = xray_cache.get(image_hash, conf, iou, imgsz, RESULT_DIR, mode=mode)
+    if cached is not None:
+        current_app.logger.info(f"[XRay] cache hit {image_hash[:12]} -> {cached['out_name']}")
+        return _respond(cached["predictions"], cached["top"], cached["out_name"], conf, iou, imgsz, device, tiled=tiled)
+
+    # ---- Resize trong bộ nhớ
+    img_bgr = resize_max(img_bgr, _settings.XRAY_TILED_MAX_SIZE if tiled else _settings.MAX_IMAGE_SIZE)
+
+    # Lưu bản upload gốc (bytes nguyên vẹn, không re-encode) — chạy nền
+    in_name = safe_filename(f.filename)
+    if _settings.XRAY_SAVE_UPLOADS:
+        socketio.start_background_task(_write_bytes, UPLOAD_DIR / in_name, data)
 
     try:
         current_app.logger.info(
-            f"[XRay] start conf={conf} iou={iou} imgsz={imgsz} device={device or 'cpu'} inp={inp_path}"
+            f"[XRay] start conf={conf} iou={iou} imgsz={imgsz} device={device or 'cpu'} "
+            f"inp={in_name} shape={img_bgr.shape[1]}x{img_bgr.shape[0]} mode={mode}"
         )
 
         # ---- RUN MODEL
-        preds_raw, annotated = infer(inp_path, conf=conf, iou=iou, imgsz=imgsz, device=device)
+        if tiled:
+            # tất cả tile của ảnh = 1 batch riêng trên process pool
+            preds_raw, annotated = run_tiled(img_bgr, conf=conf, iou=iou, imgsz=imgsz, device=device)
+        else:
+            # qua micro-batcher: gom các request đồng thời
+            preds_raw, annotated = batched_infer(img_bgr, conf=conf, iou=iou, imgsz=imgsz, device=device)
 
         # ---- Chuẩn hoá dự đoán & tính top (🔧 FIX: luôn define top)
         preds = _sanitize_preds(preds_raw)
         top = (max(preds, key=lambda x: x["prob"]) if preds else None)
 
-        # ---- Tạo annotated (có bbox)
-        out_name = f"{uuid4().hex}_{Path(in_name).stem}.jpg"
-        out_path = RESULT_DIR / out_name
+        # ---- Tạo annotated (có bbox); tên file xác định trước, ghi đĩa có thể chạy nền
+        out_name = _new_out_name(Path(in_name).stem)
         try:
-            base_from_model = _to_pil(annotated)           # r.plot() -> ndarray BGR -> PIL
-            if any(p.get("box") for p in preds) and base_from_model:
-                vis = base_from_model                      # model đã vẽ box
-            else:
-                base = base_from_model or Image.open(str(inp_path)).convert("RGB")
-                vis = _draw_boxes(base, preds)             # tự vẽ (nếu cần)
-            vis.save(out_path, format="JPEG", quality=90)
+            vis = _compose_annotated(annotated, preds, img_bgr)
+            resp = _respond(preds, top, out_name, conf, iou, imgsz, device, vis=vis, tiled=tiled)
         except Exception as e:
             current_app.logger.exception(f"[XRay] draw/save annotated failed: {e}")
             return fail("Không thể tạo ảnh annotated trên server.", 500)
 
-        current_app.logger.info(f"[XRay] ok -> {out_path}")
-
-        # ---- Lưu DB (best-effort)
-        try:
-            mongo_db.xray_results.insert_one({
-                "patient_name": request.form.get("patient_name", "Unknown"),
-                "doctor_id": getattr(g, "user_id", None) or request.form.get("doctor_id"),
-                "annotated_path": f"static/xray_results/{out_name}",
-                "ai_result": (top or {}),
-                "created_at": datetime.utcnow()
-            })
-        except Exception as dbe:
-            current_app.logger.warning(f"[XRay] DB insert warn: {dbe}")
-
-        img_url = url_for("xray_bp.get_xray_image", filename=out_name, _external=True)
-
-        return ok({
-            "predictions": preds,
-            "top": top,
-            "annotated_image_url": img_url,
-            "params": {"conf": conf, "iou": iou, "imgsz": imgsz, "device": device or "cpu"},
-        })
+        xray_cache.put(image_hash, conf, iou, imgsz, preds, top, out_name, mode=mode)
+        current_app.logger.info(f"[XRay] ok -> {RESULT_DIR / out_name}")
+        return resp
 
     except FileNotFoundError as e:
         current_app.logger.exception("[XRay] Model or file not found")
@@ -269,9 +307,237 @@ def predict_xray():
         return fail(f"Lỗi xử lý ảnh: {e}", 500)
 
 
+def _read_zip_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo, limit: int) -> bytes:
+    """Đọc từng khúc, dừng ngay khi vượt `limit` (không tin file_size trong header zip)."""
+    buf = bytearray()
+    with zf.open(info) as fh:
+        while True:
+            chunk = fh.read(ZIP_READ_CHUNK)
+            if not chunk:
+                return bytes(buf)
+            buf += chunk
+            if len(buf) > limit:
+                raise ValueError(f"Ảnh {Path(info.filename).name} vượt quá {limit // (1024 * 1024)}MB sau giải nén")
+
+
+def _collect_batch_files():
+    """
+    Lấy danh sách (filename, bytes) từ multipart: nhiều field `files`/`file`/`image`
+    và/hoặc file .zip (giải nén trong RAM, chỉ lấy png/jpg).
+    Giới hạn số ảnh, dung lượng từng ảnh và tổng dung lượng được kiểm tra TRƯỚC khi giải nén
+    (chặn zip bomb); ValueError nếu vượt.
+    """
+    max_files = _settings.XRAY_BATCH_MAX_FILES
+    max_file = _settings.XRAY_BATCH_MAX_FILE_BYTES
+    max_total = _settings.XRAY_BATCH_MAX_TOTAL_BYTES
+    items, total_bytes = [], 0
+
+    def _add(name: str, data: bytes) -> None:
+        nonlocal total_bytes
+        total_bytes += len(data)
+        if total_bytes > max_total:
+            raise ValueError(f"Tổng dung lượng ảnh vượt quá {max_total // (1024 * 1024)}MB")
+        items.append((name, data))
+
+    uploads = (
+        request.files.getlist("files")
+        + request.files.getlist("file")
+        + request.files.getlist("image")
+    )
+    for up in uploads:
+        if not up or not up.filename:
+            continue
+        if up.filename.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(up.read())) as zf:
+                    for info in zf.infolist():
+                        name = Path(info.filename).name
+                        if info.is_dir() or name.startswith(".") or not _allowed(name):
+                            continue
+                        if len(items) >= max_files:
+                            raise ValueError(f"Tối đa {max_files} ảnh mỗi lần.")
+                        if info.file_size > max_file or total_bytes + info.file_size > max_total:
+                            raise ValueError(f"Ảnh {name} trong zip quá lớn")
+                        _add(name, _read_zip_entry(zf, info, min(max_file, max_total - total_bytes)))
+            except zipfile.BadZipFile:
+                raise ValueError(f"File zip không hợp lệ: {up.filename}")
+        elif _allowed(up.filename, up.mimetype):
+            if len(items) >= max_files:
+                raise ValueError(f"Tối đa {max_files} ảnh mỗi lần.")
+            _add(up.filename, up.read())
+    return items
+
+
+def _run_batch_job(app, batch_id: str, items, params: dict, meta: dict, url_prefix: str):
+    """
+    Background task: chạy model theo từng batch (XRAY_BATCH_MAX_SIZE ảnh / lần predict),
+    emit tiến độ từng ảnh vào room `xray_batch:<batch_id>`, cuối cùng insert_many.
+    """
+    room = f"xray_batch:{batch_id}"
+    total = len(items)
+    chunk = max(1, _settings.XRAY_BATCH_MAX_SIZE)
+    conf, iou, imgsz, device = params["conf"], params["iou"], params["imgsz"], params["device"]
+    entry = _batches.get(batch_id) or {}
+    results, docs = entry.get("results", []), []
+
+    with app.app_context():
+        for start in range(0, total, chunk):
+            group = []   # (index, filename, hash, img_bgr)
+            for idx in range(start, min(start + chunk, total)):
+                filename, data = items[idx]
+                image_hash = content_hash(data)
+                cached = xray_cache.get(image_hash, conf, iou, imgsz, RESULT_DIR)
+                if cached is not None:
+                    results.append(_batch_item(batch_id, idx, total, filename, url_prefix,
+                                               cached["predictions"], cached["top"], cached["out_name"]))
+                    socketio.emit("xray_batch_progress", results[-1], room=room)
+                    continue
+                try:
+                    group.append((idx, filename, image_hash, resize_max(decode_image(data), _settings.MAX_IMAGE_SIZE)))
+                except ValueError as e:
+                    results.append(_batch_item(batch_id, idx, total, filename, url_prefix, error=str(e)))
+                    socketio.emit("xray_batch_progress", results[-1], room=room)
+            if not group:
+                continue
+
+            try:
+                outputs = run_batch([g_[3] for g_ in group], conf=conf, iou=iou, imgsz=imgsz, device=device)
+            except Exception as e:
+                app.logger.exception(f"[XRay] batch {batch_id} predict failed")
+                outputs = [e] * len(group)
+
+            for (idx, filename, image_hash, img_bgr), out in zip(group, outputs):
+                if isinstance(out, Exception):
+                    item = _batch_item(batch_id, idx, total, filename, url_prefix, error=str(out))
+                else:
+                    try:
+                        preds = _sanitize_preds(out[0])
+                        top = (max(preds, key=lambda x: x["prob"]) if preds else None)
+                        out_name = _save_annotated(out[1], preds, img_bgr, Path(safe_filename(filename)).stem)
+                        xray_cache.put(image_hash, conf, iou, imgsz, preds, top, out_name)
+                        item = _batch_item(batch_id, idx, total, filename, url_prefix, preds, top, out_name)
+                    except Exception as e:
+                        item = _batch_item(batch_id, idx, total, filename, url_prefix, error=str(e))
+                results.append(item)
+                socketio.emit("xray_batch_progress", item, room=room)
+
+        for item in results:
+            if item["ok"]:
+                docs.append({
+                    **meta,
+                    "batch_id": batch_id,
+                    "source_filename": item["filename"],
+                    "annotated_path": f"static/xray_results/{item['out_name']}",
+                    "ai_result": (item["top"] or {}),
+                    "created_at": datetime.utcnow(),
+                })
+        if docs:
+            try:
+                mongo_db.xray_results.insert_many(docs, ordered=False)
+            except Exception as dbe:
+                app.logger.warning(f"[XRay] batch {batch_id} DB insert warn: {dbe}")
+
+        succeeded = sum(1 for r in results if r["ok"])
+        results.sort(key=lambda r: r["index"])
+        done = {
+            "batch_id": batch_id,
+            "total": total,
+            "succeeded": succeeded,
+            "failed": total - succeeded,
+            "results": results,
+        }
+        entry["done"] = done
+        socketio.emit("xray_batch_done", done, room=room)
+        app.logger.info(f"[XRay] batch {batch_id} done: {succeeded}/{total}")
+
+
+def _batch_item(batch_id, idx, total, filename, url_prefix, preds=None, top=None, out_name=None, error=None):
+    return {
+        "batch_id": batch_id,
+        "index": idx,
+        "total": total,
+        "filename": filename,
+        "ok": error is None,
+        "error": error,
+        "predictions": preds or [],
+        "top": top,
+        "out_name": out_name,
+        "annotated_image_url": f"{url_prefix}{out_name}" if out_name else None,
+    }
+
+
+@xray_bp.post("/predict-batch")
+def predict_xray_batch():
+    """
+    Dự đoán hàng loạt: multipart `files` (nhiều ảnh) và/hoặc 1 file .zip.
+    Trả 202 + batch_id + join_key ngay; tiến độ từng ảnh được emit qua Socket.IO:
+      - event `join_xray_batch` {batch_id, join_key} → join room `xray_batch:<batch_id>`
+        và nhận `xray_batch_snapshot` (phần tiến độ đã có trước khi join)
+      - `xray_batch_progress` cho từng ảnh, `xray_batch_done` khi xong.
+    batch_id do server sinh; chỉ người giữ join_key (người upload) xem được kết quả.
+    """
+    try:
+        items = _collect_batch_files()
+    except ValueError as e:
+        return fail(str(e), 400)
+    if not items:
+        return fail("Không có ảnh hợp lệ (png/jpg hoặc .zip).", 400)
+
+    ensure_dir(RESULT_DIR)
+    batch_id = uuid4().hex
+    join_key = secrets.token_urlsafe(24)
+    _batches.set(batch_id, {"join_key": join_key, "results": [], "done": None})
+    params = {
+        "conf":  _num(request.form.get("conf")  or request.args.get("conf"),  float, 0.25),
+        "iou":   _num(request.form.get("iou")   or request.args.get("iou"),   float, 0.45),
+        "imgsz": _num(request.form.get("imgsz") or request.args.get("imgsz"), int,   _settings.YOLO_IMGSZ),
+        "device": request.form.get("device") or request.args.get("device") or None,
+    }
+    meta = {
+        "patient_name": request.form.get("patient_name", "Unknown"),
+        "doctor_id": getattr(g, "user_id", None) or request.form.get("doctor_id"),
+    }
+    # URL tuyệt đối phải dựng trong request context; background task chỉ nối tên file
+    url_prefix = url_for("xray_bp.get_xray_image", filename="_", _external=True)[:-1]
+
+    socketio.start_background_task(
+        _run_batch_job, current_app._get_current_object(), batch_id, items, params, meta, url_prefix
+    )
+    return ok({
+        "batch_id": batch_id,
+        "join_key": join_key,
+        "room": f"xray_batch:{batch_id}",
+        "total": len(items),
+        "params": {**params, "device": params["device"] or "cpu"},
+    }, code=202, message="Đã nhận batch, đang xử lý")
+
+
+@socketio.on("join_xray_batch")
+def on_join_xray_batch(data):
+    """Join room tiến độ batch X-quang; yêu cầu join_key trả về lúc upload."""
+    batch_id = str((data or {}).get("batch_id") or "")
+    join_key = str((data or {}).get("join_key") or "")
+    entry = _batches.get(batch_id) if batch_id else None
+    if not entry or not join_key or not hmac.compare_digest(entry["join_key"], join_key):
+        emit("xray_batch_error", {"batch_id": batch_id, "error": "Không có quyền xem batch này"})
+        return
+    join_room(f"xray_batch:{batch_id}")
+    emit("xray_batch_snapshot", {
+        "batch_id": batch_id,
+        "results": list(entry["results"]),
+        "done": entry["done"],
+    })
+
+
 @xray_bp.get("/xray-results/<filename>")
 def get_xray_image(filename: str):
     path = RESULT_DIR / filename
+    if not path.exists() and xray_writer.is_pending(filename):
+        # write-behind chưa flush: phục vụ từ RAM, hoặc chờ ngắn nếu vừa flush xong
+        data = xray_writer.pending_jpeg(filename)
+        if data is not None:
+            return send_file(io.BytesIO(data), mimetype="image/jpeg", max_age=0)
+        xray_writer.wait_flushed(filename, timeout=2.0)
     if not path.exists():
         current_app.logger.warning(f"[XRay] Not found: {path}")
         try:
@@ -101,7 +101,8 @@ def advise_doctor(user_message: str, conversation_id: str, clinical_context: dic
     return gemini_chat_streaming(
         conversation_id=conversation_id,
         user_prompt=user_message,
-        system=full_system
+        system=full_system,
+        use_case="doctor_advisor"
     )
 
 def analyze_xray(xray_findings: str, clinical_summary: str = "") -> str:
@@ -115,16 +116,22 @@ def analyze_xray(xray_findings: str, clinical_summary: str = "") -> str:
         patient_info=clinical_summary
     )
 
-def get_doctor_suggestions(chat_history_text: str = "") -> list:
-    """Gợi ý câu hỏi tiếp theo (Autocomplete cho bác sĩ)"""
+def get_doctor_suggestions(chat_history_text: str = "", fallback: bool = True) -> list:
+    """
+    Gợi ý câu hỏi tiếp theo (Autocomplete cho bác sĩ).
+    fallback=False → trả [] thay cho danh sách mặc định khi AI bận/lỗi.
+    """
     prompt = "Gợi ý 4 câu hỏi/yêu cầu ngắn gọn (thuật ngữ y khoa) mà bác sĩ nên hỏi tiếp. Trả về list text."
     if chat_history_text:
         prompt = f"Context hội thoại: {chat_history_text}\n{prompt}"
         
     try:
-        res = gemini_chat(prompt, temperature=0.5) # Temp thấp để nghiêm túc hơn
+        # Có lịch sử hội thoại (PHI) → không cache
+        res = gemini_chat(prompt, temperature=0.5, cache_response=not chat_history_text, use_case="suggestions") # Temp thấp để nghiêm túc hơn
         lines = [l.strip("- *") for l in res.split("\n") if l.strip()]
         valid = [l for l in lines if len(l) < 60]
-        return valid[:4] if len(valid) >= 2 else ["Chẩn đoán phân biệt", "Phác đồ điều trị", "Tương tác thuốc", "Chỉ định cận lâm sàng"]
+        if len(valid) >= 2:
+            return valid[:4]
+        return ["Chẩn đoán phân biệt", "Phác đồ điều trị", "Tương tác thuốc", "Chỉ định cận lâm sàng"] if fallback else []
     except:
-        return ["Chẩn đoán phân biệt", "Hướng xử trí", "Liều dùng thuốc", "Cận lâm sàng tiếp theo"]
\ No newline at end of file
+        return ["Chẩn đoán phân biệt", "Hướng xử trí", "Liều dùng thuốc", "Cận lâm sàng tiếp theo"] if fallback else []
\ No newline at end of file
@@ -9,7 +9,9 @@ AI Advisor cho Bệnh nhân (Patient Portal)
 from datetime import datetime, date
 from bson import ObjectId
 from app.extensions import mongo_db
-from .gemini_service import gemini_chat_streaming, gemini_chat, clear_chat_session
+from .gemini_service import gemini_chat_streaming, gemini_chat
+from .ehr_context_cache import get_ehr_context, set_ehr_context
+from .chat_context import EHR_CONTEXT_TOKEN_BUDGET, truncate_to_budget
 
 # --- SYSTEM PROMPT: Trái tim của AI Bệnh nhân ---
 PATIENT_SYSTEM_PROMPT = """Bạn là Trợ lý Y tế AI (AI Health Assistant).
@@ -56,11 +58,26 @@ def _format_date(d):
     return str(d)
 
 def get_patient_ehr_context(patient_id: str) -> str:
+    """
+    Context hồ sơ bệnh án cho AI, lấy từ cache nếu có.
+    Cache bị xoá khi hồ sơ/EHR của bệnh nhân thay đổi (invalidate_ehr_context).
+    """
+    if not patient_id: return ""
+    cached = get_ehr_context(patient_id)
+    if cached is not None:
+        return cached
+
+    context = _build_patient_ehr_context(patient_id)
+    if context is not None:
+        set_ehr_context(patient_id, context)
+    return context or ""
+
+def _build_patient_ehr_context(patient_id: str):
     """
     Trích xuất và tóm tắt hồ sơ bệnh án từ MongoDB để nạp vào não AI.
+    Trả None nếu lỗi (không cache).
     """
     try:
-        if not patient_id: return ""
         pid = ObjectId(patient_id)
         
         # 1. Lấy thông tin cơ bản
@@ -116,14 +133,18 @@ def get_patient_ehr_context(patient_id: str) -> str:
 
     except Exception as e:
         print(f"⚠️ Lỗi đọc EHR patient: {e}")
-        return ""
+        return None
 
-def advise_patient(user_message: str, conversation_id: str, patient_id: str = None) -> str:
+def advise_patient(user_message: str, conversation_id: str, patient_id: str = None, on_chunk=None,
+                   user_message_id=None) -> str:
     """
     Hàm chính xử lý chat cho bệnh nhân.
+    on_chunk: callback nhận từng đoạn text khi AI đang trả lời (streaming).
+    user_message_id: _id tin user đã lưu trước khi gọi (không nạp lại vào history).
     """
-    # 1. Lấy context (nếu có patient_id)
+    # 1. Lấy context (nếu có patient_id), giới hạn theo ngân sách token
     ehr_context = get_patient_ehr_context(patient_id) if patient_id else ""
+    ehr_context = truncate_to_budget(ehr_context, EHR_CONTEXT_TOKEN_BUDGET)
     
     # 2. Ghép vào System Prompt
     full_system = PATIENT_SYSTEM_PROMPT
@@ -134,19 +155,28 @@ def advise_patient(user_message: str, conversation_id: str, patient_id: str = No
     return gemini_chat_streaming(
         conversation_id=conversation_id,
         user_prompt=user_message,
-        system=full_system
+        system=full_system,
+        on_chunk=on_chunk,
+        use_case="patient_chat",
+        exclude_message_id=user_message_id,
     )
 
-def get_patient_suggestions(context: str = "") -> list:
-    """Gợi ý câu hỏi nhanh (Smart Reply)"""
+def get_patient_suggestions(context: str = "", fallback: bool = True) -> list:
+    """
+    Gợi ý câu hỏi nhanh (Smart Reply).
+    fallback=False → trả [] thay cho danh sách mặc định khi AI bận/lỗi (chỉ giữ output thật của model).
+    """
     prompt = "Đóng vai bệnh nhân, gợi ý 4 câu hỏi ngắn (dưới 10 từ) để hỏi bác sĩ/trợ lý. Chỉ trả về text, không số."
     if context:
         prompt = f"Dựa trên ngữ cảnh: '{context}'. {prompt}"
     
     try:
         # Dùng chat thường (1-shot) cho nhanh
-        res = gemini_chat(prompt, temperature=0.7)
+        # context là nội dung hội thoại (PHI) → không cache; không context → prompt cố định, cache được
+        res = gemini_chat(prompt, temperature=0.7, cache_response=not context, use_case="suggestions")
         lines = [line.strip("- *\"") for line in res.split("\n") if line.strip()]
-        return lines[:4] if len(lines) >= 2 else ["Đặt lịch khám", "Tôi cần kiêng gì?", "Uống thuốc thế nào?", "Khi nào tái khám?"]
+        if len(lines) >= 2:
+            return lines[:4]
+        return ["Đặt lịch khám", "Tôi cần kiêng gì?", "Uống thuốc thế nào?", "Khi nào tái khám?"] if fallback else []
     except:
-        return ["Đặt lịch khám mới", "Tác dụng phụ thuốc", "Chế độ ăn uống", "Triệu chứng này là gì?"]
\ No newline at end of file
+        return ["Đặt lịch khám mới", "Tác dụng phụ thuốc", "Chế độ ăn uống", "Triệu chứng này là gì?"] if fallback else []
\ No newline at end of file
@@ -2,6 +2,7 @@
 from datetime import datetime, timedelta
 from bson import ObjectId
 from app.extensions import mongo_db
+from app.services.redis_cache import cache, TAG_APPOINTMENTS, TAG_STATS, doctor_tag
 
 class AppointmentService:
     
@@ -108,6 +109,7 @@ class AppointmentService:
         }
         
         result = mongo_db.appointments.insert_one(appointment)
+        cache.invalidate_tags(TAG_APPOINTMENTS, TAG_STATS, doctor_tag(appointment["doctor_id"]))
         appointment["_id"] = str(result.inserted_id)
         appointment["slot_id"] = str(appointment["slot_id"])
         appointment["patient_id"] = str(appointment["patient_id"])
@@ -262,6 +264,7 @@ class AppointmentService:
                 "updated_at": datetime.utcnow()
             }}
         )
+        cache.invalidate_tags(TAG_APPOINTMENTS, TAG_STATS, doctor_tag(appt.get("doctor_id")))
         
         return {"success": True, "message": "Đã hủy lịch khám"}
     
@@ -0,0 +1,179 @@
+# backend/app/services/cache_codec.py
+"""
+Codec cho payload cache (Redis + memory tier).
+
+Khung bytes: [version][serializer][compression] + body
+- serializer: msgpack (ext type cho ObjectId/datetime/date) nếu có thư viện,
+  ngược lại JSON có đánh dấu kiểu ({"$oid": ...}, {"$date": ...}) → vẫn giữ đúng kiểu.
+- compression: body >= CACHE_COMPRESS_MIN_BYTES thì nén zstd (nếu có) hoặc zlib,
+  chỉ giữ bản nén khi thực sự nhỏ hơn.
+Payload cũ (JSON text không có header) vẫn đọc được.
+"""
+from __future__ import annotations
+import json
+import os
+import zlib
+from datetime import date, datetime
+from typing import Any, Optional
+
+from bson import ObjectId
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    msgpack = None
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    zstandard = None
+
+VERSION = 1
+
+SER_JSON = ord("j")
+SER_MSGPACK = ord("m")
+
+COMP_NONE = ord("n")
+COMP_ZLIB = ord("z")
+COMP_ZSTD = ord("s")
+
+# msgpack ext type codes
+EXT_OBJECTID = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+
+
+class CodecError(ValueError):
+    """Payload không giải mã được (sai version / hỏng dữ liệu)."""
+
+
+# ---------- msgpack ----------
+def _msgpack_default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return msgpack.ExtType(EXT_OBJECTID, obj.binary)
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode("ascii"))
+    if isinstance(obj, date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode("ascii"))
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == EXT_OBJECTID:
+        return ObjectId(data)
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode("ascii"))
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode("ascii"))
+    return msgpack.ExtType(code, data)
+
+
+# ---------- JSON (fallback, giữ kiểu bằng object có đánh dấu) ----------
+def _json_default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return {"$oid": str(obj)}
+    if isinstance(obj, datetime):
+        return {"$date": obj.isoformat()}
+    if isinstance(obj, date):
+        return {"$day": obj.isoformat()}
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def _json_hook(obj: dict):
+    if len(obj) == 1:
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+        if "$date" in obj:
+            return datetime.fromisoformat(obj["$date"])
+        if "$day" in obj:
+            return date.fromisoformat(obj["$day"])
+    return obj
+
+
+class CacheCodec:
+    def __init__(self, serializer: str = "msgpack", compression: str = "auto",
+                 compress_min_bytes: int = 1024, level: int = 3):
+        self.serializer = SER_MSGPACK if serializer == "msgpack" and MSGPACK_AVAILABLE else SER_JSON
+        if compression == "auto":
+            compression = "zstd" if ZSTD_AVAILABLE else "zlib"
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            compression = "zlib"
+        self.compression = {"zstd": COMP_ZSTD, "zlib": COMP_ZLIB}.get(compression, COMP_NONE)
+        self.compress_min_bytes = max(0, int(compress_min_bytes))
+        self.level = level
+        self._zstd_c = zstandard.ZstdCompressor(level=level) if self.compression == COMP_ZSTD else None
+        self._zstd_d = zstandard.ZstdDecompressor() if ZSTD_AVAILABLE else None
+
+    # ---------- encode ----------
+    def _serialize(self, value: Any) -> bytes:
+        if self.serializer == SER_MSGPACK:
+            return msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+        return json.dumps(value, default=_json_default, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    def _compress(self, body: bytes):
+        if self.compression == COMP_NONE or len(body) < self.compress_min_bytes:
+            return COMP_NONE, body
+        if self.compression == COMP_ZSTD:
+            packed = self._zstd_c.compress(body)
+        else:
+            packed = zlib.compress(body, self.level)
+        if len(packed) >= len(body):
+            return COMP_NONE, body
+        return self.compression, packed
+
+    def encode(self, value: Any) -> bytes:
+        comp, body = self._compress(self._serialize(value))
+        return bytes((VERSION, self.serializer, comp)) + body
+
+    # ---------- decode ----------
+    def decode(self, payload: Optional[bytes]) -> Any:
+        if payload is None:
+            return None
+        if isinstance(payload, str):
+            return json.loads(payload)          # payload JSON cũ (decode_responses=True)
+        if not payload or payload[0] != VERSION:
+            return json.loads(payload)          # bytes JSON cũ, không có header
+        if len(payload) < 3:
+            raise CodecError("Payload cache quá ngắn")
+        serializer, comp, body = payload[1], payload[2], payload[3:]
+
+        if comp == COMP_ZSTD:
+            if self._zstd_d is None:
+                raise CodecError("Payload nén zstd nhưng thiếu thư viện zstandard")
+            body = self._zstd_d.decompress(body)
+        elif comp == COMP_ZLIB:
+            body = zlib.decompress(body)
+        elif comp != COMP_NONE:
+            raise CodecError(f"Kiểu nén không hỗ trợ: {comp}")
+
+        if serializer == SER_MSGPACK:
+            if not MSGPACK_AVAILABLE:
+                raise CodecError("Payload msgpack nhưng thiếu thư viện msgpack")
+            return msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+        if serializer == SER_JSON:
+            return json.loads(body, object_hook=_json_hook)
+        raise CodecError(f"Serializer không hỗ trợ: {serializer}")
+
+    def describe(self) -> dict:
+        return {
+            "version": VERSION,
+            "serializer": "msgpack" if self.serializer == SER_MSGPACK else "json",
+            "compression": {COMP_ZSTD: "zstd", COMP_ZLIB: "zlib"}.get(self.compression, "none"),
+            "compress_min_bytes": self.compress_min_bytes,
+        }
+
+
+codec = CacheCodec(
+    serializer=os.getenv("CACHE_CODEC", "msgpack").lower(),
+    compression=os.getenv("CACHE_COMPRESSION", "auto").lower(),
+    compress_min_bytes=int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024")),
+)
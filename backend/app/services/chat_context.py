@@ -0,0 +1,207 @@
+# backend/app/services/chat_context.py
+"""
+Ngân sách token cho context chat AI + tóm tắt hội thoại cuốn chiếu (rolling summary).
+
+- Giữ nguyên văn các lượt gần nhất trong AI_HISTORY_TOKEN_BUDGET.
+- Lượt cũ hơn được gộp vào `conversations.ai_summary` (text + mốc `upto`/`upto_id` = created_at
+  và _id của tin cuối đã tóm tắt; _id phân định các tin trùng created_at). Lần sau chỉ đọc tin sau mốc đó.
+- Tóm tắt chỉ được tính lại khi cửa sổ trượt (phần tin sau mốc vượt ngân sách);
+  khi trượt thì cắt xuống còn ~nửa ngân sách để không phải tóm tắt lại mỗi lượt.
+- Sau mốc có hơn MAX_HISTORY_MESSAGES tin (hội thoại cũ chưa từng tóm tắt) → tóm tắt dần từng
+  đoạn cũ nhất cho tới khi mốc đuổi kịp, không bỏ sót tin nằm ngoài giới hạn đọc.
+
+Token được ước lượng theo byte UTF-8 / 4 (hơi dư với tiếng Việt có dấu → an toàn),
+không tốn round-trip count_tokens.
+"""
+from __future__ import annotations
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from app.extensions import mongo_db
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "6000"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("AI_SUMMARY_TOKEN_BUDGET", "600"))
+EHR_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_EHR_TOKEN_BUDGET", "1500"))
+MAX_HISTORY_MESSAGES = 200   # số tin tối đa đọc sau mốc tóm tắt (phần dư được tóm tắt trước)
+KEEP_RATIO = 0.5             # khi trượt: giữ lại ~50% ngân sách cho tin nguyên văn
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Bạn tóm tắt hội thoại giữa người dùng và trợ lý y tế AI để làm bộ nhớ dài hạn. "
+    "Giữ lại: triệu chứng, thuốc, dị ứng, chỉ số, lời khuyên đã đưa ra, câu hỏi còn bỏ ngỏ. "
+    "Viết tiếng Việt, văn bản thuần, gạch đầu dòng ngắn, không bịa thêm."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """Cắt text để không vượt max_tokens (ước lượng), giữ phần đầu."""
+    if not text or max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return text
+    data = text.encode("utf-8")[: max_tokens * 4]
+    return data.decode("utf-8", errors="ignore").rstrip() + "\n...(đã rút gọn)"
+
+
+def _role_of(m: Dict[str, Any]) -> str:
+    return "model" if (m.get("sender") or m.get("role")) in ["ai", "model"] else "user"
+
+
+def _transcript(msgs: Iterable[Dict[str, Any]]) -> str:
+    lines = []
+    for m in msgs:
+        text = (m.get("text") or "").strip()
+        if text:
+            lines.append(f"{'AI' if _role_of(m) == 'model' else 'Người dùng'}: {text}")
+    return "\n".join(lines)
+
+
+def _summarize(previous: str, dropped: List[Dict[str, Any]]) -> Optional[str]:
+    """Gộp tóm tắt cũ + các tin vừa trượt khỏi cửa sổ → tóm tắt mới (None nếu lỗi)."""
+    from app.services.gemini_service import gemini_chat
+
+    transcript = truncate_to_budget(_transcript(dropped), HISTORY_TOKEN_BUDGET)
+    if not transcript:
+        return previous or None
+    prompt = (
+        f"TÓM TẮT HIỆN CÓ:\n{previous or '(chưa có)'}\n\n"
+        f"ĐOẠN HỘI THOẠI MỚI CẦN GỘP:\n{transcript}\n\n"
+        f"Viết lại bản tóm tắt đầy đủ (tối đa ~{SUMMARY_TOKEN_BUDGET * 3} ký tự)."
+    )
+    try:
+        # nội dung hội thoại là PHI → không cache
+        text = gemini_chat(
+            prompt,
+            system=SUMMARY_SYSTEM_PROMPT,
+            temperature=0.2,
+            max_tokens=SUMMARY_TOKEN_BUDGET * 2,
+            cache_response=False,
+            use_case="summary",
+        )
+    except Exception as e:
+        print(f"⚠️ Summarize error: {e}")
+        return None
+    return truncate_to_budget(text, SUMMARY_TOKEN_BUDGET) if text else None
+
+
+def _after_watermark(conv_oid: ObjectId, summary: Dict[str, Any], exclude_message_id=None) -> Dict[str, Any]:
+    """Query các tin sau mốc tóm tắt; (created_at, _id) để tin trùng created_at với mốc không bị bỏ."""
+    query: Dict[str, Any] = {"conversation_id": conv_oid}
+    upto, upto_id = summary.get("upto"), summary.get("upto_id")
+    if upto and upto_id:
+        query["$or"] = [
+            {"created_at": {"$gt": upto}},
+            {"created_at": upto, "_id": {"$gt": upto_id}},
+        ]
+    elif upto:
+        query["created_at"] = {"$gt": upto}   # tóm tắt cũ chưa có upto_id
+    if exclude_message_id:
+        query["_id"] = {"$ne": exclude_message_id}
+    return query
+
+
+def _chunks_by_budget(msgs: List[Dict[str, Any]]) -> Iterable[List[Dict[str, Any]]]:
+    """Chia tin thành các đoạn ≤ HISTORY_TOKEN_BUDGET (mỗi đoạn ≥ 1 tin) để _summarize không phải cắt bớt."""
+    chunk: List[Dict[str, Any]] = []
+    used = 0
+    for m in msgs:
+        size = estimate_tokens(m.get("text") or "")
+        if chunk and used + size > HISTORY_TOKEN_BUDGET:
+            yield chunk
+            chunk, used = [], 0
+        chunk.append(m)
+        used += size
+    if chunk:
+        yield chunk
+
+
+def _fold_into_summary(conv_oid: ObjectId, summary: Dict[str, Any], msgs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Gộp msgs (theo thứ tự thời gian) vào tóm tắt từng đoạn, lưu mốc sau mỗi đoạn.
+    AI lỗi → dừng ở đoạn đó (mốc giữ nguyên, lần sau thử lại). Trả ai_summary mới nhất.
+    """
+    for chunk in _chunks_by_budget(msgs):
+        new_text = _summarize(summary.get("text") or "", chunk)
+        if not new_text:
+            break
+        summary = {
+            "text": new_text,
+            "upto": chunk[-1].get("created_at"),
+            "upto_id": chunk[-1].get("_id"),
+            "summarized_count": int(summary.get("summarized_count") or 0) + len(chunk),
+            "updated_at": datetime.utcnow(),
+        }
+        mongo_db.conversations.update_one({"_id": conv_oid}, {"$set": {"ai_summary": summary}})
+    return summary
+
+
+def build_history(conversation_id: str, exclude_message_id=None) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    → (tóm tắt các lượt cũ, các tin gần nhất giữ nguyên văn theo thứ tự thời gian).
+    Cập nhật `conversations.ai_summary` khi cửa sổ trượt.
+    exclude_message_id: tin user vừa lưu trước khi gọi AI (sẽ được gửi làm prompt) → không đưa vào history.
+    """
+    try:
+        conv_oid = ObjectId(conversation_id)
+    except Exception:
+        return "", []
+
+    conv = mongo_db.conversations.find_one({"_id": conv_oid}, {"ai_summary": 1}) or {}
+    summary = conv.get("ai_summary") or {}
+    fields = {"text": 1, "sender": 1, "role": 1, "created_at": 1}
+
+    # Quá MAX_HISTORY_MESSAGES tin sau mốc → tóm tắt các tin cũ nhất trước cho tới khi mốc đuổi kịp
+    while True:
+        query = _after_watermark(conv_oid, summary, exclude_message_id)
+        overflow = mongo_db.messages.count_documents(query) - MAX_HISTORY_MESSAGES
+        if overflow <= 0:
+            break
+        oldest = list(mongo_db.messages.find(query, fields)
+                      .sort([("created_at", 1), ("_id", 1)]).limit(min(overflow, MAX_HISTORY_MESSAGES)))
+        before = summary.get("summarized_count")
+        summary = _fold_into_summary(conv_oid, summary, oldest)
+        if summary.get("summarized_count") == before:
+            break   # AI lỗi → giữ nguyên, dùng cửa sổ mới nhất như cũ
+
+    msgs = list(mongo_db.messages.find(query, fields)
+                .sort([("created_at", -1), ("_id", -1)]).limit(MAX_HISTORY_MESSAGES))
+    msgs.reverse()
+    summary_text = summary.get("text") or ""
+
+    sizes = [estimate_tokens(m.get("text") or "") for m in msgs]
+    if sum(sizes) <= HISTORY_TOKEN_BUDGET:
+        return summary_text, msgs          # cửa sổ chưa trượt → dùng tóm tắt sẵn có
+
+    # Trượt: giữ tin mới nhất trong KEEP_RATIO ngân sách, phần còn lại gộp vào tóm tắt
+    keep_budget = HISTORY_TOKEN_BUDGET * KEEP_RATIO
+    used, cut = 0, len(msgs)
+    while cut > 0 and (used + sizes[cut - 1] <= keep_budget or cut == len(msgs)):
+        cut -= 1
+        used += sizes[cut]
+    dropped, kept = msgs[:cut], msgs[cut:]
+    if not dropped:
+        return summary_text, kept
+
+    summary = _fold_into_summary(conv_oid, summary, dropped)
+    return summary.get("text") or "", kept
+
+
+def history_tokens(chat) -> int:
+    """Ước lượng token của history đang nằm trong session SDK (0 nếu không đọc được)."""
+    get_history = getattr(chat, "get_history", None)
+    if get_history is None:
+        return 0
+    try:
+        total = 0
+        for content in get_history():
+            for part in content.parts or []:
+                total += estimate_tokens(getattr(part, "text", None) or "")
+        return total
+    except Exception:
+        return 0
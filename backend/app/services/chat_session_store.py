@@ -0,0 +1,13 @@
+# backend/app/services/chat_session_store.py
+"""
+Kho session chat AI trong RAM: LRU giới hạn số lượng + TTL theo thời gian rảnh.
+
+Session bị loại (đầy hoặc quá hạn) không mất dữ liệu: lần sau
+`get_or_create_chat_session` dựng lại từ `mongo_db.messages`.
+Cài đặt chung nằm ở TTLStore (ttl_store).
+"""
+from __future__ import annotations
+
+from app.services.ttl_store import TTLStore
+
+ChatSessionStore = TTLStore
@@ -0,0 +1,32 @@
+# backend/app/services/ehr_context_cache.py
+"""
+Cache context EHR đã render (system prompt AI bệnh nhân) theo patient_id.
+
+Chỉ giữ trong RAM của process (dữ liệu bảo mật, không đẩy lên Redis).
+Nơi ghi `patients` / `ehr_records` gọi `invalidate_ehr_context(patient_id)`;
+TTL chỉ là lưới an toàn cho các đường ghi chưa hook.
+"""
+from __future__ import annotations
+import os
+from typing import Optional
+
+from app.services.ttl_store import TTLStore
+
+ehr_contexts = TTLStore(
+    max_size=int(os.getenv("EHR_CONTEXT_CACHE_MAX", "1000")),
+    ttl_seconds=float(os.getenv("EHR_CONTEXT_CACHE_TTL", "900")),
+)
+
+
+def get_ehr_context(patient_id: str) -> Optional[str]:
+    return ehr_contexts.get(str(patient_id))
+
+
+def set_ehr_context(patient_id: str, context: str) -> None:
+    ehr_contexts.set(str(patient_id), context)
+
+
+def invalidate_ehr_context(patient_id) -> None:
+    """Bỏ context đã cache của bệnh nhân (nhận str hoặc ObjectId; None → bỏ qua)."""
+    if patient_id:
+        ehr_contexts.pop(str(patient_id))
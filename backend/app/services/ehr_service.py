@@ -2,6 +2,8 @@
 from datetime import datetime
 from bson import ObjectId
 from app.extensions import mongo_db, socketio
+from app.services.ehr_context_cache import invalidate_ehr_context
+from app.services.redis_cache import cache, doctor_tag, TAG_APPOINTMENTS, TAG_STATS
 
 def clean_for_json(obj):
     """
@@ -181,6 +183,7 @@ class EHRService:
         
         # Insert record
         result = mongo_db.ehr_records.insert_one(record_doc)
+        invalidate_ehr_context(patient_oid)
         
         # ✅ CRITICAL: Update appointment status to 'completed' after saving EHR
         if appointment_id:
@@ -197,6 +200,7 @@ class EHRService:
                     }
                 )
                 print(f"✅ Updated appointment {appointment_id} to 'completed'")
+                cache.invalidate_tags(TAG_APPOINTMENTS, TAG_STATS, doctor_tag(doctor_oid))
             except Exception as e:
                 print(f"⚠️ Failed to update appointment status: {e}")
         
@@ -608,6 +612,7 @@ class EHRService:
         
         # Insert new version
         result = mongo_db.ehr_records.insert_one(new_record)
+        invalidate_ehr_context(new_record["patient_id"])
         new_record["_id"] = str(result.inserted_id)
         new_record["patient_id"] = str(new_record["patient_id"])
         new_record["doctor_id"] = str(new_record["doctor_id"])
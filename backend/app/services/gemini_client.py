@@ -0,0 +1,187 @@
+# backend/app/services/gemini_client.py
+"""
+Cổng gọi Gemini: giới hạn đồng thời + hàng chờ có backpressure + deadline từng request.
+
+- Tối đa GEMINI_MAX_CONCURRENCY call chạy cùng lúc; tối đa GEMINI_MAX_QUEUE call chờ slot.
+  Hàng chờ đầy (hoặc chờ quá GEMINI_QUEUE_TIMEOUT giây) → AIBusyError (HTTP 429 + Retry-After),
+  nên traffic AI không chiếm hết green thread của phần API còn lại.
+- Deadline: mỗi call chạy trong eventlet.Timeout (chỉ cắt khi đang chờ IO "xanh", đúng
+  trường hợp HTTP tới Google chậm). Thay cho socket.setdefaulttimeout toàn cục.
+- sleep()/deadline dùng eventlet khi có (monkey_patch) → chờ retry không khoá worker.
+"""
+from __future__ import annotations
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from app.utils.errors import APIError
+
+try:
+    import eventlet
+    from eventlet.timeout import Timeout as _GreenTimeout
+except ImportError:  # chạy script ngoài server (không có eventlet)
+    eventlet = None
+    _GreenTimeout = None
+
+T = TypeVar("T")
+
+
+class AIBusyError(APIError):
+    """Cổng AI đã đầy → client nên thử lại sau `retry_after` giây."""
+    status_code = 429
+    message = "Trợ lý AI đang quá tải, vui lòng thử lại sau."
+
+    def __init__(self, retry_after: int = 1, message: Optional[str] = None):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def sleep(seconds: float) -> None:
+    """Sleep nhường CPU cho green thread khác (eventlet), fallback time.sleep."""
+    if seconds <= 0:
+        return
+    if eventlet is not None:
+        eventlet.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Timeout / mất kết nối (kể cả eventlet.Timeout, lỗi httpx) → đáng retry và tính lỗi cho model."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if _GreenTimeout is not None and isinstance(error, _GreenTimeout):
+        return True
+    name = type(error).__name__.lower()
+    return any(w in name for w in ("timeout", "connect", "network", "protocolerror"))
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status của lỗi SDK (google.genai.errors.APIError.code / .status_code), None nếu không có."""
+    for attr in ("code", "status_code"):
+        try:
+            code = int(getattr(error, attr))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if 100 <= code <= 599:
+            return code
+    return None
+
+
+class Deadline:
+    """Mốc hết hạn tuyệt đối (monotonic) dùng chung cho các lần retry của 1 request."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.at = time.monotonic() + seconds if seconds and seconds > 0 else None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+
+class GeminiGate:
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 16, queue_timeout: float = 5.0):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._sem = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._avg_hold = 2.0         # EWMA thời gian giữ slot (giây) → ước lượng Retry-After
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _retry_after(self) -> int:
+        backlog = self._waiting + 1
+        return max(1, math.ceil(self._avg_hold * backlog / self.max_concurrency))
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Giữ 1 slot gọi Gemini; hàng chờ đầy/chờ quá lâu → AIBusyError."""
+        with self._lock:
+            if self._active >= self.max_concurrency and self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise AIBusyError(self._retry_after())
+            self._waiting += 1
+        try:
+            acquired = self._sem.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+                retry_after = self._retry_after()
+            raise AIBusyError(retry_after)
+
+        with self._lock:
+            self._active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            self._sem.release()
+
+    def has_capacity(self) -> bool:
+        """Còn slot rảnh và không ai đang chờ (việc nền chỉ chạy khi không tranh slot với user)."""
+        with self._lock:
+            return self._active < self.max_concurrency and self._waiting == 0
+
+    @contextmanager
+    def deadline(self, seconds: Optional[float]) -> Iterator[None]:
+        """Cắt phần việc bên trong nếu vượt `seconds` (cần eventlet; không có → không cắt)."""
+        if not seconds or seconds <= 0 or _GreenTimeout is None:
+            yield
+            return
+        timer = _GreenTimeout(seconds)
+        try:
+            yield
+        except _GreenTimeout as t:
+            if t is not timer:
+                raise
+            with self._lock:
+                self.timeouts += 1
+            raise DeadlineExceeded(f"Gemini call exceeded {seconds:.0f}s deadline")
+        finally:
+            timer.cancel()
+
+    def call(self, fn: Callable[[], T], *, timeout: Optional[float] = None) -> T:
+        """Chạy fn() trong 1 slot với deadline `timeout` giây."""
+        with self.slot(), self.deadline(timeout):
+            return fn()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_call_seconds": round(self._avg_hold, 3),
+        }
+
+
+# Global gate instance
+gemini_gate = GeminiGate(
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "5")),
+)
@@ -6,19 +6,33 @@ Sử dụng: google-genai SDK (Latest)
 Cấu hình: Ưu tiên GEMINI 2.5 PRO.
 Tính năng:
 - Auto Fallback: Nếu 2.5 chưa có, tự dùng 1.5 Pro.
-- Smart Context: Nhớ 50 lượt chat gần nhất.
+- Circuit breaker: model lỗi liên tục bị bỏ qua trong cooldown (model_health).
+- Smart Context: Giữ nguyên văn các lượt gần nhất theo ngân sách token, lượt cũ → tóm tắt (chat_context).
 - Retry: Tự động thử lại khi rớt mạng.
+- Giới hạn đồng thời + deadline + backpressure 429 (gemini_client.gemini_gate).
 - Hỗ trợ cả Streaming và One-shot.
+- Provider theo use case (llm_providers): Gemini mặc định, hoặc model local / fake qua LLM_ROUTES.
 """
 from __future__ import annotations
 import os
 import time
-import socket
+import hashlib
+import threading
 from typing import Optional, List, Callable
 
 from google import genai
 from google.genai import types
-from bson import ObjectId
+
+from app.services.chat_session_store import ChatSessionStore
+from app.services.redis_cache import cache
+from app.services.gemini_client import (
+    AIBusyError, Deadline, DeadlineExceeded, gemini_gate, is_transient_error, sleep, status_code,
+)
+from app.services.model_health import ModelHealthTracker
+from app.services.chat_context import HISTORY_TOKEN_BUDGET, build_history, history_tokens
+from app.services.llm_providers import (
+    GEMINI, LLMProvider, forget_conversation, get_provider, register_provider, routing_table,
+)
 
 # =======================
 # 1. CẤU HÌNH MODEL
@@ -34,7 +48,16 @@ FALLBACK_MODELS = [
     "gemini-2.0-flash-exp", # Ưu tiên 4
 ]
 
-socket.setdefaulttimeout(30)
+# Sức khoẻ từng model: mở circuit sau N lỗi liên tiếp, cooldown rồi thăm dò lại
+model_health = ModelHealthTracker(
+    FALLBACK_MODELS,
+    failure_threshold=int(os.getenv("GEMINI_CB_FAILURES", "3")),
+    cooldown=float(os.getenv("GEMINI_CB_COOLDOWN", "30")),
+)
+
+# Deadline từng request (giây): one-shot và streaming (cả quá trình đọc stream)
+REQUEST_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+STREAM_TIMEOUT = float(os.getenv("GEMINI_STREAM_TIMEOUT", "120"))
 
 # =======================
 # 2. KHỞI TẠO CLIENT
@@ -53,7 +76,11 @@ def _build_client() -> Optional[genai.Client]:
     print(f"🌐 Khởi động Gemini Service [Target: {TARGET_MODEL}]...")
     for attempt in range(1, 4):
         try:
-            client = genai.Client(api_key=api_key)
+            # timeout HTTP riêng cho client (ms) thay vì socket.setdefaulttimeout toàn cục
+            client = genai.Client(
+                api_key=api_key,
+                http_options=types.HttpOptions(timeout=int(REQUEST_TIMEOUT * 1000)),
+            )
             print("✅ Kết nối Google AI thành công.")
             return client
         except Exception as e:
@@ -68,8 +95,14 @@ try:
 except:
     client = None
 
-# Cache session trong RAM
-chat_sessions: dict[str, any] = {}
+# Cache session trong RAM: LRU + TTL rảnh (miss → dựng lại từ mongo_db.messages)
+chat_sessions = ChatSessionStore(
+    max_size=int(os.getenv("GEMINI_SESSION_MAX", "500")),
+    ttl_seconds=float(os.getenv("GEMINI_SESSION_TTL", "1800")),
+)
+
+# Cache câu trả lời one-shot (gemini_chat) trong CacheService: key = prompt chuẩn hoá + system + temperature + model
+ONE_SHOT_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", "3600"))  # 0 = tắt
 
 # =======================
 # 3. CÁC HÀM CẤU HÌNH
@@ -93,34 +126,90 @@ def get_safety_settings():
 # =======================
 RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
 
-def _with_backoff(call_fn: Callable[[str], any], *, attempts: int = 3):
-    """Thử gọi API với cơ chế đổi model nếu lỗi."""
+def _with_backoff(
+    call_fn: Callable[[str], any],
+    *,
+    attempts: int = 3,
+    deadline: Optional[Deadline] = None,
+    track: bool = True,
+):
+    """
+    Thử gọi API với cơ chế đổi model nếu lỗi.
+    Thứ tự model lấy từ model_health (model đang mở circuit bị đẩy xuống cuối).
+    deadline: hạn chót chung cho mọi lần thử (không retry/sleep vượt quá).
+    track: ghi nhận kết quả vào model_health (False khi call_fn không dùng model_name).
+
+    Phân loại lỗi theo status code của SDK (không dò chuỗi):
+    - 404 (model không tồn tại) → mở circuit ngay, đổi model.
+    - 408/409/429/5xx, timeout, mất kết nối (kể cả eventlet.Timeout) → tính lỗi cho model, retry.
+    - 400 và 4xx khác (prompt hỏng, bị chặn an toàn...) → chỉ fail request này, không tính cho model.
+    Mọi đường thoát đều trả lượt thăm dò half-open (ghi nhận kết quả hoặc end_probe).
+    """
     last_exc = None
+    models = model_health.order() if track else list(FALLBACK_MODELS)
     model_idx = 0
     
     for attempt in range(1, attempts + 1):
-        current_model = FALLBACK_MODELS[model_idx]
+        if deadline is not None and deadline.expired() and last_exc is not None:
+            break
+        # giữ lượt thăm dò cho model half-open; model đang mở/đang có request thăm dò → bỏ qua
+        while track and model_idx + 1 < len(models) and not model_health.begin_probe(models[model_idx]):
+            model_idx += 1
+        current_model = models[model_idx]
+        started = time.monotonic()
+        settled = not track   # đã ghi nhận kết quả / trả lượt thăm dò cho model này chưa
         try:
-            return call_fn(current_model)
+            result = call_fn(current_model)
+            if track:
+                model_health.record_success(current_model, time.monotonic() - started)
+                settled = True
+            return result
         except Exception as e:
             last_exc = e
-            err_msg = str(e).lower()
+            code = status_code(e)
             
-            # Lỗi model không tồn tại -> Đổi model
-            if "404" in err_msg or "not found" in err_msg or "400" in err_msg:
-                print(f"⚠️ Model '{current_model}' lỗi/không có. Fallback...")
-                if model_idx + 1 < len(FALLBACK_MODELS):
+            # Model không tồn tại -> mở circuit, đổi model
+            if code == 404:
+                print(f"⚠️ Model '{current_model}' không có. Fallback...")
+                if track:
+                    model_health.record_failure(current_model, e, fatal=True)
+                    settled = True
+                if model_idx + 1 < len(models):
                     model_idx += 1
                     continue
-                else:
-                    break
+                break
             
-            # Lỗi mạng -> Retry
-            if any(str(c) in err_msg for c in RETRY_STATUS):
-                time.sleep(1 * (2 ** (attempt - 1)))
+            # Lỗi của chính request (400, safety...) -> không phải lỗi model
+            if code is not None and code < 500 and code not in RETRY_STATUS:
+                break
+            
+            # Mọi lỗi còn lại đều tính cho model
+            if track:
+                model_health.record_failure(current_model, e)
+                settled = True
+            
+            # Lỗi tạm thời -> Retry (model vừa bị mở circuit → chuyển model kế tiếp)
+            if code in RETRY_STATUS or (code is not None and code >= 500) or is_transient_error(e):
+                if track and model_health.is_open(current_model) and model_idx + 1 < len(models):
+                    model_idx += 1
+                    continue
+                delay = 1 * (2 ** (attempt - 1))
+                remaining = deadline.remaining() if deadline is not None else None
+                if remaining is not None and remaining <= delay:
+                    break
+                sleep(delay)
                 continue
                 
             break
+        except BaseException as e:
+            # eventlet.Timeout (deadline bên ngoài) / greenlet bị kill: không đi qua except Exception
+            if track and is_transient_error(e):
+                model_health.record_failure(current_model, DeadlineExceeded(f"{type(e).__name__}: hết thời gian"))
+                settled = True
+            raise
+        finally:
+            if not settled:
+                model_health.end_probe(current_model)
             
     print(f"❌ API Failed: {last_exc}")
     raise last_exc
@@ -128,108 +217,256 @@ def _with_backoff(call_fn: Callable[[str], any], *, attempts: int = 3):
 # =======================
 # 5. QUẢN LÝ SESSION
 # =======================
-def get_or_create_chat_session(conversation_id: str, system_prompt: str = None):
+def get_or_create_chat_session(conversation_id: str, system_prompt: str = None, exclude_message_id=None):
     if not client: return None
-    if conversation_id in chat_sessions: return chat_sessions[conversation_id]
+    cached = chat_sessions.get(conversation_id)
+    if cached is not None: return cached
 
     history_sdk = []
     try:
-        from app.extensions import mongo_db
-        msgs = list(mongo_db.messages.find({"conversation_id": ObjectId(conversation_id)})
-                    .sort("created_at", -1).limit(50))
-        msgs.reverse()
-
+        # Lượt gần nhất nguyên văn (trong ngân sách token) + tóm tắt các lượt cũ hơn
+        summary, msgs = build_history(conversation_id, exclude_message_id)
         for m in msgs:
             role = "model" if (m.get("sender") or m.get("role")) in ["ai", "model"] else "user"
             text = m.get("text", "").strip()
             if text:
                 history_sdk.append(types.Content(role=role, parts=[types.Part(text=text)]))
-    except Exception:
-        pass
+        if summary:
+            system_prompt = f"{system_prompt or ''}\n\n[TÓM TẮT CÁC LƯỢT TRAO ĐỔI TRƯỚC]\n{summary}".strip()
+    except Exception as e:
+        print(f"⚠️ Load history error: {e}")
 
     try:
         config = get_generation_config()
         if system_prompt: config.system_instruction = system_prompt
         
-        # Init với model đầu tiên, nếu lỗi fallback sẽ handle lúc send
+        # Init với model khoẻ nhất hiện tại (bỏ qua model đang mở circuit)
         chat = client.chats.create(
-            model=FALLBACK_MODELS[0], 
+            model=model_health.best(), 
             config=config, 
             history=history_sdk
         )
-        chat_sessions[conversation_id] = chat
+        chat_sessions.set(conversation_id, chat)
         return chat
     except:
         # Fallback init
         try:
             chat = client.chats.create(model=FALLBACK_MODELS[1], config=config, history=history_sdk)
-            chat_sessions[conversation_id] = chat
+            chat_sessions.set(conversation_id, chat)
             return chat
         except:
             return None
 
 def clear_chat_session(conversation_id: str):
-    if conversation_id in chat_sessions: del chat_sessions[conversation_id]
+    forget_conversation(conversation_id)
+
+def get_session_stats() -> dict:
+    """Số liệu hit/miss/eviction của kho session (monitoring)."""
+    return chat_sessions.stats()
+
+def get_model_health() -> dict:
+    """Circuit/latency/error rate từng model + tỉ lệ fallback."""
+    return model_health.stats()
+
+def get_gate_stats() -> dict:
+    """Slot đang chạy/đang chờ, số request bị từ chối (429) và timeout."""
+    return gemini_gate.stats()
+
+def get_llm_routes() -> dict:
+    """use case → provider (gemini/local/fake)."""
+    return routing_table()
 
 # =======================
 # 6. HÀM CHÍNH (STREAMING & ONE-SHOT)
 # =======================
 
-def gemini_chat_streaming(conversation_id: str, user_prompt: str, system: str = None) -> str:
-    """Chat có nhớ context (Streaming)"""
+class GeminiProvider(LLMProvider):
+    """
+    Gemini dưới dạng LLMProvider: model lấy từ model_health (fallback + circuit breaker),
+    chat có nhớ context dùng session SDK trong chat_sessions thay vì dựng lại history mỗi lượt.
+    Slot/deadline do người gọi giữ (gemini_gate) như mọi provider khác.
+    """
+    name = GEMINI
+
+    def __init__(self):
+        self._served = threading.local()
+
+    @property
+    def model(self) -> str:
+        return model_health.best()
+
+    def available(self) -> bool:
+        return client is not None
+
+    def served_model(self) -> str:
+        return getattr(self._served, "model", None) or self.model
+
+    def generate(self, prompt, system=None, temperature=0.5, max_tokens=1024, deadline=None):
+        if not client: return ""
+        self._served.model = None
+        contents = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+
+        def _do_generate(model_name):
+            self._served.model = model_name
+            config = get_generation_config(temperature=temperature, max_tokens=max_tokens)
+            if system: config.system_instruction = system
+
+            return client.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=config,
+                safety_settings=get_safety_settings()
+            )
+
+        resp = _with_backoff(_do_generate, attempts=3, deadline=deadline)
+        return resp.text.strip() if resp and resp.text else ""
+
+    def stream_chat(self, history, prompt, system=None, temperature=0.3, max_tokens=2048):
+        if not client: return
+        config = get_generation_config(temperature=temperature, max_tokens=max_tokens)
+        if system: config.system_instruction = system
+        history_sdk = [
+            types.Content(role="model" if h.get("role") == "model" else "user", parts=[types.Part(text=h.get("text", ""))])
+            for h in history if h.get("text")
+        ]
+        chat = client.chats.create(model=model_health.best(), config=config, history=history_sdk)
+        for chunk in _with_backoff(lambda _m: chat.send_message_stream(prompt), attempts=3, track=False):
+            if chunk.text:
+                yield chunk.text
+
+    def converse(self, conversation_id, prompt, system=None, exclude_message_id=None):
+        chat = get_or_create_chat_session(conversation_id, system_prompt=system, exclude_message_id=exclude_message_id)
+        if not chat:
+            yield "⚠️ Lỗi kết nối AI."
+            return
+
+        def _send(model_name_unused):
+            return chat.send_message_stream(prompt)
+
+        # model đã cố định theo session → không ghi nhận vào model_health
+        for chunk in _with_backoff(_send, attempts=3, deadline=Deadline(STREAM_TIMEOUT), track=False):
+            if chunk.text:
+                yield chunk.text
+        # history trong session vượt ngân sách → bỏ session, lượt sau dựng lại (trượt cửa sổ + tóm tắt)
+        if history_tokens(chat) > HISTORY_TOKEN_BUDGET:
+            chat_sessions.pop(conversation_id)
+
+    def forget(self, conversation_id):
+        chat_sessions.pop(conversation_id)
+
+
+gemini_provider = GeminiProvider()
+register_provider(GEMINI, gemini_provider)
+
+def gemini_chat_streaming(
+    conversation_id: str,
+    user_prompt: str,
+    system: str = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    use_case: Optional[str] = None,
+    exclude_message_id=None,
+) -> str:
+    """
+    Chat có nhớ context (Streaming).
+    on_chunk: callback nhận từng đoạn text ngay khi về (để emit realtime);
+    hàm vẫn trả toàn bộ câu trả lời khi stream kết thúc.
+    use_case: chọn provider theo LLM_ROUTES (None/không khai báo → LLM_DEFAULT_PROVIDER).
+    exclude_message_id: _id của tin user (= user_prompt) đã lưu trước khi gọi → không nạp lại vào history.
+    """
     if not user_prompt: return ""
-    chat = get_or_create_chat_session(conversation_id, system_prompt=system)
-    if not chat: return "⚠️ Lỗi kết nối AI."
+    provider = get_provider(use_case)
+    if not provider.available(): return "⚠️ Lỗi kết nối AI."
 
+    resp_text = ""
     try:
-        def _send(model_name_unused): 
-            return chat.send_message_stream(user_prompt)
-
-        resp_text = ""
-        stream = _with_backoff(_send, attempts=3)
-        for chunk in stream:
-            if chunk.text: resp_text += chunk.text
-            clean_text = resp_text.replace("**", "").replace("##", "").strip()
+        # giữ slot suốt quá trình đọc stream (mọi provider); hết STREAM_TIMEOUT → trả phần đã nhận
+        with gemini_gate.slot(), gemini_gate.deadline(STREAM_TIMEOUT):
+            for delta in provider.converse(conversation_id, user_prompt, system=system,
+                                           exclude_message_id=exclude_message_id):
+                resp_text += delta
+                if on_chunk:
+                    try:
+                        on_chunk(delta)
+                    except Exception as e:
+                        print(f"⚠️ on_chunk error: {e}")
         return resp_text.strip()
-    except Exception:
-        return "Xin lỗi, hệ thống đang bận."
+    except AIBusyError:
+        raise
+    except Exception as e:
+        print(f"⚠️ LLM provider '{provider.name}' stream error: {e}")
+        return resp_text.strip() or "Xin lỗi, hệ thống đang bận."
+
+def _normalize_prompt(text: str) -> str:
+    """Bỏ khác biệt vô nghĩa (khoảng trắng, hoa/thường) để prompt lặp lại trùng key."""
+    return " ".join((text or "").split()).casefold()
+
+def _one_shot_cache_key(user_prompt: str, system: str, temperature: float, max_tokens: int, model: str) -> str:
+    raw = "\x1f".join([
+        model,
+        f"{temperature:.2f}",
+        str(max_tokens),
+        _normalize_prompt(system),
+        _normalize_prompt(user_prompt),
+    ])
+    return f"gemini:oneshot:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
 
 def gemini_chat(
     user_prompt: str,
     system: str = None,
     history: list = None,
     temperature: float = 0.5,
-    max_tokens: int = 1024
+    max_tokens: int = 1024,
+    cache_response: bool = True,
+    cache_ttl: Optional[int] = None,
+    use_case: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
 ) -> str:
     """
     Chat 1 lần (One-shot), không dùng session, không streaming.
     Dùng để tạo gợi ý câu hỏi (Suggestions).
+
+    Câu trả lời được cache theo (prompt chuẩn hoá, system, temperature, model) trong
+    CacheService; model trong key là model thực sự trả lời (fallback khác key với model chính).
+    Prompt có chứa dữ liệu bệnh nhân (PHI: triệu chứng, bệnh sử, sinh hiệu...) → cache_response=False.
+    use_case: chọn provider theo LLM_ROUTES (vd suggestions=local).
+    deadline: hạn chót của người gọi (vd batch) — call bị cắt khi hết, không chạy quá REQUEST_TIMEOUT.
     """
-    if not client: return ""
+    provider = get_provider(use_case)
+    if not provider.available(): return ""
 
-    # Build contents
-    contents = []
-    if history:
-        # Map history dict to types.Content if needed (đơn giản hóa)
-        pass 
-    contents.append(types.Content(role="user", parts=[types.Part(text=user_prompt)]))
+    ttl = ONE_SHOT_CACHE_TTL if cache_ttl is None else cache_ttl
+    use_cache = cache_response and ttl > 0 and not history
+    # tra cache theo model nhiều khả năng sẽ trả lời (Gemini: model đóng tốt nhất)
+    model = f"{provider.name}:{provider.model}"
+    cache_key = _one_shot_cache_key(user_prompt, system, temperature, max_tokens, model) if use_cache else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached:
+            return cached
 
-    def _do_generate(model_name):
-        config = get_generation_config(temperature=temperature, max_tokens=max_tokens)
-        if system: config.system_instruction = system
-        
-        return client.models.generate_content(
-            model=model_name,
-            contents=contents,
-            config=config,
-            safety_settings=get_safety_settings()
-        )
+    timeout = REQUEST_TIMEOUT
+    if deadline is not None and deadline.remaining() is not None:
+        timeout = min(timeout, deadline.remaining())
+        if timeout <= 0:
+            return ""  # người gọi đã bỏ cuộc → không chiếm slot/quota
 
     try:
-        resp = _with_backoff(_do_generate, attempts=3)
-        return resp.text.strip() if resp and resp.text else ""
+        text = gemini_gate.call(
+            lambda: provider.generate(user_prompt, system=system, temperature=temperature,
+                                      max_tokens=max_tokens, deadline=Deadline(timeout)),
+            timeout=timeout,
+        )
+        if cache_key and text:
+            # fallback sang model khác → lưu theo key của model thực sự trả lời
+            served_model = f"{provider.name}:{provider.served_model()}"
+            if served_model != model:
+                cache_key = _one_shot_cache_key(user_prompt, system, temperature, max_tokens, served_model)
+            cache.set(cache_key, text, ttl)
+        return text
+    except AIBusyError:
+        raise
     except Exception as e:
-        print(f"One-shot Error: {e}")
+        print(f"One-shot Error ({provider.name}): {e}")
         return ""
 
 def analyze_xray_with_context(xray_findings: str, patient_info: str = "") -> str:
@@ -240,19 +477,17 @@ def analyze_xray_with_context(xray_findings: str, patient_info: str = "") -> str
     Dữ liệu lâm sàng: {patient_info}
     Yêu cầu: Chẩn đoán hình ảnh, chẩn đoán phân biệt, hướng xử trí.
     """
-    if not client: return "Lỗi kết nối."
-
-    def _do_gen(model_name):
-        return client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=get_generation_config(temperature=0.2),
-            safety_settings=get_safety_settings()
-        )
+    provider = get_provider("xray_analysis")
+    if not provider.available(): return "Lỗi kết nối."
 
     try:
-        resp = _with_backoff(_do_gen, attempts=3)
-        return resp.text.strip() if resp else "Không có kết quả."
+        text = gemini_gate.call(
+            lambda: provider.generate(prompt, temperature=0.2, max_tokens=2048, deadline=Deadline(REQUEST_TIMEOUT)),
+            timeout=REQUEST_TIMEOUT,
+        )
+        return text or "Không có kết quả."
+    except AIBusyError:
+        raise
     except Exception as e:
         return f"Không thể phân tích: {str(e)}"
 
@@ -263,5 +498,10 @@ __all__ = [
     "gemini_chat_streaming", 
     "gemini_chat",  # <-- Đã thêm hàm này vào exports
     "analyze_xray_with_context", 
-    "clear_chat_session"
+    "clear_chat_session",
+    "get_session_stats",
+    "get_gate_stats",
+    "get_model_health",
+    "get_llm_routes",
+    "AIBusyError",
 ]
\ No newline at end of file
@@ -0,0 +1,275 @@
+# backend/app/services/llm_providers.py
+"""
+Lớp provider LLM bên dưới gemini_service.
+
+- "gemini": GeminiProvider trong gemini_service (session, fallback, circuit breaker), tự đăng ký
+            qua register_provider khi gemini_service được import.
+- "local":  server OpenAI-compatible (LM Studio / llama.cpp) tại LMSTUDIO_URL.
+- "fake":   trả lời tất định theo hash prompt, không gọi mạng (benchmark offline,
+            scripts/check_llm_routing.py kiểm tra định tuyến qua provider này).
+
+Chọn provider theo use case qua LLM_ROUTES, vd:
+    LLM_ROUTES="suggestions=local,summary=local,doctor_advisor=gemini"
+Use case không khai báo → LLM_DEFAULT_PROVIDER.
+Người gọi (gemini_service) giữ gemini_gate.slot() quanh MỌI provider → local/fake cũng bị giới hạn đồng thời.
+"""
+from __future__ import annotations
+import abc
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+from app.config import get_settings
+from app.services.ttl_store import TTLStore
+from app.services.gemini_client import Deadline, sleep
+
+GEMINI = "gemini"
+
+# Use case dùng trong code (giá trị key của LLM_ROUTES)
+USE_CASES = (
+    "suggestions",      # smart reply bệnh nhân/bác sĩ
+    "specialty",        # gợi ý chuyên khoa
+    "summary",          # tóm tắt hội thoại cuốn chiếu
+    "patient_chat",     # chat AI bệnh nhân
+    "doctor_advisor",   # medical copilot
+    "chat",             # chat AI chung
+    "xray_analysis",    # phân tích X-quang
+)
+
+# history: [{"role": "user" | "model", "text": "..."}]
+History = List[Dict[str, str]]
+
+# Lượt chat qua provider không giữ session (local/fake) cho hội thoại KHÔNG lưu DB (vd doctor advisor):
+# giữ trong RAM như chat session Gemini, cùng giới hạn LRU/TTL; cắt theo HISTORY_TOKEN_BUDGET
+provider_turns = TTLStore(
+    max_size=int(os.getenv("GEMINI_SESSION_MAX", "500")),
+    ttl_seconds=float(os.getenv("GEMINI_SESSION_TTL", "1800")),
+)
+
+
+class LLMProvider(abc.ABC):
+    """Interface tối thiểu cho 1 backend LLM."""
+    name = "base"
+
+    @property
+    def model(self) -> str:
+        return self.name
+
+    def available(self) -> bool:
+        """False → bỏ qua luôn, không chiếm slot (vd Gemini thiếu API key)."""
+        return True
+
+    def served_model(self) -> str:
+        """Model thực sự trả lời lần generate gần nhất (key cache one-shot)."""
+        return self.model
+
+    @abc.abstractmethod
+    def generate(self, prompt: str, system: Optional[str] = None,
+                 temperature: float = 0.5, max_tokens: int = 1024,
+                 deadline: Optional[Deadline] = None) -> str:
+        ...
+
+    @abc.abstractmethod
+    def stream_chat(self, history: History, prompt: str, system: Optional[str] = None,
+                    temperature: float = 0.3, max_tokens: int = 2048) -> Iterator[str]:
+        ...
+
+    def converse(self, conversation_id: str, prompt: str, system: Optional[str] = None,
+                 exclude_message_id=None) -> Iterator[str]:
+        """
+        Chat có nhớ context: history dựng lại từ DB mỗi lượt (lượt gần + tóm tắt).
+        Hội thoại không lưu DB → dùng các lượt giữ trong RAM (provider_turns),
+        tương đương session Gemini (mất khi restart / hết TTL).
+        """
+        from app.services.chat_context import build_history
+
+        summary, msgs = build_history(conversation_id, exclude_message_id)
+        history = []
+        for m in msgs:
+            role = "model" if (m.get("sender") or m.get("role")) in ["ai", "model"] else "user"
+            text = (m.get("text") or "").strip()
+            if text:
+                history.append({"role": role, "text": text})
+        in_memory = not history and not summary
+        if in_memory:
+            history = list(provider_turns.get(conversation_id) or [])
+        # tin user hiện tại đã lưu nhưng không rõ id → bỏ bản trùng cuối history (không gửi 2 lần)
+        if (exclude_message_id is None and history and history[-1]["role"] == "user"
+                and history[-1]["text"] == prompt.strip()):
+            history.pop()
+        if summary:
+            system = f"{system or ''}\n\n[TÓM TẮT CÁC LƯỢT TRAO ĐỔI TRƯỚC]\n{summary}".strip()
+
+        answer = ""
+        for delta in self.stream_chat(history, prompt, system=system):
+            answer += delta
+            yield delta
+        if in_memory and answer.strip():
+            _remember_turn(conversation_id, history, prompt, answer.strip())
+
+    def forget(self, conversation_id: str) -> None:
+        provider_turns.pop(conversation_id)
+
+
+def _remember_turn(conversation_id: str, history: History, prompt: str, answer: str) -> None:
+    """Lưu lượt vừa xong vào provider_turns, bỏ lượt cũ nhất khi vượt ngân sách token."""
+    from app.services.chat_context import HISTORY_TOKEN_BUDGET, estimate_tokens
+
+    turns = history + [{"role": "user", "text": prompt.strip()}, {"role": "model", "text": answer}]
+    while len(turns) > 2 and sum(estimate_tokens(t["text"]) for t in turns) > HISTORY_TOKEN_BUDGET:
+        turns = turns[2:]
+    provider_turns.set(conversation_id, turns)
+
+
+class LocalOpenAIProvider(LLMProvider):
+    """Server OpenAI-compatible: POST {base_url}/v1/chat/completions."""
+    name = "local"
+
+    def __init__(self, base_url: str, model: str, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self._model = model
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    def _messages(self, history: History, prompt: str, system: Optional[str]) -> List[Dict[str, str]]:
+        msgs = [{"role": "system", "content": system}] if system else []
+        for h in history:
+            msgs.append({"role": "assistant" if h.get("role") == "model" else "user", "content": h.get("text", "")})
+        msgs.append({"role": "user", "content": prompt})
+        return msgs
+
+    def _post(self, payload: Dict, stream: bool = False, deadline: Optional[Deadline] = None) -> requests.Response:
+        url = f"{self.base_url}/v1/chat/completions"
+        timeout = self.timeout
+        if deadline is not None and deadline.remaining() is not None:
+            timeout = max(0.1, min(timeout, deadline.remaining()))
+        resp = self._session.post(url, json=payload, timeout=timeout, stream=stream)
+        resp.raise_for_status()
+        return resp
+
+    def generate(self, prompt, system=None, temperature=0.5, max_tokens=1024, deadline=None):
+        payload = {
+            "model": self._model,
+            "messages": self._messages([], prompt, system),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        data = self._post(payload, deadline=deadline).json()
+        return ((data.get("choices") or [{}])[0].get("message") or {}).get("content", "").strip()
+
+    def stream_chat(self, history, prompt, system=None, temperature=0.3, max_tokens=2048):
+        payload = {
+            "model": self._model,
+            "messages": self._messages(history, prompt, system),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        with self._post(payload, stream=True) as resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+
+
+class FakeProvider(LLMProvider):
+    """Trả lời tất định (cùng input → cùng output), độ trễ giả lập FAKE_LLM_LATENCY_MS."""
+    name = "fake"
+
+    def __init__(self, latency_ms: int = 0):
+        self.latency_s = max(0, latency_ms) / 1000.0
+
+    def _answer(self, prompt: str, system: Optional[str]) -> str:
+        digest = hashlib.sha256(f"{system or ''}\x1f{prompt}".encode("utf-8")).hexdigest()[:8]
+        return "\n".join([
+            f"Câu hỏi mẫu {digest} số 1",
+            f"Câu hỏi mẫu {digest} số 2",
+            f"Câu hỏi mẫu {digest} số 3",
+            f"Câu hỏi mẫu {digest} số 4",
+        ])
+
+    def _wait(self) -> None:
+        if self.latency_s:
+            sleep(self.latency_s)
+
+    def generate(self, prompt, system=None, temperature=0.5, max_tokens=1024, deadline=None):
+        self._wait()
+        return self._answer(prompt, system)
+
+    def stream_chat(self, history, prompt, system=None, temperature=0.3, max_tokens=2048):
+        self._wait()
+        for word in self._answer(prompt, system).split(" "):
+            yield word + " "
+
+
+_providers: Dict[str, LLMProvider] = {}
+
+
+def register_provider(name: str, provider: LLMProvider) -> None:
+    """Đăng ký provider dựng sẵn ở nơi khác (gemini_service đăng ký GeminiProvider)."""
+    _providers[name] = provider
+
+
+def _build(name: str) -> Optional[LLMProvider]:
+    settings = get_settings()
+    if name == "local":
+        return LocalOpenAIProvider(settings.LMSTUDIO_URL, settings.LMSTUDIO_MODEL, settings.LMSTUDIO_TIMEOUT)
+    if name == "fake":
+        return FakeProvider(settings.FAKE_LLM_LATENCY_MS)
+    return None
+
+
+def _routes() -> Dict[str, str]:
+    routes = {}
+    for pair in get_settings().LLM_ROUTES.split(","):
+        if "=" in pair:
+            use_case, name = pair.split("=", 1)
+            routes[use_case.strip().lower()] = name.strip().lower()
+    return routes
+
+
+def provider_name(use_case: Optional[str]) -> str:
+    return _routes().get((use_case or "").lower()) or get_settings().LLM_DEFAULT_PROVIDER or GEMINI
+
+
+def get_provider(use_case: Optional[str]) -> LLMProvider:
+    """Provider cho use case; tên không hợp lệ → Gemini."""
+    name = provider_name(use_case)
+    if name not in _providers:
+        provider = _build(name)
+        if provider is None:
+            print(f"⚠️ LLM provider '{name}' không hợp lệ → dùng Gemini")
+            name = GEMINI
+        else:
+            _providers[name] = provider
+    if name == GEMINI and GEMINI not in _providers:
+        # GeminiProvider tự đăng ký khi import gemini_service
+        import app.services.gemini_service  # noqa: F401
+    return _providers[name]
+
+
+def forget_conversation(conversation_id: str) -> None:
+    """Bỏ context trong RAM của hội thoại ở mọi provider (session Gemini, provider_turns)."""
+    provider_turns.pop(conversation_id)
+    for provider in list(_providers.values()):
+        provider.forget(conversation_id)
+
+
+def routing_table() -> Dict[str, str]:
+    """use case → provider đang dùng (monitoring)."""
+    return {uc: provider_name(uc) for uc in USE_CASES}
@@ -0,0 +1,201 @@
+# backend/app/services/model_health.py
+"""
+Theo dõi sức khoẻ từng model Gemini trong chuỗi fallback + circuit breaker.
+
+- Ghi nhận thành công/thất bại + latency (EWMA) theo model, dùng chung toàn process.
+- Model lỗi liên tiếp >= failure_threshold (hoặc 404/model không tồn tại) → mở circuit
+  trong `cooldown` giây; hết cooldown cho 1 request thăm dò (half-open), lỗi tiếp thì
+  cooldown nhân đôi (tối đa max_cooldown).
+- `order()` trả danh sách model nên thử: model half-open (chờ thăm dò) lên đầu để model
+  ưu tiên có cơ hội hồi phục, rồi model đóng, model đang mở xếp cuối.
+  Model đóng xếp theo sức khoẻ: vừa lỗi → tỉ lệ lỗi gần đây (EWMA, bậc 10%) → chậm hẳn
+  (latency EWMA > slow_factor × model nhanh nhất); cùng bậc thì giữ thứ tự ưu tiên cấu hình
+  (model mạnh trước) — không đổi sang model yếu hơn chỉ vì nhanh hơn vài trăm ms.
+- Người gọi chỉ giữ lượt thăm dò bằng `begin_probe(model)` ngay trước khi thật sự gọi model đó,
+  và trả lượt bằng record_success/record_failure hoặc `end_probe(model)` (lỗi không tính cho model).
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _ModelState:
+    __slots__ = ("calls", "successes", "failures", "consecutive", "latency", "error_rate",
+                 "opened_until", "cooldown", "probe_until", "last_error")
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive = 0
+        self.latency: Optional[float] = None   # EWMA giây
+        self.error_rate = 0.0                  # EWMA tỉ lệ lỗi gần đây (0..1)
+        self.opened_until = 0.0
+        self.cooldown = 0.0
+        self.probe_until = 0.0                 # đang có 1 request thăm dò (half-open) tới mốc này
+        self.last_error: Optional[str] = None
+
+
+class ModelHealthTracker:
+    def __init__(
+        self,
+        models: Sequence[str],
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+        slow_factor: float = 3.0,
+    ):
+        self.models = list(models)
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.base_cooldown = float(cooldown)
+        self.max_cooldown = float(max_cooldown)
+        self.slow_factor = float(slow_factor)
+        self._state: Dict[str, _ModelState] = {m: _ModelState() for m in self.models}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fallbacks = 0          # request thành công bằng model khác model ưu tiên số 1
+        self.served_by: Dict[str, int] = {m: 0 for m in self.models}
+
+    def _get(self, model: str) -> _ModelState:
+        st = self._state.get(model)
+        if st is None:
+            st = self._state[model] = _ModelState()
+        return st
+
+    def _circuit(self, st: _ModelState, now: float) -> str:
+        if st.opened_until <= 0:
+            return CLOSED
+        return OPEN if now < st.opened_until or now < st.probe_until else HALF_OPEN
+
+    def _rank_key(self, models: Sequence[str]):
+        """Key sort (ổn định) cho model đóng: lỗi liên tiếp, tỉ lệ lỗi gần đây, chậm bất thường."""
+        latencies = [self._state[m].latency for m in models if self._state[m].latency is not None]
+        fastest = min(latencies) if latencies else None
+
+        def key(m: str):
+            st = self._state[m]
+            slow = fastest is not None and st.latency is not None and st.latency > self.slow_factor * fastest
+            return (st.consecutive > 0, round(st.error_rate, 1), slow)
+        return key
+
+    # ---------- routing ----------
+    def order(self) -> List[str]:
+        """
+        Model theo thứ tự nên thử: half-open trước (thăm dò), rồi model đóng (sạch lỗi trước),
+        model đang mở cuối cùng. Không giữ lượt thăm dò — xem begin_probe().
+        """
+        now = time.monotonic()
+        probes, usable, opened = [], [], []
+        with self._lock:
+            for m in self.models:
+                state = self._circuit(self._get(m), now)
+                if state == HALF_OPEN:
+                    probes.append(m)
+                elif state == OPEN:
+                    opened.append(m)
+                else:
+                    usable.append(m)
+            # model vừa lỗi / hay lỗi / chậm hẳn lùi sau; cùng bậc giữ thứ tự ưu tiên
+            usable.sort(key=self._rank_key(usable))
+            opened.sort(key=lambda m: self._state[m].opened_until)
+        return probes + usable + opened
+
+    def begin_probe(self, model: str, probe_window: float = 60.0) -> bool:
+        """
+        Gọi ngay trước khi gửi request tới `model`.
+        Half-open → giữ lượt thăm dò duy nhất trong `probe_window` giây, True.
+        Đóng → True. Đang mở (hoặc đã có request khác thăm dò) → False.
+        """
+        now = time.monotonic()
+        with self._lock:
+            st = self._get(model)
+            state = self._circuit(st, now)
+            if state == HALF_OPEN:
+                st.probe_until = now + probe_window
+                return True
+            return state == CLOSED
+
+    def end_probe(self, model: str) -> None:
+        """Trả lượt thăm dò khi request kết thúc mà không có kết quả tính cho model (vd lỗi 400, bị huỷ)."""
+        with self._lock:
+            st = self._get(model)
+            if st.probe_until > 0:
+                st.probe_until = 0.0
+
+    def best(self) -> str:
+        """Model cho session dài hạn: model đóng tốt nhất (session không dùng để thăm dò)."""
+        now = time.monotonic()
+        with self._lock:
+            closed = [m for m in self.models if self._circuit(self._get(m), now) == CLOSED]
+            closed.sort(key=self._rank_key(closed))
+        return closed[0] if closed else self.order()[0]
+
+    # ---------- ghi nhận ----------
+    def record_success(self, model: str, latency: float) -> None:
+        with self._lock:
+            st = self._get(model)
+            st.calls += 1
+            st.successes += 1
+            st.consecutive = 0
+            st.latency = latency if st.latency is None else 0.8 * st.latency + 0.2 * latency
+            st.error_rate = 0.8 * st.error_rate
+            if st.opened_until > 0:
+                print(f"✅ Model '{model}' hồi phục → đóng circuit")
+            st.opened_until = 0.0
+            st.cooldown = 0.0
+            st.probe_until = 0.0
+            self.requests += 1
+            self.served_by[model] = self.served_by.get(model, 0) + 1
+            if self.models and model != self.models[0]:
+                self.fallbacks += 1
+
+    def record_failure(self, model: str, error: Exception, *, fatal: bool = False) -> None:
+        """fatal=True (model không tồn tại/không hỗ trợ) → mở circuit ngay."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._get(model)
+            st.calls += 1
+            st.failures += 1
+            st.consecutive += 1
+            st.error_rate = 0.8 * st.error_rate + 0.2
+            st.last_error = str(error)[:200]
+            probing = st.probe_until > 0
+            if fatal or probing or st.consecutive >= self.failure_threshold:
+                st.cooldown = min(self.max_cooldown, st.cooldown * 2 if st.cooldown else self.base_cooldown)
+                st.opened_until = now + st.cooldown
+                st.probe_until = 0.0
+                print(f"⛔ Mở circuit model '{model}' trong {st.cooldown:.0f}s ({st.last_error[:80]})")
+
+    def is_open(self, model: str) -> bool:
+        with self._lock:
+            return self._circuit(self._get(model), time.monotonic()) == OPEN
+
+    # ---------- metrics ----------
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for m, st in self._state.items():
+                models[m] = {
+                    "circuit": self._circuit(st, now),
+                    "calls": st.calls,
+                    "failures": st.failures,
+                    "consecutive_failures": st.consecutive,
+                    "error_rate": round(st.failures / st.calls, 3) if st.calls else 0.0,
+                    "recent_error_rate": round(st.error_rate, 3),
+                    "avg_latency_s": round(st.latency, 3) if st.latency is not None else None,
+                    "reopens_in_s": round(max(0.0, st.opened_until - now), 1) if st.opened_until else 0.0,
+                    "last_error": st.last_error,
+                    "served": self.served_by.get(m, 0),
+                }
+            return {
+                "requests": self.requests,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": round(self.fallbacks / self.requests, 3) if self.requests else 0.0,
+                "models": models,
+            }
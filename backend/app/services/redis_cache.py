@@ -2,10 +2,39 @@
 """
 Redis caching service for API response caching
 Improves performance by caching frequently accessed data
+
+Tiers: L1 (in-process, short TTL) -> L2 Redis -> memory fallback when Redis is down.
+`get_or_compute` / `cache_result` add single-flight on misses and
+probabilistic early refresh (XFetch) before expiry.
+
+Invalidation is by tag: writers pass `tags=[...]` when caching and call
+`cache.invalidate_tags(...)` after a write. In Redis each tag is a set of keys
+(`cache:tag:<tag>`), so invalidation costs O(tags + keys) instead of a KEYS scan.
+Invalidation runs as one Lua script (read set + delete keys + bump the tag's
+version atomically); `get_or_compute` snapshots tag versions before computing
+and only stores if no tag was invalidated meanwhile, so a slow leader cannot
+write back data computed before the invalidation.
+
+Limitations:
+- The invalidation script deletes key names it reads from the tag sets, which are
+  not declared in KEYS. That is fine on a single Redis (or primary/replica) but NOT
+  on Redis Cluster or key-routing proxies (twemproxy, Envoy): there the tag sets
+  would have to share a hash slot with every tagged key.
+- L1 entries are dropped only in the process that calls invalidate_tags; other
+  workers keep serving their L1 copy until CACHE_L1_TTL (default 5s) expires.
+
+Payloads are encoded by `cache_codec.codec` (msgpack/JSON + optional zstd/zlib,
+versioned header), so ObjectId/datetime round-trip with their types.
 """
-import json
+import fnmatch
+import hashlib
+import math
 import os
-from typing import Any, Optional, Union
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
 from functools import wraps
 
 try:
@@ -15,150 +44,710 @@ except ImportError:
     REDIS_AVAILABLE = False
     redis = None
 
-# Redis connection (lazy initialization)
+from app.services.cache_codec import codec
+
+# Tags dùng chung giữa route ghi và route đọc cache
+TAG_APPOINTMENTS = "appointments"
+TAG_STATS = "stats"
+TAG_RATINGS = "ratings"
+TAG_PREFIX = "cache:tag:"
+TAG_VERSION_PREFIX = "cache:tagver:"
+# Tag set sống lâu hơn mọi entry mà nó trỏ tới (member hết hạn chỉ là rác vô hại)
+TAG_TTL = int(os.getenv("CACHE_TAG_TTL", "86400"))
+
+
+def doctor_tag(doctor_id) -> str:
+    return f"doctor:{doctor_id}"
+
+
+# KEYS = tag sets..., version keys... ; ARGV[1] = version key TTL
+# -> {deleted count, member keys}
+_INVALIDATE_LUA = """
+local n = #KEYS / 2
+local deleted, members = 0, {}
+for i = 1, n do
+    local keys = redis.call('SMEMBERS', KEYS[i])
+    for j = 1, #keys, 500 do
+        deleted = deleted + redis.call('DEL', unpack(keys, j, math.min(j + 499, #keys)))
+    end
+    for _, k in ipairs(keys) do members[#members + 1] = k end
+    redis.call('DEL', KEYS[i])
+    redis.call('INCR', KEYS[n + i])
+    redis.call('EXPIRE', KEYS[n + i], ARGV[1])
+end
+return {deleted, members}
+"""
+
+# KEYS = key, tag sets..., version keys... ; ARGV = ttl, payload, n tags, tag TTL, expected versions...
+# -> 1 stored, 0 skipped (a tag was invalidated after the versions were read)
+_STORE_IF_FRESH_LUA = """
+local n = tonumber(ARGV[3])
+for i = 1, n do
+    if (redis.call('GET', KEYS[1 + n + i]) or '0') ~= ARGV[4 + i] then
+        return 0
+    end
+end
+redis.call('SETEX', KEYS[1], ARGV[1], ARGV[2])
+for i = 1, n do
+    redis.call('SADD', KEYS[1 + i], KEYS[1])
+    redis.call('EXPIRE', KEYS[1 + i], ARGV[4])
+end
+return 1
+"""
+
+
+# Redis connection (lazy initialization, pooled)
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "15"))
 _redis_client: Optional[Any] = None
+_redis_pool: Optional[Any] = None
+_redis_next_retry = 0.0
+_redis_reconnects = 0
+_redis_lock = threading.Lock()
 
 def get_redis_client():
-    """Get or create Redis client"""
-    global _redis_client
+    """
+    Get the shared pooled Redis client, or None while Redis is unreachable.
+    A failed connect is retried every REDIS_RETRY_INTERVAL seconds instead of
+    falling back to memory for the life of the process.
+    """
+    global _redis_client, _redis_pool, _redis_next_retry, _redis_reconnects
     
     if not REDIS_AVAILABLE:
         return None
+    if _redis_client is not None:
+        return _redis_client
+    if time.monotonic() < _redis_next_retry:
+        return None
     
-    if _redis_client is None:
+    with _redis_lock:
+        if _redis_client is not None or time.monotonic() < _redis_next_retry:
+            return _redis_client
         try:
-            redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-            _redis_client = redis.from_url(
-                redis_url,
-                decode_responses=True,
-                socket_connect_timeout=2,
-                socket_timeout=2
-            )
+            if _redis_pool is None:
+                redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+                _redis_pool = redis.ConnectionPool.from_url(
+                    redis_url,
+                    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+                    socket_connect_timeout=2,
+                    socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "2")),
+                    socket_keepalive=True,
+                    health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+                    retry_on_timeout=True,
+                )
+            client = redis.Redis(connection_pool=_redis_pool)  # payloads are codec bytes (no decode)
             # Test connection
-            _redis_client.ping()
+            client.ping()
+            if _redis_next_retry:
+                _redis_reconnects += 1
+            _redis_client = client
             print("✅ Redis connected successfully")
         except Exception as e:
-            print(f"⚠️  Redis not available: {e}. Using memory cache fallback.")
-            _redis_client = None
+            _redis_next_retry = time.monotonic() + REDIS_RETRY_INTERVAL
+            print(f"⚠️  Redis not available: {e}. Using memory cache fallback (retry in {REDIS_RETRY_INTERVAL:.0f}s).")
     
     return _redis_client
 
+
+def mark_redis_down(error: Exception) -> None:
+    """Connection-level failure: drop the client so callers use memory until the next retry."""
+    global _redis_client, _redis_next_retry
+    with _redis_lock:
+        if _redis_client is None:
+            return
+        _redis_client = None
+        _redis_next_retry = time.monotonic() + REDIS_RETRY_INTERVAL
+    try:
+        _redis_pool.disconnect()
+    except Exception:
+        pass
+    print(f"⚠️  Redis connection lost: {error}. Retrying in {REDIS_RETRY_INTERVAL:.0f}s.")
+
+
+def redis_pool_stats() -> Dict[str, Any]:
+    pool = _redis_pool
+    return {
+        "connected": _redis_client is not None,
+        "reconnects": _redis_reconnects,
+        "max_connections": getattr(pool, "max_connections", None),
+        "in_use": len(getattr(pool, "_in_use_connections", ()) or ()),
+        "idle": len(getattr(pool, "_available_connections", ()) or ()),
+    }
+
+class MemoryLRUCache:
+    """
+    In-process fallback cache: LRU bounded by entry count and total bytes,
+    per-entry expiry on the monotonic clock, guarded by a lock
+    (threading is monkey-patched by eventlet, so this is greenlet-safe too).
+
+    As the Redis fallback it holds the same encoded payload Redis would, so both
+    backends return identical (deserialized) data; as the L1 near-cache it
+    holds decoded entries with the payload size passed in explicitly.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        # key -> (payload, expires_at | None, size_bytes)
+        self._data: "OrderedDict[str, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._bytes = 0
+        # tag -> keys, key -> tags (kept in sync with _data)
+        self._tags: Dict[str, Set[str]] = {}
+        self._key_tags: Dict[str, Tuple[str, ...]] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key: str) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            payload, expires_at, _ = item
+            if expires_at is not None and expires_at <= now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, key: str, payload: Any, ttl: Optional[float], size: Optional[int] = None,
+            tags: Iterable[str] = ()) -> bool:
+        size = len(key) + (size if size is not None else len(payload))
+        if size > self.max_bytes:
+            return False  # a single entry larger than the whole budget is not cached
+        expires_at = time.monotonic() + ttl if ttl and ttl > 0 else None
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (payload, expires_at, size)
+            self._bytes += size
+            tags = tuple(tags)
+            if tags:
+                self._key_tags[key] = tags
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """Drop expired entries first, then least recently used, until within bounds."""
+        if len(self._data) <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        now = time.monotonic()
+        for key in [k for k, (_, exp, _) in self._data.items() if exp is not None and exp <= now]:
+            self._drop(key)
+            self.expirations += 1
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+                return True
+            return False
+
+    def delete_pattern(self, pattern: str) -> int:
+        with self._lock:
+            keys = [k for k in self._data if fnmatch.fnmatchcase(k, pattern)]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def delete_tags(self, tags: Iterable[str]) -> int:
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._tags.clear()
+            self._key_tags.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Envelope written by get_or_compute: {"__cache_env__": 1, "v": value, "d": compute seconds, "x": expiry epoch}
+ENVELOPE_KEY = "__cache_env__"
+
+# (value, compute seconds, expiry epoch | None)
+Entry = Tuple[Any, float, Optional[float]]
+
+
+def _unwrap(data: Any) -> Entry:
+    if isinstance(data, dict) and data.get(ENVELOPE_KEY):
+        return data.get("v"), float(data.get("d") or 0.0), data.get("x")
+    return data, 0.0, None
+
+
 class CacheService:
     """Cache service with Redis backend and memory fallback"""
     
     def __init__(self):
-        self.redis = get_redis_client()
-        self.memory_cache = {}  # Fallback memory cache
+        # Fallback memory cache (bounded LRU + TTL)
+        self.memory_cache = MemoryLRUCache(
+            max_entries=int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+        # L1 near-cache in front of Redis: hot keys skip the round-trip and decoding.
+        # Entries are shared between callers -> treat returned values as read-only.
+        self.l1_ttl = float(os.getenv("CACHE_L1_TTL", "5"))
+        self.l1 = MemoryLRUCache(
+            max_entries=int(os.getenv("CACHE_L1_MAX_ENTRIES", "500")),
+            max_bytes=int(os.getenv("CACHE_L1_MAX_BYTES", str(16 * 1024 * 1024))),
+        )
+        # Single-flight: key -> Event set when the leader finishes computing
+        self._flights: Dict[str, threading.Event] = {}
+        self._flight_lock = threading.Lock()
+        self.flight_wait = float(os.getenv("CACHE_FLIGHT_WAIT", "10"))
+        self.coalesced = 0
+        self.early_refreshes = 0
+        self.stale_skips = 0
+        # Lua scripts registered once per Redis client (client changes after a reconnect)
+        self._script_client = None
+        self._scripts: Dict[str, Any] = {}
+        # tag -> local invalidation counter (guards the memory fallback the same way)
+        self._local_tag_versions: Dict[str, int] = {}
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get value from cache"""
-        # Try Redis first
-        if self.redis:
+    @property
+    def redis(self):
+        """Current Redis client (None while down; reconnect is retried periodically)."""
+        return get_redis_client()
+    
+    def _redis_error(self, op: str, error: Exception) -> None:
+        print(f"⚠️  Redis {op} error: {error}")
+        if isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+            mark_redis_down(error)
+    
+    def _get_entry(self, key: str) -> Optional[Entry]:
+        """L1 -> Redis -> memory fallback; returns (value, delta, expiry) or None."""
+        client = self.redis
+        if client:
+            if self.l1_ttl > 0:
+                hit = self.l1.get(key)
+                if hit is not None:
+                    return hit
             try:
-                value = self.redis.get(key)
-                if value:
-                    return json.loads(value)
+                raw = client.get(key)
+                if raw:
+                    entry = _unwrap(codec.decode(raw))
+                    self._fill_l1(key, entry, len(raw))
+                    return entry
             except Exception as e:
-                print(f"⚠️  Redis get error: {e}")
+                self._redis_error("get", e)
         
         # Fallback to memory cache
-        if key in self.memory_cache:
-            cached_data, expiry = self.memory_cache[key]
-            # Check if expired (simple memory cache doesn't auto-expire)
-            if expiry is None or expiry > 0:
-                return cached_data
-            else:
-                del self.memory_cache[key]
+        payload = self.memory_cache.get(key)
+        if payload is not None:
+            try:
+                return _unwrap(codec.decode(payload))
+            except Exception:
+                self.memory_cache.delete(key)
         
         return None
     
-    def set(self, key: str, value: Any, ttl: int = 3600):
+    def _fill_l1(self, key: str, entry: Entry, size: int) -> None:
+        if self.l1_ttl <= 0:
+            return
+        ttl = self.l1_ttl
+        expiry = entry[2]
+        if expiry is not None:
+            ttl = min(ttl, expiry - time.time())  # never outlive the L2 entry
+        if ttl > 0:
+            self.l1.set(key, entry, ttl, size=size)
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Get value from cache"""
+        entry = self._get_entry(key)
+        return entry[0] if entry is not None else None
+    
+    def set(self, key: str, value: Any, ttl: int = 3600, tags: Iterable[str] = ()):
         """
         Set value in cache with TTL (time to live in seconds)
         
         Args:
             key: Cache key
-            value: Value to cache (will be JSON serialized)
+            value: Value to cache (encoded by the cache codec)
             ttl: Time to live in seconds (default: 1 hour)
+            tags: Tags to invalidate the key by (see invalidate_tags)
         """
         try:
-            json_value = json.dumps(value, default=str)
+            payload = codec.encode(value)
         except Exception:
             # If value can't be serialized, skip caching
             return False
         
+        return self._store(key, payload, ttl, tags)
+    
+    def _store(self, key: str, payload: bytes, ttl: int, tags: Iterable[str] = ()) -> bool:
+        return self._store_many([(key, payload, tuple(tags))], ttl)
+    
+    def _script(self, client, name: str):
+        if self._script_client is not client:
+            self._scripts = {
+                "invalidate": client.register_script(_INVALIDATE_LUA),
+                "store_if_fresh": client.register_script(_STORE_IF_FRESH_LUA),
+            }
+            self._script_client = client
+        return self._scripts[name]
+    
+    def _tag_versions(self, tags: Tuple[str, ...]):
+        """Snapshot of (local, redis) tag versions, taken before computing a value."""
+        local = tuple(self._local_tag_versions.get(t, 0) for t in tags)
+        remote = None
+        client = self.redis
+        if client and tags:
+            try:
+                remote = [(v.decode() if isinstance(v, bytes) else v) or "0"
+                          for v in client.mget([TAG_VERSION_PREFIX + t for t in tags])]
+            except Exception as e:
+                self._redis_error("mget", e)
+        return local, remote
+    
+    def _store_if_fresh(self, key: str, payload: bytes, ttl: int, tags: Tuple[str, ...], versions) -> bool:
+        """Store unless one of `tags` was invalidated since `versions` was taken."""
+        local, remote = versions
+        if local != tuple(self._local_tag_versions.get(t, 0) for t in tags):
+            self.stale_skips += 1
+            return False
+        if not tags or remote is None:
+            return self._store(key, payload, ttl, tags)
+        
+        self.l1.delete(key)
+        client = self.redis
+        if client:
+            try:
+                script = self._script(client, "store_if_fresh")
+                keys = [key] + [TAG_PREFIX + t for t in tags] + [TAG_VERSION_PREFIX + t for t in tags]
+                stored = script(keys=keys, args=[ttl, payload, len(tags), max(ttl, TAG_TTL), *remote])
+                if not stored:
+                    self.stale_skips += 1
+                return bool(stored)
+            except Exception as e:
+                self._redis_error("set", e)
+        return self.memory_cache.set(key, payload, ttl, tags=tags)
+    
+    def _store_many(self, items, ttl: int) -> bool:
+        """items: [(key, payload, tags)] -> one MULTI round-trip (atomic w.r.t. invalidate_tags)."""
+        for key, _, _ in items:
+            self.l1.delete(key)
+        
         # Try Redis first
-        if self.redis:
+        client = self.redis
+        if client:
             try:
-                self.redis.setex(key, ttl, json_value)
+                pipe = client.pipeline(transaction=True)
+                for key, payload, tags in items:
+                    pipe.setex(key, ttl, payload)
+                    for tag in tags:
+                        pipe.sadd(TAG_PREFIX + tag, key)
+                        pipe.expire(TAG_PREFIX + tag, max(ttl, TAG_TTL))
+                pipe.execute()
                 return True
             except Exception as e:
-                print(f"⚠️  Redis set error: {e}")
+                self._redis_error("set", e)
         
-        # Fallback to memory cache (simplified, no auto-expiry)
-        # In production, should use a proper memory cache library
-        self.memory_cache[key] = (value, ttl)
+        # Fallback to memory cache (expires after ttl, LRU-evicted when full)
+        stored = True
+        for key, payload, tags in items:
+            stored = self.memory_cache.set(key, payload, ttl, tags=tags) and stored
+        return stored
+    
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        {key: value} for the cached keys (misses are left out).
+        L1 hits are served locally, the rest come back in a single MGET.
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, Any] = {}
         
-        # Clean up old entries (simple cleanup, not production-ready)
-        if len(self.memory_cache) > 1000:
-            # Remove oldest 10% of entries
-            keys_to_remove = list(self.memory_cache.keys())[:100]
-            for k in keys_to_remove:
-                del self.memory_cache[k]
+        client = self.redis
+        if client:
+            remote = []
+            for key in keys:
+                hit = self.l1.get(key) if self.l1_ttl > 0 else None
+                if hit is not None:
+                    found[key] = hit[0]
+                else:
+                    remote.append(key)
+            if remote:
+                try:
+                    for key, raw in zip(remote, client.mget(remote)):
+                        if raw:
+                            entry = _unwrap(codec.decode(raw))
+                            self._fill_l1(key, entry, len(raw))
+                            found[key] = entry[0]
+                except Exception as e:
+                    self._redis_error("mget", e)
         
-        return True
+        # Fallback to memory cache
+        for key in keys:
+            if key in found:
+                continue
+            payload = self.memory_cache.get(key)
+            if payload is not None:
+                try:
+                    found[key] = _unwrap(codec.decode(payload))[0]
+                except Exception:
+                    self.memory_cache.delete(key)
+        
+        return found
+    
+    def set_many(self, values: Dict[str, Any], ttl: int = 3600,
+                 tags: Optional[Dict[str, Iterable[str]]] = None) -> bool:
+        """
+        Cache several values in one pipeline round-trip.
+        tags: optional {key: [tag, ...]} (see invalidate_tags)
+        """
+        tags = tags or {}
+        items = []
+        for key, value in values.items():
+            try:
+                items.append((key, codec.encode(value), tuple(tags.get(key, ()))))
+            except Exception:
+                continue  # not serializable -> skip this key
+        if not items:
+            return False
+        return self._store_many(items, ttl)
+    
+    # ---------- single-flight + early refresh ----------
+    def _begin_flight(self, key: str) -> Tuple[bool, threading.Event]:
+        """(True, event) for the leader; (False, event) for callers that should wait."""
+        with self._flight_lock:
+            event = self._flights.get(key)
+            if event is not None:
+                return False, event
+            event = self._flights[key] = threading.Event()
+            return True, event
+    
+    def _end_flight(self, key: str) -> None:
+        with self._flight_lock:
+            event = self._flights.pop(key, None)
+        if event is not None:
+            event.set()
+    
+    def _remote_lock(self, key: str, ttl_ms: int) -> bool:
+        """Cross-process single-flight via SET NX (True if we may compute)."""
+        client = self.redis
+        if not client:
+            return True
+        try:
+            return bool(client.set(f"lock:{key}", "1", nx=True, px=ttl_ms))
+        except Exception:
+            return True
+    
+    def _remote_unlock(self, key: str) -> None:
+        client = self.redis
+        if client:
+            try:
+                client.delete(f"lock:{key}")
+            except Exception:
+                pass
+    
+    def _compute_and_store(self, key: str, compute, ttl: int, tags: Iterable[str] = ()) -> Any:
+        tags = tuple(tags)
+        versions = self._tag_versions(tags)
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        if value is not None:
+            envelope = {ENVELOPE_KEY: 1, "v": value, "d": round(delta, 4), "x": time.time() + ttl}
+            try:
+                self._store_if_fresh(key, codec.encode(envelope), ttl, tags, versions)
+            except Exception:
+                pass  # not serializable -> just don't cache
+        return value
+    
+    def get_or_compute(self, key: str, compute, ttl: int = 3600, beta: float = 1.0,
+                       tags: Iterable[str] = ()) -> Any:
+        """
+        Cached value of `key`, computing it with `compute()` on a miss.
+
+        - Miss: only one caller per process (and, with Redis, per cluster) computes;
+          concurrent callers wait for it and read the fresh entry.
+        - Hit close to expiry: XFetch decides (probability grows as expiry nears,
+          scaled by how long compute took) to refresh early; one caller refreshes
+          while the others keep getting the current value.
+        """
+        entry = self._get_entry(key)
+        if entry is not None:
+            value, delta, expiry = entry
+            if not (delta and expiry and beta > 0):
+                return value
+            if time.time() - delta * beta * math.log(random.random() or 1e-12) < expiry:
+                return value
+            leader, _ = self._begin_flight(key)
+            if not leader:
+                return value
+            try:
+                self.early_refreshes += 1
+                return self._compute_and_store(key, compute, ttl, tags)
+            except Exception as e:
+                print(f"⚠️  Early refresh failed for {key}: {e}")
+                return value
+            finally:
+                self._end_flight(key)
+        
+        leader, event = self._begin_flight(key)
+        if not leader:
+            self.coalesced += 1
+            event.wait(self.flight_wait)
+            entry = self._get_entry(key)
+            return entry[0] if entry is not None else compute()
+        
+        try:
+            if not self._remote_lock(key, int(self.flight_wait * 1000)):
+                # another process is computing: poll briefly for its result
+                deadline = time.monotonic() + self.flight_wait
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    entry = self._get_entry(key)
+                    if entry is not None:
+                        self.coalesced += 1
+                        return entry[0]
+                return self._compute_and_store(key, compute, ttl, tags)
+            try:
+                return self._compute_and_store(key, compute, ttl, tags)
+            finally:
+                self._remote_unlock(key)
+        finally:
+            self._end_flight(key)
     
     def delete(self, key: str):
         """Delete key from cache"""
         # Try Redis first
-        if self.redis:
+        client = self.redis
+        if client:
             try:
-                self.redis.delete(key)
+                client.delete(key)
             except Exception:
                 pass
         
         # Remove from memory cache
-        if key in self.memory_cache:
-            del self.memory_cache[key]
+        self.memory_cache.delete(key)
+        self.l1.delete(key)
+    
+    def invalidate_tags(self, *tags: str) -> int:
+        """Delete every key cached under any of `tags` (e.g. "appointments", doctor_tag(id))."""
+        tags = [t for t in tags if t]
+        if not tags:
+            return 0
+        deleted_count = 0
+        for tag in tags:
+            self._local_tag_versions[tag] = self._local_tag_versions.get(tag, 0) + 1
+        
+        client = self.redis
+        if client:
+            try:
+                script = self._script(client, "invalidate")
+                keys = [TAG_PREFIX + t for t in tags] + [TAG_VERSION_PREFIX + t for t in tags]
+                deleted_count, members = script(keys=keys, args=[TAG_TTL])
+                for key in members or ():
+                    self.l1.delete(key.decode() if isinstance(key, bytes) else key)
+            except Exception as e:
+                self._redis_error("invalidate", e)
+        
+        deleted_count += self.memory_cache.delete_tags(tags)
+        return deleted_count
     
     def delete_pattern(self, pattern: str):
         """
         Delete all keys matching pattern (e.g., "user:*")
-        Warning: Use with caution in production
+        Prefer tags (invalidate_tags); this walks the keyspace incrementally with SCAN.
         """
         deleted_count = 0
         
         # Try Redis first
-        if self.redis:
+        client = self.redis
+        if client:
             try:
-                keys = self.redis.keys(pattern)
-                if keys:
-                    deleted_count = self.redis.delete(*keys)
+                batch = []
+                for key in client.scan_iter(match=pattern, count=500):
+                    batch.append(key)
+                    if len(batch) >= 500:
+                        deleted_count += client.unlink(*batch)
+                        batch = []
+                if batch:
+                    deleted_count += client.unlink(*batch)
             except Exception:
                 pass
         
-        # Remove from memory cache (simple string matching)
-        keys_to_delete = [k for k in self.memory_cache.keys() if pattern.replace("*", "") in k]
-        for key in keys_to_delete:
-            del self.memory_cache[key]
-            deleted_count += 1
+        # Remove from memory cache (same glob semantics as Redis)
+        deleted_count += self.memory_cache.delete_pattern(pattern)
+        self.l1.delete_pattern(pattern)
         
         return deleted_count
     
     def clear(self):
         """Clear all cache"""
-        if self.redis:
+        client = self.redis
+        if client:
             try:
-                self.redis.flushdb()
+                client.flushdb()
             except Exception:
                 pass
         
         self.memory_cache.clear()
+        self.l1.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend in use + memory/L1 tier counters (monitoring)."""
+        return {
+            "backend": "redis" if self.redis else "memory",
+            "redis": redis_pool_stats(),
+            "codec": codec.describe(),
+            "memory": self.memory_cache.stats(),
+            "l1": self.l1.stats(),
+            "coalesced": self.coalesced,
+            "early_refreshes": self.early_refreshes,
+            "stale_skips": self.stale_skips,
+        }
 
 # Global cache instance
 cache = CacheService()
 
-def cache_result(key_prefix: str, ttl: int = 3600, key_func=None):
+def cache_result(key_prefix: str, ttl: int = 3600, key_func=None, tags=None):
     """
     Decorator to cache function results
     
@@ -166,6 +755,7 @@ def cache_result(key_prefix: str, ttl: int = 3600, key_func=None):
         key_prefix: Prefix for cache key
         ttl: Time to live in seconds
         key_func: Function to generate cache key from function arguments
+        tags: List of tags, or a function of the arguments returning one
     
     Example:
         @cache_result("user", ttl=1800, key_func=lambda user_id: f"user:{user_id}")
@@ -181,17 +771,14 @@ def cache_result(key_prefix: str, ttl: int = 3600, key_func=None):
                 cache_key = key_func(*args, **kwargs)
             else:
                 # Default: use function name + arguments
+                # (stable digest: builtin hash() differs per process, which breaks a shared Redis)
                 key_str = "_".join([str(arg) for arg in args] + [f"{k}:{v}" for k, v in kwargs.items()])
-                cache_key = f"{key_prefix}:{func.__name__}:{hash(key_str)}"
-            
-            # Try to get from cache
-            cached = cache.get(cache_key)
-            if cached is not None:
-                return cached
+                digest = hashlib.md5(key_str.encode("utf-8")).hexdigest()
+                cache_key = f"{key_prefix}:{func.__name__}:{digest}"
             
-            # Call function and cache result
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, ttl)
+            # L1/L2 lookup, single-flight on miss, early refresh near expiry
+            key_tags = tags(*args, **kwargs) if callable(tags) else (tags or ())
+            result = cache.get_or_compute(cache_key, lambda: func(*args, **kwargs), ttl, tags=key_tags)
             
             return result
         
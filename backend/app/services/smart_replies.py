@@ -0,0 +1,157 @@
+# backend/app/services/smart_replies.py
+"""
+Tính trước gợi ý trả lời nhanh (smart replies) cho hội thoại.
+
+Ngay khi 1 tin nhắn được lưu, `schedule_smart_replies` chạy nền việc sinh gợi ý cho
+người sẽ trả lời tiếp theo, lưu theo (conversation_id, role) và đẩy qua Socket.IO
+(event `chat_suggestions` tới room:<conversation_id>). Route gợi ý chỉ còn đọc cache.
+
+Mỗi hội thoại có số thứ tự (seq): tin mới tới trong lúc đang sinh → kết quả cũ bị bỏ.
+
+Đây là việc đầu cơ, dùng chung gemini_gate với chat thật nên bị giới hạn:
+tối đa SMART_REPLY_CONCURRENCY việc nền cùng lúc, và bỏ qua khi gate không còn slot rảnh
+(route sẽ lên lịch lại khi client hỏi). Chỉ lưu/emit output thật của model, không lưu
+danh sách fallback tĩnh.
+"""
+from __future__ import annotations
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from app.extensions import mongo_db, socketio
+from app.services.ttl_store import TTLStore
+from app.services.gemini_client import gemini_gate
+
+CONTEXT_MESSAGES = 3   # số tin gần nhất làm context (giống route /chat/suggestions)
+
+_store = TTLStore(
+    max_size=int(os.getenv("SMART_REPLY_CACHE_MAX", "2000")),
+    ttl_seconds=float(os.getenv("SMART_REPLY_CACHE_TTL", "1800")),
+)
+_seq: Dict[str, int] = {}          # conversation_id → seq của tin mới nhất đã lên lịch
+_inflight: Dict[str, int] = {}     # conversation_id → seq đang được sinh ở nền
+_lock = threading.Lock()
+# ngân sách riêng cho việc nền (không chờ: hết lượt → bỏ qua)
+_background = threading.BoundedSemaphore(max(1, int(os.getenv("SMART_REPLY_CONCURRENCY", "1"))))
+
+
+def build_suggestion_context(messages: Iterable[Dict[str, Any]]) -> str:
+    """Ghép các tin (cũ → mới) thành context ngắn cho prompt gợi ý."""
+    context_lines = []
+    for msg in list(messages)[-CONTEXT_MESSAGES:]:
+        role = msg.get("role") or msg.get("sender") or ""
+        text = (msg.get("text") or "").strip()
+        if text and len(text) > 5:  # Skip very short messages
+            role_label = "Bác sĩ" if role == "doctor" else "Bệnh nhân" if role == "patient" else "AI"
+            context_lines.append(f"{role_label}: {text}")
+    return "\n".join(context_lines)
+
+
+def next_roles(sender: str, conv: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Ai sẽ trả lời tin của `sender` → cần gợi ý cho role đó."""
+    sender = (sender or "").lower()
+    if sender == "patient":
+        # hội thoại với AI (không có bác sĩ) → AI trả lời, không cần gợi ý cho bác sĩ
+        if conv is not None and not conv.get("doctor_id"):
+            return []
+        return ["doctor"]
+    if sender in ("doctor", "ai", "model"):
+        return ["patient"]
+    return []
+
+
+def _key(conversation_id: str, role: str) -> str:
+    return f"{conversation_id}:{role}"
+
+
+def get_smart_replies(conversation_id: str, role: str) -> Optional[Dict[str, Any]]:
+    """Gợi ý đã tính sẵn (None nếu chưa có / đang tính)."""
+    return _store.get(_key(str(conversation_id), (role or "").lower()))
+
+
+def _generate(conversation_id: str, role: str, seq: int) -> None:
+    from app.services.ai_patient_advisor import get_patient_suggestions
+    from app.services.ai_doctor_advisor import get_doctor_suggestions
+
+    # gate đang bận phục vụ user → không tranh slot (tránh 429 cho chat thật)
+    if not gemini_gate.has_capacity() or not _background.acquire(blocking=False):
+        return
+    try:
+        msgs = list(mongo_db.messages.find(
+            {"conversation_id": ObjectId(conversation_id)},
+            {"text": 1, "sender": 1, "role": 1},
+        ).sort("created_at", -1).limit(CONTEXT_MESSAGES))
+        msgs.reverse()
+        context = build_suggestion_context(msgs)
+
+        if role == "patient":
+            suggestions = get_patient_suggestions(context, fallback=False)
+        else:
+            suggestions = get_doctor_suggestions(context, fallback=False)
+    except Exception as e:
+        print(f"⚠️ Smart reply error ({conversation_id}): {e}")
+        return
+    finally:
+        _background.release()
+
+    if not suggestions:
+        return  # AI bận/lỗi → không lưu danh sách mặc định như thể gợi ý đã tính
+    entry = {
+        "suggestions": suggestions,
+        "context_used": bool(context),
+        "role": role,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+    }
+    with _lock:
+        if _seq.get(conversation_id) != seq:
+            return  # đã có tin mới hơn → kết quả này lỗi thời
+        _store.set(_key(conversation_id, role), entry)
+    socketio.emit("chat_suggestions", {"conversation_id": conversation_id, **entry},
+                  room=f"room:{conversation_id}")
+
+
+def _run(conversation_id: str, roles: List[str], seq: int) -> None:
+    try:
+        for role in roles:
+            _generate(conversation_id, role, seq)
+    finally:
+        with _lock:
+            if _inflight.get(conversation_id) == seq:
+                _inflight.pop(conversation_id, None)
+
+
+def schedule_smart_replies(conversation_id, roles: Iterable[str]) -> None:
+    """Gọi sau khi lưu tin nhắn: bỏ gợi ý cũ và sinh gợi ý mới ở nền."""
+    roles = [r for r in roles if r in ("patient", "doctor")]
+    if not conversation_id or not roles:
+        return
+    conversation_id = str(conversation_id)
+    with _lock:
+        seq = _seq.get(conversation_id, 0) + 1
+        _seq[conversation_id] = seq
+        _inflight[conversation_id] = seq
+        if len(_seq) > _store.max_size * 2:      # giữ map seq không phình vô hạn
+            for k in list(_seq)[: len(_seq) // 2]:
+                if k not in _inflight:
+                    _seq.pop(k, None)
+    for role in roles:
+        _store.pop(_key(conversation_id, role))
+    try:
+        socketio.start_background_task(_run, conversation_id, roles, seq)
+    except Exception as e:
+        print(f"⚠️ Cannot schedule smart replies: {e}")
+        with _lock:
+            _inflight.pop(conversation_id, None)
+
+
+def ensure_smart_replies(conversation_id, role: str) -> bool:
+    """Cache miss ở route: lên lịch sinh gợi ý nếu chưa có việc nào đang chạy. True nếu đang/đã lên lịch."""
+    conversation_id = str(conversation_id)
+    with _lock:
+        if conversation_id in _inflight:
+            return True
+    schedule_smart_replies(conversation_id, [(role or "").lower()])
+    return conversation_id in _inflight
@@ -5,7 +5,7 @@ Cung cấp gợi ý thông minh dựa trên specialty và symptoms
 """
 
 from typing import Dict, List, Optional
-from app.services.gemini_service import gemini_chat
+from app.services.gemini_service import gemini_chat, AIBusyError, Deadline
 import json
 
 class SpecialtyAIService:
@@ -68,7 +68,8 @@ Trả lời bằng tiếng Việt, dễ hiểu cho phụ huynh."""
         specialty: str,
         symptoms: str,
         patient_info: Optional[Dict] = None,
-        vital_signs: Optional[Dict] = None
+        vital_signs: Optional[Dict] = None,
+        deadline: Optional[Deadline] = None
     ) -> Dict:
         """
         Get AI suggestions for examination based on specialty and symptoms
@@ -79,6 +80,7 @@ Trả lời bằng tiếng Việt, dễ hiểu cho phụ huynh."""
             symptoms: Triệu chứng chính
             patient_info: Thông tin bệnh nhân (tuổi, giới tính, tiền sử...)
             vital_signs: Dấu hiệu sinh tồn
+            deadline: Hạn chót chung (batch) — hết hạn thì call AI bị cắt
             
         Returns:
             Dict with suggestions for labs, diagnosis, medications
@@ -118,11 +120,15 @@ Format trả lời JSON:
         
         try:
             # Call gemini_chat function directly
+            # Prompt chứa triệu chứng/tuổi/giới/sinh hiệu/tiền sử (PHI) → không cache
             response = gemini_chat(
                 user_prompt=user_prompt,
                 system=system_prompt,
                 temperature=0.3,
-                max_tokens=1000
+                max_tokens=1000,
+                cache_response=False,
+                deadline=deadline,
+                use_case="specialty"
             )
             
             # Parse response (json already imported at top)
@@ -141,6 +147,8 @@ Format trả lời JSON:
                 "suggestions": suggestions
             }
             
+        except AIBusyError:
+            raise  # route trả 429 + Retry-After
         except json.JSONDecodeError:
             # Fallback: return raw text
             return {
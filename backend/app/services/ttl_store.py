@@ -0,0 +1,91 @@
+# backend/app/services/ttl_store.py
+"""
+Kho key → value trong RAM dùng chung: LRU giới hạn số lượng + TTL theo thời gian rảnh.
+
+Dùng cho state process-local cần tự dọn: session chat AI (ChatSessionStore),
+context EHR đã render, gợi ý smart reply, tiến độ batch X-quang, lượt chat provider_turns.
+Cache kết quả có giới hạn theo byte / tag → MemoryLRUCache (redis_cache).
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class TTLStore:
+    """Map key → value trong RAM: tối đa max_size mục (LRU) + TTL theo thời gian rảnh (0 = không hết hạn)."""
+
+    def __init__(self, max_size: int = 500, ttl_seconds: float = 1800):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()  # key → (value, last_used)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # bị đẩy ra vì đầy
+        self.expirations = 0    # bị loại vì rảnh quá TTL
+
+    def _expired(self, last_used: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - last_used > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, last_used = item
+            if self._expired(last_used, now):
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            self._purge_expired(now)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _purge_expired(self, now: float) -> None:
+        """Dọn mục quá hạn từ đầu LRU (cũ nhất trước). Gọi khi đang giữ lock."""
+        while self._data:
+            key, (_, last_used) = next(iter(self._data.items()))
+            if not self._expired(last_used, now):
+                break
+            del self._data[key]
+            self.expirations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,84 @@
+# backend/app/services/xray_cache.py
+"""
+Cache kết quả X-ray theo nội dung ảnh.
+
+Key = sha256(bytes ảnh upload) + (conf, iou, imgsz, mode full/tiled) + phiên bản model.
+Value = predictions đã chuẩn hoá + tên file annotated trong RESULT_DIR.
+LRU giới hạn theo số entry (XRAY_CACHE_MAX_ENTRIES). Phiên bản model (yolo_service.model_version)
+cố định trong vòng đời process như chính model đã load, nên cache không tự xoá khi best.pt bị ghi đè:
+thay weights → PHẢI restart app (và process pool); cache RAM mất theo, key mới mang version mới.
+"""
+from __future__ import annotations
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import get_settings
+from app.services.yolo_service import model_version
+from app.services.xray_writer import xray_writer
+
+CacheKey = Tuple[str, float, float, int, str, str]
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class XRayResultCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(0, int(max_entries))
+        self._data: "OrderedDict[CacheKey, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, image_hash: str, conf: float, iou: float, imgsz: int, result_dir: Path, mode: str = "full"
+    ) -> Optional[Dict[str, Any]]:
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            key = (image_hash, conf, iou, imgsz, mode, model_version())
+            entry = self._data.get(key)
+            # ảnh annotated có thể đã bị dọn khỏi đĩa (hoặc vẫn đang chờ write-behind)
+            name = entry["out_name"] if entry is not None else None
+            if name and not (result_dir / name).exists() and not xray_writer.is_pending(name):
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(
+        self, image_hash: str, conf: float, iou: float, imgsz: int, preds, top, out_name: str, mode: str = "full"
+    ) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            key = (image_hash, conf, iou, imgsz, mode, model_version())
+            self._data[key] = {"predictions": preds, "top": top, "out_name": out_name}
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "model_version": model_version(),
+        }
+
+
+# Global cache instance
+xray_cache = XRayResultCache(get_settings().XRAY_CACHE_MAX_ENTRIES)
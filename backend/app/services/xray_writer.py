@@ -0,0 +1,130 @@
+# backend/app/services/xray_writer.py
+"""
+Write-behind cho kết quả X-ray.
+
+predict_xray trả response ngay khi có predictions (URL ảnh đã xác định trước),
+còn việc encode JPEG annotated + `xray_results.insert_one` chạy ở worker nền
+(có retry). Trong lúc chưa flush, ảnh được giữ trong RAM để `get_xray_image`
+phục vụ trực tiếp.
+"""
+from __future__ import annotations
+import io
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from app.extensions import mongo_db
+
+JPEG_QUALITY = 90
+
+
+class _Job:
+    __slots__ = ("path", "image", "doc")
+
+    def __init__(self, path: Optional[Path], image: Optional[Image.Image], doc: Optional[Dict[str, Any]]):
+        self.path = path
+        self.image = image
+        self.doc = doc
+
+
+class XRayWriter:
+    def __init__(self, db_attempts: int = 3, retry_base_s: float = 0.5):
+        self.db_attempts = max(1, db_attempts)
+        self.retry_base_s = retry_base_s
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._pending: Dict[str, Image.Image] = {}   # tên file → ảnh chưa ghi xuống đĩa
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self.failed_writes = 0
+        self.failed_inserts = 0
+
+    # ---------- API ----------
+    def submit(self, path: Optional[Path], image: Optional[Image.Image], doc: Optional[Dict[str, Any]] = None) -> None:
+        """Xếp hàng ghi ảnh (nếu có) rồi insert doc (nếu có)."""
+        if path is not None and image is not None:
+            with self._lock:
+                self._pending[path.name] = image
+        self._ensure_worker()
+        self._queue.put(_Job(path, image, doc))
+
+    def is_pending(self, name: str) -> bool:
+        return name in self._pending
+
+    def pending_jpeg(self, name: str) -> Optional[bytes]:
+        """Encode ảnh còn trong RAM → bytes JPEG (None nếu đã flush / không có)."""
+        img = self._pending.get(name)
+        if img is None:
+            return None
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+        return buf.getvalue()
+
+    def wait_flushed(self, name: str, timeout: float = 2.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.is_pending(name):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "pending_images": len(self._pending),
+            "failed_writes": self.failed_writes,
+            "failed_inserts": self.failed_inserts,
+        }
+
+    # ---------- worker ----------
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name="xray-writer", daemon=True)
+                self._worker.start()
+
+    def _loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job.path is not None and job.image is not None:
+                    self._write_image(job.path, job.image)
+                if job.doc is not None:
+                    self._insert(job.doc)
+            except Exception as e:  # không để worker chết
+                print(f"[XRay] writer error: {e}")
+
+    def _write_image(self, path: Path, image: Image.Image) -> None:
+        try:
+            # ghi ra file tạm rồi rename → reader không bao giờ thấy file dở dang
+            tmp = path.with_name(path.name + ".part")
+            image.save(tmp, format="JPEG", quality=JPEG_QUALITY)
+            os.replace(tmp, path)
+        except Exception as e:
+            self.failed_writes += 1
+            print(f"[XRay] write annotated failed {path.name}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(path.name, None)
+
+    def _insert(self, doc: Dict[str, Any]) -> None:
+        for attempt in range(1, self.db_attempts + 1):
+            try:
+                mongo_db.xray_results.insert_one(doc)
+                return
+            except Exception as e:
+                if attempt == self.db_attempts:
+                    self.failed_inserts += 1
+                    print(f"[XRay] DB insert failed after {attempt} attempts: {e}")
+                    return
+                time.sleep(self.retry_base_s * (2 ** (attempt - 1)))
+
+
+# Global writer instance
+xray_writer = XRayWriter()
@@ -0,0 +1,170 @@
+# backend/app/services/yolo_batcher.py
+"""
+Micro-batching cho YOLO X-ray inference.
+
+Các request `/api/xray/predict` đồng thời được gom lại trong một cửa sổ ngắn
+(XRAY_BATCH_MAX_WAIT_MS, tối đa XRAY_BATCH_MAX_SIZE ảnh) rồi chạy MỘT lần
+`predict` trên cả batch; kết quả được trả về từng handler đang chờ qua Future.
+Request có tham số khác nhau (conf/iou/imgsz/device) được tách thành batch riêng.
+Batch lỗi → chạy lại từng ảnh để một ảnh hỏng không làm hỏng request của người khác.
+Batch được chạy qua `yolo_executor.run_batch` (process pool nếu bật).
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from app.config import get_settings
+from app.services.yolo_executor import pool_size, run_batch, run_infer
+
+BatchRunner = Callable[..., List[Tuple[List[Dict[str, Any]], Any]]]
+
+
+class _Pending:
+    __slots__ = ("source", "params", "future")
+
+    def __init__(self, source, params: Tuple, future: Future):
+        self.source = source
+        self.params = params
+        self.future = future
+
+
+class InferenceBatcher:
+    """Worker nền gom request và gọi `runner(sources, conf=, iou=, imgsz=, device=)`."""
+
+    def __init__(
+        self,
+        runner: BatchRunner,
+        max_batch_size: int = 8,
+        max_wait_ms: int = 25,
+        max_inflight: int = 1,
+    ):
+        self._runner = runner
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, int(max_wait_ms)) / 1000.0
+        # Số batch chạy song song (= số worker process); batch sau vẫn được gom trong lúc chờ
+        self._inflight = threading.BoundedSemaphore(max(1, int(max_inflight)))
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        image_path: Union[str, Path],
+        conf: float = 0.25,
+        iou: float = 0.45,
+        imgsz: int = 640,
+        device: Optional[str] = None,
+    ) -> Future:
+        self._ensure_worker()
+        fut: Future = Future()
+        self._queue.put(_Pending(image_path, (conf, iou, imgsz, device), fut))
+        return fut
+
+    def infer(self, image_path, conf=0.25, iou=0.45, imgsz=640, device=None, timeout: Optional[float] = None):
+        """Blocking: chờ kết quả của đúng ảnh này (preds, annotated)."""
+        return self.submit(image_path, conf=conf, iou=iou, imgsz=imgsz, device=device).result(timeout=timeout)
+
+    # ---------- internal ----------
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name="yolo-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            self._inflight.acquire()
+            threading.Thread(target=self._dispatch, args=(batch,), daemon=True).start()
+
+    def _dispatch(self, batch: List[_Pending]) -> None:
+        try:
+            self._run(batch)
+        except Exception as e:  # không để worker chết
+            print(f"[YOLO] batcher error: {e}")
+        finally:
+            self._inflight.release()
+
+    def _run(self, batch: List[_Pending]) -> None:
+        groups: Dict[Tuple, List[_Pending]] = {}
+        for item in batch:
+            if item.future.set_running_or_notify_cancel():
+                groups.setdefault(item.params, []).append(item)
+
+        for params, items in groups.items():
+            try:
+                outputs = self._run_group(items, params)
+            except Exception as e:
+                if len(items) == 1:
+                    items[0].future.set_exception(e)
+                    continue
+                # 1 ảnh hỏng (không decode được...) làm cả batch lỗi → chạy lại từng ảnh,
+                # chỉ ảnh lỗi nhận exception
+                print(f"[YOLO] batch of {len(items)} failed ({e}) → retry one by one")
+                for it in items:
+                    try:
+                        it.future.set_result(self._run_group([it], params)[0])
+                    except Exception as item_error:
+                        it.future.set_exception(item_error)
+                continue
+            for it, out in zip(items, outputs):
+                it.future.set_result(out)
+
+    def _run_group(self, items: List[_Pending], params: Tuple) -> List[Tuple[List[Dict[str, Any]], Any]]:
+        conf, iou, imgsz, device = params
+        outputs = self._runner([it.source for it in items], conf=conf, iou=iou, imgsz=imgsz, device=device)
+        if len(outputs) != len(items):
+            raise RuntimeError(f"batch size mismatch: {len(outputs)} != {len(items)}")
+        return outputs
+
+
+# ===== Singleton =====
+_BATCHER: Optional[InferenceBatcher] = None
+_BATCHER_LOCK = threading.Lock()
+
+
+def get_batcher() -> InferenceBatcher:
+    global _BATCHER
+    if _BATCHER is None:
+        with _BATCHER_LOCK:
+            if _BATCHER is None:
+                settings = get_settings()
+                _BATCHER = InferenceBatcher(
+                    run_batch,
+                    max_batch_size=settings.XRAY_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.XRAY_BATCH_MAX_WAIT_MS,
+                    max_inflight=pool_size() or 1,
+                )
+    return _BATCHER
+
+
+def batched_infer(
+    image_path: Union[str, Path],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+):
+    """Drop-in cho `yolo_service.infer`, đi qua micro-batcher nếu XRAY_BATCHING bật."""
+    if not get_settings().XRAY_BATCHING:
+        return run_infer(image_path, conf=conf, iou=iou, imgsz=imgsz, device=device)
+    return get_batcher().infer(image_path, conf=conf, iou=iou, imgsz=imgsz, device=device)
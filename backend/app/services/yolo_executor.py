@@ -0,0 +1,251 @@
+# backend/app/services/yolo_executor.py
+"""
+Process pool cho YOLO inference.
+
+App chạy `eventlet.monkey_patch()` → mọi request / Socket.IO dùng chung 1 hub.
+Torch predict là CPU-bound (vài giây) nên nếu chạy inline sẽ chặn cả hub.
+Module này đẩy inference sang các worker process (mỗi worker preload model
+1 lần qua `_get_model()`); phía web chỉ chờ Future — chờ kiểu green nên hub
+vẫn phục vụ request khác.
+
+XRAY_POOL_WORKERS = 0 → tắt pool, chạy inline như trước.
+
+Worker mặc định tạo bằng forkserver/spawn, KHÔNG fork: process web đã
+`eventlet.monkey_patch()` và giữ MongoClient (pymongo không fork-safe, lock/socket
+của hub bị copy nguyên trạng) → worker bắt đầu từ interpreter sạch, chỉ import
+yolo_service. Đổi qua XRAY_POOL_START_METHOD=fork chỉ khi chấp nhận rủi ro đó.
+"""
+from __future__ import annotations
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.config import get_settings
+from app.services import yolo_service
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+# ===== Readiness (warm-up lúc khởi động) =====
+_READY = threading.Event()
+_WARMUP: Dict[str, Any] = {"state": "pending"}
+
+# Kết quả warm-up của chính worker (chỉ có giá trị trong worker process)
+_WORKER_WARMUP: Dict[str, Any] = {}
+
+
+# ===== Chạy trong worker process =====
+def _init_worker() -> None:
+    """
+    Preload model (theo YOLO_BACKEND) ngay khi worker khởi động; bật XRAY_WARMUP_ON_START
+    thì chạy luôn inference giả → mọi worker đều nóng trước khi nhận task đầu tiên.
+    """
+    settings = get_settings()
+    if settings.XRAY_WARMUP_ON_START:
+        try:
+            _WORKER_WARMUP.update(yolo_service.warmup(settings.YOLO_IMGSZ))
+        except Exception as e:
+            _WORKER_WARMUP["error"] = str(e) or e.__class__.__name__
+        return
+    if settings.YOLO_BACKEND == "onnx":
+        from app.services import yolo_onnx
+        yolo_onnx.get_session()
+    else:
+        yolo_service._get_model()
+
+
+def _ping() -> Dict[str, Any]:
+    return {
+        "pid": os.getpid(),
+        "model_loaded": yolo_service._MODEL is not None,
+        "model_kind": yolo_service._MODEL_KIND,
+        "warmup": dict(_WORKER_WARMUP),
+    }
+
+
+# ===== Phía web process =====
+def pool_size() -> int:
+    return max(0, get_settings().XRAY_POOL_WORKERS)
+
+
+def _mp_context():
+    method = get_settings().XRAY_POOL_START_METHOD
+    if not method:
+        # không fork process đã monkey-patch + có MongoClient (xem docstring module);
+        # worker import lại __main__ dưới tên __mp_main__ → run.py bỏ qua khởi tạo app
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+    return mp.get_context(method)
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Tạo pool lần đầu dùng; None nếu pool bị tắt."""
+    global _POOL
+    workers = pool_size()
+    if workers <= 0:
+        return None
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                if get_settings().YOLO_BACKEND == "onnx":
+                    # export .onnx 1 lần ở process cha trước khi có worker (worker chỉ đọc)
+                    from app.services import yolo_onnx
+                    try:
+                        yolo_onnx.onnx_path()
+                    except Exception as e:
+                        print(f"[YOLO] ONNX export before pool failed: {e}")
+                _POOL = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=_mp_context(),
+                    initializer=_init_worker,
+                )
+                print(f"[YOLO] Inference pool started: {workers} worker(s)")
+    return _POOL
+
+
+def _reset_pool() -> None:
+    """Bỏ pool hỏng (worker crash / OOM) để lần gọi sau tạo lại."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            try:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            except Exception:
+                pass
+        _POOL = None
+
+
+def shutdown_pool() -> None:
+    _reset_pool()
+
+
+def run_batch(
+    image_paths: Sequence[Union[str, Path, np.ndarray]],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+    render: bool = True,
+) -> List[Tuple[List[Dict[str, Any]], Any]]:
+    """
+    `infer_batch` chạy trên worker process; fallback inline nếu pool tắt.
+    render=False: worker không vẽ + không pickle ảnh annotated về (annotated = None).
+    """
+    pool = get_pool()
+    if pool is None:
+        return yolo_service.infer_batch(image_paths, conf=conf, iou=iou, imgsz=imgsz, device=device, render=render)
+
+    # ndarray pickle được sang worker; Path đổi sang str
+    sources = [p if isinstance(p, np.ndarray) else str(p) for p in image_paths]
+    try:
+        fut = pool.submit(
+            yolo_service.infer_batch, sources, conf=conf, iou=iou, imgsz=imgsz, device=device, render=render
+        )
+        # Future.result() chờ trên Condition (đã monkey-patch) → nhường hub, không chặn
+        return fut.result(timeout=get_settings().XRAY_INFER_TIMEOUT)
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+
+
+def run_infer(
+    image_path: Union[str, Path, np.ndarray],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+    render: bool = True,
+) -> Tuple[List[Dict[str, Any]], Any]:
+    """Drop-in cho `yolo_service.infer` nhưng chạy ngoài hub; chỉ cần preds → render=False."""
+    return run_batch([image_path], conf=conf, iou=iou, imgsz=imgsz, device=device, render=render)[0]
+
+
+def run_tiled(
+    image: Union[str, Path, np.ndarray],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Any]:
+    """`infer_tiled` (mọi tile của 1 ảnh = 1 batch) chạy trên worker process."""
+    pool = get_pool()
+    if pool is None:
+        return yolo_service.infer_tiled(image, conf=conf, iou=iou, imgsz=imgsz, device=device)
+
+    source = image if isinstance(image, np.ndarray) else str(image)
+    try:
+        fut = pool.submit(yolo_service.infer_tiled, source, conf=conf, iou=iou, imgsz=imgsz, device=device)
+        return fut.result(timeout=get_settings().XRAY_INFER_TIMEOUT)
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+
+
+def warmup() -> Dict[str, Any]:
+    """
+    Load model + chạy inference giả ở YOLO_IMGSZ trên mọi worker rồi bật cờ ready.
+    Gọi 1 lần lúc khởi động (background task); lỗi được ghi lại chứ không raise.
+
+    Với pool, mỗi worker tự warm-up trong initializer (_init_worker) trước task đầu tiên.
+    Ở đây chỉ submit pool_size lần `_ping` để pool khởi động đủ worker và chờ chúng xong
+    initializer; pool không đảm bảo mỗi worker nhận đúng 1 ping nên `details` có thể ít
+    hơn số worker, nhưng worker nào chạy được task cũng đã nóng.
+    """
+    settings = get_settings()
+    _WARMUP.update(state="warming_up", started_at=time.time())
+    try:
+        pool = get_pool()
+        if pool is None:
+            details = [yolo_service.warmup(settings.YOLO_IMGSZ)]
+        else:
+            futs = [pool.submit(_ping) for _ in range(pool_size())]
+            pings = [f.result(timeout=settings.XRAY_INFER_TIMEOUT * 2) for f in futs]
+            details = list({p["pid"]: p for p in pings}.values())
+            errors = [p["warmup"]["error"] for p in details if p["warmup"].get("error")]
+            if errors:
+                raise RuntimeError("; ".join(errors))
+        _WARMUP.update(state="ready", details=details, finished_at=time.time())
+        _READY.set()
+        print(f"[YOLO] Warm-up done: {details}")
+    except Exception as e:
+        _WARMUP.update(state="failed", error=str(e), finished_at=time.time())
+        print(f"[YOLO] Warm-up failed: {e}")
+    return dict(_WARMUP)
+
+
+def is_ready() -> bool:
+    """True khi model đã nóng; nếu tắt warm-up thì luôn ready (lazy-load như cũ)."""
+    return _READY.is_set() or not get_settings().XRAY_WARMUP_ON_START
+
+
+def readiness() -> Dict[str, Any]:
+    return {"ready": is_ready(), **_WARMUP}
+
+
+def health(timeout: float = 5.0) -> Dict[str, Any]:
+    """Health probe: ping 1 worker, trả trạng thái pool."""
+    workers = pool_size()
+    if workers <= 0:
+        return {
+            "mode": "inline",
+            "healthy": True,
+            "model_loaded": yolo_service._MODEL is not None,
+        }
+
+    info: Dict[str, Any] = {"mode": "process_pool", "workers": workers}
+    t0 = time.monotonic()
+    try:
+        worker = get_pool().submit(_ping).result(timeout=timeout)
+        info.update(healthy=True, latency_ms=round((time.monotonic() - t0) * 1000, 1), worker=worker)
+    except BrokenProcessPool as e:
+        _reset_pool()
+        info.update(healthy=False, error=f"pool broken: {e}")
+    except Exception as e:
+        info.update(healthy=False, error=str(e) or e.__class__.__name__)
+    return info
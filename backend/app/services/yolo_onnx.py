@@ -0,0 +1,231 @@
+# backend/app/services/yolo_onnx.py
+"""
+ONNX Runtime backend cho YOLO (CPU).
+
+- Export best.pt → best.onnx MỘT lần (cache cạnh file weights, export lại khi .pt mới hơn).
+  Export chạy trong file lock + thư mục tạm rồi os.replace → nhiều process (pool worker,
+  nhiều instance web) không ghi đè / đọc file .onnx dở dang của nhau.
+- Chạy bằng onnxruntime với số thread intra-op cấu hình được (ONNX_INTRA_OP_THREADS).
+- Provider cấu hình qua ONNX_PROVIDERS (vd "OpenVINOExecutionProvider,CPUExecutionProvider").
+- Trả đúng contract của yolo_service.infer_batch: list (preds, annotated PIL).
+
+Bật bằng YOLO_BACKEND=onnx. Cần: pip install onnxruntime (export cần ultralytics + onnx).
+"""
+from __future__ import annotations
+import ast
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.config import get_settings
+from app.utils.xray_render import render_predictions
+
+_SESSION = None
+_NAMES: Dict[int, str] = {}
+_TASK: str = "detect"
+_LOCK = threading.Lock()
+_EXPORT_LOCK = threading.Lock()
+
+
+def _weights_path() -> Path:
+    from app.services.yolo_service import _resolve_model_path
+    return _resolve_model_path()
+
+
+def _is_fresh(out: Path, pt: Path) -> bool:
+    return out.exists() and out.stat().st_mtime >= pt.stat().st_mtime
+
+
+@contextmanager
+def _export_lock(out: Path):
+    """Khoá liên process (flock trên file .lock cạnh .onnx); Windows không có fcntl → chỉ khoá thread."""
+    with _EXPORT_LOCK:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(out.with_name(out.name + ".lock"), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def onnx_path() -> Path:
+    """
+    Đường dẫn best.onnx cạnh best.pt; export nếu chưa có hoặc cũ hơn weights.
+    Process đến sau chờ lock rồi dùng luôn file process trước đã export.
+    """
+    pt = _weights_path()
+    out = pt.with_suffix(".onnx")
+    if _is_fresh(out, pt):
+        return out
+
+    with _export_lock(out):
+        if _is_fresh(out, pt):
+            return out
+        from ultralytics import YOLO  # type: ignore
+        print(f"[YOLO] Exporting ONNX: {pt} → {out}")
+        # Ultralytics ghi file cạnh .pt → export bản copy trong thư mục tạm, xong mới thay file thật
+        with tempfile.TemporaryDirectory(dir=str(pt.parent)) as tmp:
+            tmp_pt = Path(tmp) / pt.name
+            shutil.copy2(pt, tmp_pt)
+            exported = YOLO(str(tmp_pt)).export(format="onnx", imgsz=get_settings().YOLO_IMGSZ, dynamic=True)
+            os.replace(exported, out)
+    return out
+
+
+def get_session():
+    """Lazy-load onnxruntime.InferenceSession (+ đọc names/task từ metadata Ultralytics)."""
+    global _SESSION, _NAMES, _TASK
+    if _SESSION is not None:
+        return _SESSION
+    with _LOCK:
+        if _SESSION is not None:
+            return _SESSION
+
+        import onnxruntime as ort  # type: ignore
+
+        settings = get_settings()
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.ONNX_INTRA_OP_THREADS > 0:
+            so.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+        so.inter_op_num_threads = 1
+
+        available = set(ort.get_available_providers())
+        wanted = [p.strip() for p in settings.ONNX_PROVIDERS.split(",") if p.strip()]
+        providers = [p for p in wanted if p in available] or ["CPUExecutionProvider"]
+
+        path = onnx_path()
+        sess = ort.InferenceSession(str(path), sess_options=so, providers=providers)
+
+        meta = sess.get_modelmeta().custom_metadata_map or {}
+        try:
+            _NAMES = {int(k): str(v) for k, v in ast.literal_eval(meta.get("names", "{}")).items()}
+        except Exception:
+            _NAMES = {}
+        _TASK = meta.get("task", "detect")
+        _SESSION = sess
+        print(f"[YOLO] Loaded ONNX model: {path} providers={sess.get_providers()}")
+        return _SESSION
+
+
+# ===== Pre/Post-processing =====
+def _letterbox(img: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Resize giữ tỉ lệ + pad 114 về size x size (giống Ultralytics)."""
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - nw) / 2.0, (size - nh) / 2.0
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return img, r, (left, top)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, iou: float) -> np.ndarray:
+    """NMS theo từng class (offset box theo class id → 1 lần NMSBoxes)."""
+    if len(boxes) == 0:
+        return np.empty((0,), dtype=int)
+    offset = classes[:, None].astype(np.float32) * 4096.0
+    b = boxes + offset
+    xywh = np.concatenate([b[:, :2], b[:, 2:] - b[:, :2]], axis=1)
+    keep = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), 0.0, iou)
+    return np.array(keep, dtype=int).reshape(-1)
+
+
+def _decode_detect(out: np.ndarray, conf: float, iou: float, ratio: float, pad, shape) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """out: (4+nc, N) → boxes xyxy (pixel ảnh gốc), scores, classes."""
+    pred = out.T                                  # (N, 4+nc)
+    cls_scores = pred[:, 4:]
+    classes = cls_scores.argmax(axis=1)
+    scores = cls_scores[np.arange(len(pred)), classes]
+    m = scores >= conf
+    pred, scores, classes = pred[m], scores[m], classes[m]
+    if len(pred) == 0:
+        return np.empty((0, 4), np.float32), scores, classes
+
+    cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    keep = _nms(boxes, scores, classes, iou)
+    boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+    # bỏ letterbox → toạ độ ảnh gốc
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    H, W = shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, W)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, H)
+    return boxes, scores, classes
+
+
+def infer_batch(
+    image_paths: Sequence[Union[str, Path, np.ndarray]],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+    render: bool = True,
+) -> List[Tuple[List[Dict[str, Any]], Optional[Image.Image]]]:
+    """Cùng contract với yolo_service.infer_batch (device bị bỏ qua: luôn theo ONNX_PROVIDERS)."""
+    from app.services.yolo_service import _bgr_ndarray_to_pil, _label_for
+
+    images: List[np.ndarray] = []
+    for p in image_paths:
+        if isinstance(p, np.ndarray):
+            images.append(p)
+            continue
+        if not Path(p).exists():
+            raise FileNotFoundError(str(p))
+        img = cv2.imread(str(p))
+        if img is None:
+            raise ValueError(f"Không đọc được ảnh: {p}")
+        images.append(img)
+    if not images:
+        return []
+
+    sess = get_session()
+    size = int(np.ceil(imgsz / 32) * 32)  # stride 32
+    metas, blobs = [], []
+    for img in images:
+        boxed, r, pad = _letterbox(img, size)
+        blobs.append(boxed[:, :, ::-1].transpose(2, 0, 1))   # BGR→RGB, HWC→CHW
+        metas.append((r, pad))
+    batch = np.ascontiguousarray(np.stack(blobs), dtype=np.float32) / 255.0
+
+    out = sess.run(None, {sess.get_inputs()[0].name: batch})[0]
+
+    outputs: List[Tuple[List[Dict[str, Any]], Optional[Image.Image]]] = []
+    for i, img in enumerate(images):
+        preds: List[Dict[str, Any]] = []
+        if _TASK == "classify":
+            probs = out[i].reshape(-1)
+            for cls_id in probs.argsort()[::-1][:5]:
+                preds.append({"label": _label_for(_NAMES, int(cls_id)), "prob": float(probs[cls_id])})
+            annotated = img
+        else:
+            r, pad = metas[i]
+            boxes, scores, classes = _decode_detect(out[i], conf, iou, r, pad, img.shape)
+            for box, sc, cls_id in zip(boxes, scores, classes):
+                preds.append({
+                    "label": _label_for(_NAMES, int(cls_id)),
+                    "prob": float(sc),
+                    "box": [float(v) for v in box.tolist()],
+                })
+            annotated = render_predictions(img, preds) if render else None
+        preds.sort(key=lambda x: x.get("prob", 0.0), reverse=True)
+        outputs.append((preds, _bgr_ndarray_to_pil(annotated) if render else None))
+    return outputs
@@ -1,17 +1,20 @@
 # backend/app/services/yolo_service.py
 from __future__ import annotations
+import time
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional, Union
+from typing import List, Dict, Any, Tuple, Optional, Union, Sequence
 
 import numpy as np
 from PIL import Image
 
 from app.config import get_settings
+from app.utils.xray_render import render_predictions
 
 # ===== Model cache =====
 _MODEL = None
 _MODEL_KIND: Optional[str] = None  # "ultralytics" | "yolov5"
 _MODEL_PATH: Optional[Path] = None
+_MODEL_VERSION: Optional[str] = None
 
 
 def _resolve_model_path() -> Path:
@@ -43,6 +46,24 @@ def _resolve_model_path() -> Path:
     return _MODEL_PATH
 
 
+def model_version() -> str:
+    """
+    Định danh phiên bản model: file weights thực sự được load (sau fallback) + mtime + size + backend.
+    Chốt 1 lần cho cả vòng đời process, giống _MODEL (không reload khi best.pt bị ghi đè):
+    thay model → restart app/pool, version mới đi kèm model mới.
+    """
+    global _MODEL_VERSION
+    if _MODEL_VERSION is not None:
+        return _MODEL_VERSION
+    try:
+        p = _resolve_model_path()
+        st = p.stat()
+    except Exception:
+        return str(get_settings().YOLO_MODEL_PATH)  # chưa có file → chưa chốt, lần sau tính lại
+    _MODEL_VERSION = f"{p}:{st.st_mtime_ns}:{st.st_size}:{get_settings().YOLO_BACKEND}"
+    return _MODEL_VERSION
+
+
 def _get_model():
     """Lazy-load model. Ưu tiên Ultralytics; fallback YOLOv5 (torch hub)."""
     global _MODEL, _MODEL_KIND
@@ -50,6 +71,7 @@ def _get_model():
         return _MODEL
 
     model_path = str(_resolve_model_path())
+    model_version()  # chốt version theo đúng file sắp load
 
     # Try Ultralytics
     try:
@@ -80,73 +102,100 @@ def _bgr_ndarray_to_pil(bgr: np.ndarray) -> Image.Image:
     return Image.fromarray(bgr).convert("RGB")
 
 
-def infer(
-    image_path: Union[str, Path],
+def _label_for(names, cls_id: int) -> str:
+    if isinstance(names, dict):
+        return names.get(cls_id, str(cls_id))
+    # names có thể là list
+    return names[cls_id] if isinstance(names, (list, tuple)) and cls_id < len(names) else str(cls_id)
+
+
+def _parse_ultralytics(r, names, render: bool = True) -> Tuple[List[Dict[str, Any]], Optional[Image.Image]]:
+    """Chuyển 1 `Results` của Ultralytics → (preds, annotated PIL | None nếu render=False)."""
+    preds: List[Dict[str, Any]] = []
+
+    # ===== Detection: có boxes → LẤY BBOX =====
+    if getattr(r, "boxes", None) is not None and len(r.boxes) > 0:
+        xyxy = r.boxes.xyxy.cpu().numpy()       # (N,4)
+        confs = r.boxes.conf.cpu().numpy()      # (N,)
+        clses = r.boxes.cls.cpu().numpy()       # (N,)
+        for box, cf, cls in zip(xyxy, confs, clses):
+            x1, y1, x2, y2 = [float(v) for v in box.tolist()]
+            preds.append({"label": _label_for(names, int(cls)), "prob": float(cf), "box": [x1, y1, x2, y2]})
+
+    # ===== Classification: không có bbox → trả top-k label/prob =====
+    elif getattr(r, "probs", None) is not None:
+        # topk 5 nhãn
+        tk = r.probs.topk(5)
+        vals = tk.values.tolist()
+        idxs = tk.indices.tolist()
+        for v, i in zip(vals, idxs):
+            preds.append({"label": _label_for(names, int(i)), "prob": float(v)})
+
+    if not render:
+        return preds, None
+    if preds and "box" in preds[0]:
+        # Detection: tự vẽ 1 lượt bằng cv2 trên ảnh gốc (nhanh hơn r.plot(), màu theo label)
+        annotated_nd = render_predictions(r.orig_img, preds)
+    else:
+        annotated_nd = r.plot()  # ndarray BGR (classification: Ultralytics vẽ top-k)
+    return preds, _bgr_ndarray_to_pil(annotated_nd)
+
+
+def infer_batch(
+    image_paths: Sequence[Union[str, Path, np.ndarray]],
     conf: float = 0.25,
     iou: float = 0.45,
     imgsz: int = 640,
     device: Optional[str] = None,
-) -> Tuple[List[Dict[str, Any]], Image.Image]:
+    backend: Optional[str] = None,
+    render: bool = True,
+) -> List[Tuple[List[Dict[str, Any]], Optional[Image.Image]]]:
     """
-    Chạy model và trả:
-      - preds: List[ {label: str, prob: float(0..1), box?: [x1,y1,x2,y2]} ]
-      - annotated: PIL.Image (ảnh đã vẽ nếu là detection)
+    Chạy model trên nhiều ảnh trong MỘT lần gọi `predict` (batch).
+    Mỗi phần tử là đường dẫn file hoặc ndarray BGR (như cv2.imread).
+    Trả list (preds, annotated) theo đúng thứ tự đầu vào — cùng format với `infer`.
+    backend: "torch" | "onnx" (mặc định theo YOLO_BACKEND).
+    render=False: bỏ qua bước vẽ (annotated = None), dùng cho tile.
     """
-    p = Path(image_path)
-    if not p.exists():
-        raise FileNotFoundError(str(p))
+    if (backend or get_settings().YOLO_BACKEND) == "onnx":
+        from app.services import yolo_onnx
+        return yolo_onnx.infer_batch(image_paths, conf=conf, iou=iou, imgsz=imgsz, device=device, render=render)
+    return _infer_batch_torch(image_paths, conf=conf, iou=iou, imgsz=imgsz, device=device, render=render)
+
+
+def _infer_batch_torch(
+    image_paths: Sequence[Union[str, Path, np.ndarray]],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+    render: bool = True,
+) -> List[Tuple[List[Dict[str, Any]], Optional[Image.Image]]]:
+    """Backend PyTorch (Ultralytics / YOLOv5 hub)."""
+    paths = [p if isinstance(p, np.ndarray) else Path(p) for p in image_paths]
+    if not paths:
+        return []
+    for p in paths:
+        if isinstance(p, Path) and not p.exists():
+            raise FileNotFoundError(str(p))
 
     model = _get_model()
     kind = _MODEL_KIND or "ultralytics"
-    preds: List[Dict[str, Any]] = []
+    outputs: List[Tuple[List[Dict[str, Any]], Optional[Image.Image]]] = []
 
     if kind == "ultralytics":
-        from ultralytics.engine.results import Results  # type: ignore
-
         results = model.predict(
-            source=str(p),
+            source=[p if isinstance(p, np.ndarray) else str(p) for p in paths],
             conf=conf,
             iou=iou,
             imgsz=imgsz,
             device=device or "cpu",  # ép CPU nếu không chắc CUDA
             verbose=False,
         )
-        r: Results = results[0]
-        # tên lớp
-        names = getattr(model, "names", None) or getattr(r, "names", None) or {}
-
-        # ===== Detection: có boxes → LẤY BBOX =====
-        if getattr(r, "boxes", None) is not None and len(r.boxes) > 0:
-            xyxy = r.boxes.xyxy.cpu().numpy()       # (N,4)
-            confs = r.boxes.conf.cpu().numpy()      # (N,)
-            clses = r.boxes.cls.cpu().numpy()       # (N,)
-            for box, cf, cls in zip(xyxy, confs, clses):
-                x1, y1, x2, y2 = [float(v) for v in box.tolist()]
-                cls_id = int(cls)
-                if isinstance(names, dict):
-                    label = names.get(cls_id, str(cls_id))
-                else:
-                    # names có thể là list
-                    label = names[cls_id] if isinstance(names, (list, tuple)) and cls_id < len(names) else str(cls_id)
-                preds.append({"label": label, "prob": float(cf), "box": [x1, y1, x2, y2]})
-
-        # ===== Classification: không có bbox → trả top-k label/prob =====
-        elif getattr(r, "probs", None) is not None:
-            # topk 5 nhãn
-            tk = r.probs.topk(5)
-            vals = tk.values.tolist()
-            idxs = tk.indices.tolist()
-            for v, i in zip(vals, idxs):
-                cls_id = int(i)
-                if isinstance(names, dict):
-                    label = names.get(cls_id, str(cls_id))
-                else:
-                    label = names[cls_id] if isinstance(names, (list, tuple)) and cls_id < len(names) else str(cls_id)
-                preds.append({"label": label, "prob": float(v)})
-
-        # annotated từ Ultralytics (đã vẽ nếu có boxes)
-        annotated_nd = r.plot()  # ndarray BGR
-        annotated_pil = _bgr_ndarray_to_pil(annotated_nd)
+        for r in results:
+            # tên lớp
+            names = getattr(model, "names", None) or getattr(r, "names", None) or {}
+            outputs.append(_parse_ultralytics(r, names, render=render))
 
     else:
         # ===== YOLOv5 hub =====
@@ -157,21 +206,148 @@ def infer(
         except Exception:
             pass
 
-        results = model(str(p), size=imgsz)
+        # YOLOv5 hub nhận ndarray RGB
+        results = model([p[:, :, ::-1] if isinstance(p, np.ndarray) else str(p) for p in paths], size=imgsz)
         names = getattr(model, "names", {})
+        ann_list = results.render() if render else None  # list BGR ndarray
 
-        # Detection
-        if hasattr(results, "xyxy") and len(results.xyxy) and results.xyxy[0] is not None:
-            for *xyxy_vals, confv, cls_id in results.xyxy[0].tolist():
-                x1, y1, x2, y2 = [float(x) for x in xyxy_vals]
-                label = names[int(cls_id)] if isinstance(names, dict) else str(int(cls_id))
-                preds.append({"label": label, "prob": float(confv), "box": [x1, y1, x2, y2]})
-        # (YOLOv5 hub classification support hạn chế; bỏ qua)
-
-        # annotated
-        ann_list = results.render()  # list BGR ndarray
-        annotated_pil = _bgr_ndarray_to_pil(ann_list[0])
+        for i in range(len(paths)):
+            preds: List[Dict[str, Any]] = []
+            # Detection
+            if hasattr(results, "xyxy") and i < len(results.xyxy) and results.xyxy[i] is not None:
+                for *xyxy_vals, confv, cls_id in results.xyxy[i].tolist():
+                    x1, y1, x2, y2 = [float(x) for x in xyxy_vals]
+                    label = names[int(cls_id)] if isinstance(names, dict) else str(int(cls_id))
+                    preds.append({"label": label, "prob": float(confv), "box": [x1, y1, x2, y2]})
+            # (YOLOv5 hub classification support hạn chế; bỏ qua)
+            outputs.append((preds, _bgr_ndarray_to_pil(ann_list[i]) if render else None))
 
     # Sắp xếp theo xác suất giảm dần
+    for preds, _ in outputs:
+        preds.sort(key=lambda x: x.get("prob", 0.0), reverse=True)
+    return outputs
+
+
+def infer(
+    image_path: Union[str, Path, np.ndarray],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Image.Image]:
+    """
+    Chạy model và trả:
+      - preds: List[ {label: str, prob: float(0..1), box?: [x1,y1,x2,y2]} ]
+      - annotated: PIL.Image (ảnh đã vẽ nếu là detection)
+    """
+    return infer_batch([image_path], conf=conf, iou=iou, imgsz=imgsz, device=device)[0]
+
+
+def _tile_origins(length: int, tile: int, step: int) -> List[int]:
+    """Vị trí bắt đầu các tile trên 1 trục; tile cuối luôn sát mép ảnh."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def _nms_per_label(preds: List[Dict[str, Any]], iou: float) -> List[Dict[str, Any]]:
+    """NMS (numpy) theo từng label để gộp box trùng giữa các tile chồng lấn."""
+    kept: List[Dict[str, Any]] = []
+    by_label: Dict[str, List[Dict[str, Any]]] = {}
+    for p in preds:
+        by_label.setdefault(p["label"], []).append(p)
+
+    for items in by_label.values():
+        boxes = np.array([p["box"] for p in items], dtype=np.float32)
+        scores = np.array([p["prob"] for p in items], dtype=np.float32)
+        areas = (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+        order = scores.argsort()[::-1]
+        while order.size:
+            i = order[0]
+            kept.append(items[i])
+            rest = order[1:]
+            xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+            yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+            xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+            yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+            inter = (xx2 - xx1).clip(0) * (yy2 - yy1).clip(0)
+            ovr = inter / (areas[i] + areas[rest] - inter + 1e-9)
+            order = rest[ovr <= iou]
+    return kept
+
+
+def infer_tiled(
+    image: Union[str, Path, np.ndarray],
+    conf: float = 0.25,
+    iou: float = 0.45,
+    imgsz: int = 640,
+    device: Optional[str] = None,
+    tile: Optional[int] = None,
+    overlap: Optional[float] = None,
+) -> Tuple[List[Dict[str, Any]], Image.Image]:
+    """
+    Sliding-window cho film độ phân giải cao: cắt ảnh thành các tile chồng lấn
+    (mặc định tile = imgsz → model thấy đúng độ phân giải gốc), chạy TẤT CẢ tile
+    trong 1 batch, dời box về toạ độ ảnh gốc rồi NMS theo label giữa các tile.
+    Kèm 1 lượt toàn ảnh (XRAY_TILE_INCLUDE_FULL) để giữ tổn thương lớn hơn 1 tile.
+    Chỉ áp dụng cho detection; model classification → như `infer`.
+    """
+    import cv2
+
+    settings = get_settings()
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        img = cv2.imread(str(image))
+        if img is None:
+            raise FileNotFoundError(str(image))
+    tile = int(tile or settings.XRAY_TILE_SIZE or imgsz)
+    overlap = settings.XRAY_TILE_OVERLAP if overlap is None else overlap
+    step = max(1, int(tile * (1.0 - min(max(overlap, 0.0), 0.9))))
+
+    H, W = img.shape[:2]
+    if max(H, W) <= tile:
+        return infer(img, conf=conf, iou=iou, imgsz=imgsz, device=device)
+
+    origins = [(x, y) for y in _tile_origins(H, tile, step) for x in _tile_origins(W, tile, step)]
+    crops = [img[y:y + tile, x:x + tile] for x, y in origins]
+    if settings.XRAY_TILE_INCLUDE_FULL:
+        crops.append(img)
+        origins.append((0, 0))
+
+    outputs = infer_batch(crops, conf=conf, iou=iou, imgsz=imgsz, device=device, render=False)
+
+    merged: List[Dict[str, Any]] = []
+    for (ox, oy), (preds, _) in zip(origins, outputs):
+        for p in preds:
+            if "box" not in p:
+                # classification model: tiling không có ý nghĩa
+                return infer(img, conf=conf, iou=iou, imgsz=imgsz, device=device)
+            x1, y1, x2, y2 = p["box"]
+            merged.append({**p, "box": [x1 + ox, y1 + oy, x2 + ox, y2 + oy]})
+
+    preds = _nms_per_label(merged, iou)
     preds.sort(key=lambda x: x.get("prob", 0.0), reverse=True)
-    return preds, annotated_pil
+    return preds, _bgr_ndarray_to_pil(render_predictions(img, preds))
+
+
+def warmup(imgsz: int = 640, device: Optional[str] = None) -> Dict[str, Any]:
+    """Load model + chạy 1 inference giả ở đúng imgsz để lần predict đầu không bị chậm."""
+    backend = get_settings().YOLO_BACKEND
+    t0 = time.monotonic()
+    if backend == "onnx":
+        from app.services import yolo_onnx
+        yolo_onnx.get_session()
+    else:
+        _get_model()
+    t_load = time.monotonic() - t0
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    infer_batch([dummy], imgsz=imgsz, device=device)
+    return {
+        "backend": backend,
+        "model_kind": _MODEL_KIND,
+        "load_s": round(t_load, 2),
+        "warmup_s": round(time.monotonic() - t0 - t_load, 2),
+    }
@@ -15,7 +15,11 @@ class APIError(Exception):
 def register_error_handlers(app):
     @app.errorhandler(APIError)
     def handle_api_error(err: APIError):
-        return jsonify({"status": "error", "code": err.status_code, "message": err.message}), err.status_code
+        resp = jsonify({"status": "error", "code": err.status_code, "message": err.message})
+        retry_after = getattr(err, "retry_after", None)
+        if retry_after:
+            resp.headers["Retry-After"] = str(retry_after)
+        return resp, err.status_code
 
     @app.errorhandler(404)
     def handle_404(_):
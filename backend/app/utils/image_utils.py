@@ -1,4 +1,5 @@
 # 
+from __future__ import annotations
 from pathlib import Path
 import uuid
 import cv2
@@ -13,30 +14,59 @@ def safe_filename(original: str) -> str:
     ext = Path(name).suffix or ".jpg"
     return f"{uuid.uuid4().hex[:12]}{ext}"
 
-def resize_inplace(image_path: Path, max_size: int = 1024) -> None:
-    img = cv2.imread(str(image_path))
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode bytes (PNG/JPEG) → ndarray BGR, không đụng tới đĩa."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
     if img is None:
         raise ValueError("Không đọc được ảnh.")
+    return img
+
+def resize_max(img: np.ndarray, max_size: int = 1024) -> np.ndarray:
+    """Thu nhỏ để cạnh dài nhất <= max_size (giữ tỉ lệ); ảnh nhỏ hơn giữ nguyên."""
     h, w = img.shape[:2]
     m = max(h, w)
     if m > max_size:
         scale = max_size / float(m)
         new_w, new_h = int(w*scale), int(h*scale)
-        resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        cv2.imwrite(str(image_path), resized)
+        return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    return img
 
-def annotate_bboxes(image_bgr: np.ndarray, boxes, labels, confs, names) -> np.ndarray:
+def annotate_bboxes(
+    image_bgr: np.ndarray,
+    boxes,
+    labels,
+    confs,
+    names,
+    colors=None,
+    thickness: int = 2,
+    font_scale: float = 0.55,
+    label_bg: bool = False,
+    label_fmt: str = "{label} {conf:.2f}",
+    empty_text: str | None = "No findings",
+) -> np.ndarray:
+    """
+    Vẽ bbox + nhãn lên bản sao ảnh BGR trong 1 lượt.
+    colors: list màu BGR theo từng box (mặc định xanh lá);
+    label_bg: vẽ nền màu dưới nhãn, chữ trắng.
+    """
     out = image_bgr.copy()
+    font = cv2.FONT_HERSHEY_SIMPLEX
     for i, b in enumerate(boxes):
         x1,y1,x2,y2 = map(int, b)
         label = names[int(labels[i])]
         conf = float(confs[i])
-        cv2.rectangle(out, (x1,y1), (x2,y2), (0,255,0), 2)
-        cv2.putText(out, f"{label} {conf:.2f}", (x1, max(y1-8, 12)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0,255,0), 2, lineType=cv2.LINE_AA)
-    if len(boxes) == 0:
-        cv2.putText(out, "No findings", (18, 28),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+        color = tuple(int(c) for c in colors[i]) if colors is not None else (0,255,0)
+        text = label_fmt.format(label=label, conf=conf, pct=conf * 100)
+        cv2.rectangle(out, (x1,y1), (x2,y2), color, thickness)
+        if label_bg:
+            (tw, th), base = cv2.getTextSize(text, font, font_scale, 1)
+            ty = max(y1, th + base + 4)
+            cv2.rectangle(out, (x1, ty - th - base - 4), (x1 + tw + 4, ty), color, -1)
+            cv2.putText(out, text, (x1 + 2, ty - base - 2), font, font_scale, (255,255,255), 1, lineType=cv2.LINE_AA)
+        else:
+            cv2.putText(out, text, (x1, max(y1-8, 12)), font, font_scale, color, 2, lineType=cv2.LINE_AA)
+    if len(boxes) == 0 and empty_text:
+        cv2.putText(out, empty_text, (18, 28), font, 0.9, (0, 0, 255), 2)
     return out
 
 def save_image(image_bgr: np.ndarray, out_path: Path) -> None:
@@ -47,6 +47,12 @@ def fail(message="Lỗi không xác định", status_code=400, errors=None, **ex
     resp = make_response(jsonify(payload), status_code)
     return _corsify(resp)
 
+def too_busy(message="Hệ thống đang quá tải, vui lòng thử lại sau.", retry_after=1, **extra):
+    """429 kèm header Retry-After (giây) để client tự lùi lại."""
+    resp = fail(message=message, status_code=429, retry_after=retry_after, **extra)
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
 # Tương thích ngược: ok()/error() dùng ở code cũ
 def ok(data=None, code=200, message="OK", **extra):
     return success(data=data, message=message, status_code=code, **extra)
@@ -0,0 +1,64 @@
+# backend/app/utils/xray_render.py
+"""
+Vẽ kết quả X-ray (bbox + nhãn) trong 1 lượt bằng cv2 trên ndarray BGR.
+
+- Màu theo label: bảng màu cache (ổn định giữa các process, không phụ thuộc hash() ngẫu nhiên).
+- Font cv2 Hershey là hằng số → không phải load font mỗi lần vẽ.
+"""
+from __future__ import annotations
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.image_utils import annotate_bboxes
+
+
+@lru_cache(maxsize=256)
+def color_for(label: str) -> Tuple[int, int, int]:
+    """Màu RGB ổn định theo label (50..254 mỗi kênh để chữ trắng dễ đọc)."""
+    h = zlib.crc32(label.encode("utf-8"))
+    return (50 + (h & 0xFF) % 205, 50 + ((h >> 8) & 0xFF) % 205, 50 + ((h >> 16) & 0xFF) % 205)
+
+
+def style_for(width: int, height: int) -> Tuple[int, float]:
+    """(thickness, font_scale) scale theo kích thước ảnh."""
+    m = min(width, height)
+    return max(2, int(m * 0.004)), max(0.4, m / 1000.0 * 0.6)
+
+
+def render_predictions(
+    image_bgr: np.ndarray,
+    preds: Sequence[Dict[str, Any]],
+    boxes: Optional[List[Sequence[float]]] = None,
+) -> np.ndarray:
+    """
+    Vẽ mọi box có trong preds lên bản sao ảnh (BGR) bằng 1 lần `annotate_bboxes`.
+    boxes: xyxy đã chuẩn hoá theo từng pred (None → lấy pred["box"]); box None bị bỏ qua.
+    """
+    H, W = image_bgr.shape[:2]
+    thickness, font_scale = style_for(W, H)
+    boxes = boxes if boxes is not None else [p.get("box") for p in preds]
+
+    xyxy, names, confs, colors = [], [], [], []
+    for p, box in zip(preds, boxes):
+        if not box or len(box) != 4:
+            continue
+        label = str(p.get("label", "Unknown"))
+        xyxy.append(box)
+        names.append(label)
+        confs.append(float(p.get("prob", 0.0)))
+        r, g, b = color_for(label)
+        colors.append((b, g, r))          # cv2 dùng BGR
+
+    labels = range(len(names))            # mỗi box 1 tên riêng
+    return annotate_bboxes(
+        image_bgr, xyxy, labels, confs, names,
+        colors=colors,
+        thickness=thickness,
+        font_scale=font_scale,
+        label_bg=True,
+        label_fmt="{label} {pct:.1f}%",
+        empty_text=None,
+    )
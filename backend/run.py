@@ -1,32 +1,43 @@
 # backend/run.py
-from app.main import create_app, socketio
-from app.model.appointments import AppointmentModel
-from app.tasks.expire_hold import init_scheduler
-
-app = create_app()
-
-# Khởi tạo database indexes
-with app.app_context():
-    print("🔧 Initializing database indexes...")
-    AppointmentModel.ensure_indexes()
-    print("✅ Database indexes initialized\n")
-
-# Khởi động background scheduler
-print("🚀 Starting background scheduler...")
-scheduler = init_scheduler()
-
-# Setup SocketIO
-socketio.init_app(
-    app,
-    async_mode="threading",
-    cors_allowed_origins=[
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-    ],
-    allow_upgrades=False,
-    ping_interval=25,
-    ping_timeout=20,
-)
+
+
+def _bootstrap():
+    from app.main import create_app, socketio
+    from app.model.appointments import AppointmentModel
+    from app.tasks.expire_hold import init_scheduler
+
+    app = create_app()
+
+    # Khởi tạo database indexes
+    with app.app_context():
+        print("🔧 Initializing database indexes...")
+        AppointmentModel.ensure_indexes()
+        print("✅ Database indexes initialized\n")
+
+    # Khởi động background scheduler
+    print("🚀 Starting background scheduler...")
+    scheduler = init_scheduler()
+
+    # Setup SocketIO
+    socketio.init_app(
+        app,
+        async_mode="threading",
+        cors_allowed_origins=[
+            "http://localhost:3000",
+            "http://127.0.0.1:3000",
+        ],
+        allow_upgrades=False,
+        ping_interval=25,
+        ping_timeout=20,
+    )
+    return app, scheduler
+
+
+# Worker của YOLO pool (forkserver/spawn) import lại file này dưới tên __mp_main__
+# → không monkey-patch / tạo app / scheduler thứ hai trong worker
+if __name__ != "__mp_main__":
+    from app.main import socketio
+    app, scheduler = _bootstrap()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,91 @@
+# backend/scripts/benchmark_yolo_backends.py
+"""
+So sánh tốc độ các backend YOLO (torch vs onnx) trên 1 thư mục ảnh mẫu.
+
+Chạy từ thư mục backend:
+    python scripts/benchmark_yolo_backends.py path/to/samples --imgsz 640 --batch 4 --runs 3
+"""
+from __future__ import annotations
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import cv2  # noqa: E402
+
+from app.services import yolo_service  # noqa: E402
+from app.utils.image_utils import resize_max  # noqa: E402
+
+EXTS = {".png", ".jpg", ".jpeg"}
+
+
+def _load_images(folder: Path, max_size: int):
+    images = []
+    for p in sorted(folder.iterdir()):
+        if p.suffix.lower() in EXTS:
+            img = cv2.imread(str(p))
+            if img is not None:
+                images.append(resize_max(img, max_size))
+    return images
+
+
+def _bench(backend: str, images, imgsz: int, batch: int, runs: int, conf: float, iou: float):
+    # warm-up (load model / export onnx + 1 lượt chạy)
+    yolo_service.infer_batch(images[:1], conf=conf, iou=iou, imgsz=imgsz, backend=backend)
+
+    latencies = []   # ms / batch
+    n_dets = 0
+    t_total = time.perf_counter()
+    for _ in range(runs):
+        for i in range(0, len(images), batch):
+            chunk = images[i:i + batch]
+            t0 = time.perf_counter()
+            out = yolo_service.infer_batch(chunk, conf=conf, iou=iou, imgsz=imgsz, backend=backend)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            n_dets += sum(len(preds) for preds, _ in out)
+    elapsed = time.perf_counter() - t_total
+
+    latencies.sort()
+    n = len(images) * runs
+    return {
+        "backend": backend,
+        "images": n,
+        "img_per_s": n / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "dets_per_img": n_dets / n if n else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark YOLO backends (torch vs onnx)")
+    ap.add_argument("folder", type=Path, help="Thư mục ảnh mẫu (.png/.jpg)")
+    ap.add_argument("--backends", default="torch,onnx")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--max-size", type=int, default=1024, help="Giống MAX_IMAGE_SIZE")
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--iou", type=float, default=0.45)
+    args = ap.parse_args()
+
+    images = _load_images(args.folder, args.max_size)
+    if not images:
+        sys.exit(f"Không có ảnh trong {args.folder}")
+    print(f"{len(images)} ảnh, imgsz={args.imgsz}, batch={args.batch}, runs={args.runs}\n")
+
+    print(f"{'backend':<8} {'img/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'dets/img':>9}")
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            r = _bench(backend, images, args.imgsz, args.batch, args.runs, args.conf, args.iou)
+        except Exception as e:
+            print(f"{backend:<8} lỗi: {e}")
+            continue
+        print(f"{r['backend']:<8} {r['img_per_s']:>8.2f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['dets_per_img']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# backend/scripts/check_llm_routing.py
+"""
+Kiểm tra định tuyến LLM_ROUTES qua FakeProvider (không gọi mạng, không cần API key).
+
+Chạy từ thư mục backend:
+    python scripts/check_llm_routing.py
+Thoát với mã 1 nếu có kiểm tra sai.
+"""
+from __future__ import annotations
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# phải đặt trước khi import app: suggestions/specialty → fake, còn lại → gemini
+os.environ["LLM_ROUTES"] = "suggestions=fake,specialty=fake"
+os.environ["LLM_DEFAULT_PROVIDER"] = "gemini"
+os.environ["GEMINI_CACHE_TTL"] = "0"  # không đọc/ghi cache one-shot
+
+from app.services import llm_providers  # noqa: E402
+from app.services.gemini_service import gemini_chat  # noqa: E402
+
+
+def main():
+    failures = []
+
+    def check(name, cond):
+        print(f"{'✅' if cond else '❌'} {name}")
+        if not cond:
+            failures.append(name)
+
+    check("LLMProvider là abstract", _is_abstract())
+    check("suggestions → FakeProvider", isinstance(llm_providers.get_provider("suggestions"), llm_providers.FakeProvider))
+    check("chat → GeminiProvider", llm_providers.get_provider("chat").name == llm_providers.GEMINI)
+    table = llm_providers.routing_table()
+    check("routing_table", table["suggestions"] == "fake" and table["doctor_advisor"] == "gemini")
+
+    a = gemini_chat("Tôi bị ho 3 ngày", use_case="suggestions")
+    b = gemini_chat("Tôi bị ho 3 ngày", use_case="suggestions")
+    c = gemini_chat("Tôi bị sốt", use_case="suggestions")
+    check("gemini_chat đi qua FakeProvider", a.startswith("Câu hỏi mẫu"))
+    check("cùng prompt → cùng trả lời", a == b)
+    check("khác prompt → khác trả lời", a != c)
+
+    if failures:
+        sys.exit(1)
+
+
+def _is_abstract() -> bool:
+    try:
+        llm_providers.LLMProvider()
+    except TypeError:
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+"""Chạy từ thư mục backend: python -m pytest -q tests"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,63 @@
+# backend/tests/test_cache_tags.py
+"""invalidate_tags + bỏ ghi kết quả cũ (stale write) trên memory fallback (không cần Redis)."""
+import pytest
+
+from app.services import redis_cache
+from app.services.redis_cache import CacheService, doctor_tag
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(redis_cache, "get_redis_client", lambda: None)
+    return CacheService()
+
+
+def test_invalidate_tags_drops_only_tagged_keys(cache):
+    cache.set("appointments:doctor:1", [1, 2], ttl=60, tags=["appointments", doctor_tag("1")])
+    cache.set("appointments:doctor:2", [3], ttl=60, tags=["appointments", doctor_tag("2")])
+    cache.set("stats:global", {"n": 3}, ttl=60, tags=["stats"])
+
+    assert cache.invalidate_tags(doctor_tag("1")) == 1
+    assert cache.get("appointments:doctor:1") is None
+    assert cache.get("appointments:doctor:2") == [3]
+
+    cache.invalidate_tags("appointments")
+    assert cache.get("appointments:doctor:2") is None
+    assert cache.get("stats:global") == {"n": 3}
+
+
+def test_get_or_compute_caches_value(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"total": 5}
+
+    assert cache.get_or_compute("stats:doctor:1", compute, ttl=60, tags=["stats"]) == {"total": 5}
+    assert cache.get_or_compute("stats:doctor:1", compute, ttl=60, tags=["stats"]) == {"total": 5}
+    assert len(calls) == 1
+
+
+def test_write_after_concurrent_invalidation_is_dropped(cache):
+    def compute():
+        # ghi DB + invalidate xảy ra trong lúc đang tính → giá trị vừa tính đã cũ
+        cache.invalidate_tags("stats")
+        return {"total": 1}
+
+    assert cache.get_or_compute("stats:doctor:1", compute, ttl=60, tags=["stats"]) == {"total": 1}
+    assert cache.get("stats:doctor:1") is None
+    assert cache.stale_skips == 1
+
+    # lần sau không bị invalidate giữa chừng → được cache bình thường
+    assert cache.get_or_compute("stats:doctor:1", lambda: {"total": 2}, ttl=60, tags=["stats"]) == {"total": 2}
+    assert cache.get("stats:doctor:1") == {"total": 2}
+
+
+def test_untagged_invalidation_does_not_block_write(cache):
+    def compute():
+        cache.invalidate_tags("ratings")
+        return [1]
+
+    cache.get_or_compute("appointments:doctor:1", compute, ttl=60, tags=["appointments"])
+    assert cache.get("appointments:doctor:1") == [1]
+    assert cache.stale_skips == 0
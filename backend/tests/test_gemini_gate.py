@@ -0,0 +1,68 @@
+# backend/tests/test_gemini_gate.py
+"""GeminiGate: hàng chờ đầy → AIBusyError → 429 + Retry-After."""
+import threading
+
+import pytest
+from flask import Flask
+
+from app.services.gemini_client import AIBusyError, GeminiGate
+from app.utils.errors import register_error_handlers
+from app.utils.responses import too_busy
+
+
+def test_slot_rejects_when_queue_full():
+    gate = GeminiGate(max_concurrency=1, max_queue=0, queue_timeout=0.05)
+    with gate.slot():
+        with pytest.raises(AIBusyError) as exc:
+            with gate.slot():
+                pass
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after >= 1
+    assert gate.stats()["rejected"] == 1
+    assert gate.stats()["active"] == 0
+
+
+def test_slot_times_out_in_queue():
+    gate = GeminiGate(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    held, release = threading.Event(), threading.Event()
+
+    def _hold():
+        with gate.slot():
+            held.set()
+            release.wait(2)
+
+    worker = threading.Thread(target=_hold)
+    worker.start()
+    held.wait(2)
+    try:
+        with pytest.raises(AIBusyError):
+            with gate.slot():
+                pass
+        assert gate.stats()["waiting"] == 0
+    finally:
+        release.set()
+        worker.join(2)
+    assert gate.stats()["active"] == 0
+    assert gate.has_capacity()
+
+
+def test_busy_error_maps_to_429_with_retry_after():
+    app = Flask(__name__)
+    register_error_handlers(app)
+
+    @app.route("/busy")
+    def busy():
+        raise AIBusyError(retry_after=7)
+
+    resp = app.test_client().get("/busy")
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "7"
+
+
+def test_too_busy_sets_retry_after_header():
+    app = Flask(__name__)
+    with app.test_request_context():
+        resp = too_busy("busy", 3)
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "3"
+        assert resp.get_json()["retry_after"] == 3
@@ -0,0 +1,50 @@
+# backend/tests/test_llm_providers.py
+"""Định tuyến LLM_ROUTES → provider; mọi provider đi qua slot của gemini_gate."""
+import pytest
+
+from app.services import gemini_service, llm_providers
+from app.services.gemini_client import AIBusyError, GeminiGate
+
+
+@pytest.fixture
+def fake_routes(monkeypatch):
+    monkeypatch.setenv("LLM_ROUTES", "suggestions=fake,specialty=fake")
+    monkeypatch.setenv("LLM_DEFAULT_PROVIDER", "gemini")
+    monkeypatch.setenv("FAKE_LLM_LATENCY_MS", "0")
+
+
+def test_llm_provider_is_abstract():
+    with pytest.raises(TypeError):
+        llm_providers.LLMProvider()
+
+
+def test_routes_pick_provider_per_use_case(fake_routes):
+    assert isinstance(llm_providers.get_provider("suggestions"), llm_providers.FakeProvider)
+    assert isinstance(llm_providers.get_provider("chat"), gemini_service.GeminiProvider)
+    table = llm_providers.routing_table()
+    assert table["suggestions"] == "fake"
+    assert table["doctor_advisor"] == "gemini"
+
+
+def test_unknown_provider_falls_back_to_gemini(monkeypatch):
+    monkeypatch.setenv("LLM_ROUTES", "summary=nope")
+    assert llm_providers.get_provider("summary").name == llm_providers.GEMINI
+
+
+def test_gemini_chat_goes_through_fake_provider(fake_routes):
+    a = gemini_service.gemini_chat("Tôi bị ho 3 ngày", use_case="suggestions", cache_response=False)
+    b = gemini_service.gemini_chat("Tôi bị ho 3 ngày", use_case="suggestions", cache_response=False)
+    c = gemini_service.gemini_chat("Tôi bị sốt", use_case="suggestions", cache_response=False)
+    assert a.startswith("Câu hỏi mẫu")
+    assert a == b
+    assert a != c
+
+
+def test_fake_provider_takes_a_gate_slot(fake_routes, monkeypatch):
+    gate = GeminiGate(max_concurrency=1, max_queue=0, queue_timeout=0.05)
+    monkeypatch.setattr(gemini_service, "gemini_gate", gate)
+    with gate.slot():
+        with pytest.raises(AIBusyError):
+            gemini_service.gemini_chat("Tôi bị ho", use_case="suggestions", cache_response=False)
+    assert gate.stats()["rejected"] == 1
+    assert gemini_service.gemini_chat("Tôi bị ho", use_case="suggestions", cache_response=False)